@@ -0,0 +1,189 @@
+import os
+import sys
+import atexit
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import click
+import tabulate
+from pathlib import Path
+
+# Keep the benchmark away from the real Stash config, before stash_basic reads it
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="stash-bench-config-")
+atexit.register(shutil.rmtree, os.environ["XDG_CONFIG_HOME"], ignore_errors=True)
+
+from click.testing import CliRunner
+from stash_basic import backends, utils
+from stash_basic.main import cli
+import generate
+
+
+# -------------------- BENCHMARK SETTINGS --------------------
+# Ledger sizes as (accounts, transactions)
+SIZES = {
+    "1k": (10, 1_000),
+    "10k": (100, 10_000),
+    "100k": (1_000, 100_000),
+    "1m": (100_000, 1_000_000)
+}
+BASELINE_FILE = Path(__file__).with_name("baseline.json")
+
+def command_lines(target: str, run: int, delete_ids: list) -> dict:
+
+    '''
+    Returns the arguments (and confirmation input) of every benchmarked
+    command for one run. Commands that change the ledger get distinct
+    arguments on every run.
+    '''
+
+    return {
+        "accounts add": (["accounts", "add", f"Bench User {run}", "bench@example.com", "1985-06-15"], None),
+        "accounts summary": (["accounts", "summary"], None),
+        "accounts statement": (["accounts", "statement", target], None),
+        "transactions credit": (["transactions", "credit", target, "125.50"], None),
+        "transactions debit": (["transactions", "debit", target, "20.25"], None),
+        "transactions delete": (["transactions", "delete", target, str(delete_ids[run])], "y\n")
+    }
+
+def invoke(runner: CliRunner, args: list, input: str | None) -> float:
+
+    '''
+    Runs one command in-process and returns its wall time in seconds.
+    '''
+
+    start = time.perf_counter()
+    result = runner.invoke(cli, args, input=input, catch_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    if result.exit_code != 0 or "ERROR:" in result.output:
+        raise click.ClickException(f"`stash {' '.join(args)}` failed: {result.exception or result.output.strip()}")
+
+    return elapsed
+
+def bench_size(size: str, backend: str, compact: bool, repeat: int) -> dict:
+
+    '''
+    Generates a ledger of the given size and benchmarks every command on it.
+    The wall time is the fastest of repeat runs, the peak memory is measured
+    with tracemalloc in one more run, so it does not slow down the timed runs.
+    '''
+
+    folder = tempfile.mkdtemp(prefix=f"stash-bench-{size}-")
+    try:
+        return _bench_ledger(folder, size, backend, compact, repeat)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def _bench_ledger(folder: str, size: str, backend: str, compact: bool, repeat: int) -> dict:
+    account_count, transaction_count = SIZES[size]
+    config = {
+        "path": Path(os.path.join(folder, "records" + backends.BACKENDS[backend].extension)).as_posix(),
+        "currency": "€",
+        "backend": backend,
+        "journal": False,
+        "compact": compact
+    }
+    generate.write_ledger(config, generate.generate_accounts(account_count, transaction_count))
+    utils.save_config(config)
+
+    # Size on disk, a file or the sharded backend's directory
+    files = [Path(config["path"])] + list(Path(config["path"]).rglob("*"))
+    results = {"ledger size": {"mb": round(sum(path.stat().st_size for path in files if path.is_file()) / 2**20, 2)}}
+
+    # The first account's oldest transactions are deleted, one per run
+    target = generate.account_id(0)
+    delete_ids = [transaction["transaction_id"] for transaction in backends.get_backend(config, local=True).iter_transactions(target, limit=repeat + 1)]
+    if len(delete_ids) < repeat + 1:
+        raise click.UsageError(f"Size {size} has too few transactions per account for --repeat {repeat}.")
+
+    runner = CliRunner()
+
+    for run in range(repeat + 1):
+        for command, (args, input) in command_lines(target, run, delete_ids).items():
+            if run < repeat:
+                elapsed = invoke(runner, args, input)
+                results.setdefault(command, {"seconds": elapsed})
+                results[command]["seconds"] = min(results[command]["seconds"], elapsed)
+            else:
+                tracemalloc.start()
+                invoke(runner, args, input)
+                results[command]["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                tracemalloc.stop()
+
+    return results
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+
+    '''
+    Returns the table rows of the results, each compared with the baseline.
+    A command regressed if its time or peak memory grew by more than tolerance.
+    '''
+
+    rows = []
+    for key, commands in current.items():
+        for command, metrics in commands.items():
+            if "seconds" not in metrics:
+                continue
+
+            before = baseline.get(key, {}).get(command)
+            change = ""
+            status = click.style("NEW", fg="blue")
+
+            if before:
+                change = f"{(metrics['seconds'] / before['seconds'] - 1) * 100:+.0f}%"
+                regressed = (
+                    metrics["seconds"] > before["seconds"] * (1 + tolerance)
+                    or metrics["peak_mb"] > before["peak_mb"] * (1 + tolerance)
+                )
+                status = click.style("REGRESSION", fg="red") if regressed else click.style("OK", fg="green")
+
+            rows.append([key, command, f"{metrics['seconds'] * 1000:.1f} ms", f"{metrics['peak_mb']:.2f} MB", change, status])
+
+    return rows
+
+
+@click.command()
+@click.option("--size", "sizes", type=click.Choice(list(SIZES)), multiple=True, help="Ledger sizes to benchmark. Repeat for several. Defaults to all but 1m.")
+@click.option("--backend", type=click.Choice(list(backends.BACKENDS)), default="json", show_default=True, help="The storage engine to benchmark.")
+@click.option("--compact", is_flag=True, help="Use the compact storage format.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3, show_default=True, help="Timed runs per command, the fastest one counts.")
+@click.option("--baseline", "baseline_file", type=click.Path(dir_okay=False), default=str(BASELINE_FILE), show_default=True, help="JSON file with the baseline results.")
+@click.option("--tolerance", type=click.FLOAT, default=0.25, show_default=True, help="Allowed slowdown (or memory growth) before a command counts as a regression.")
+@click.option("--save", is_flag=True, help="Store the results as the new baseline.")
+def bench(sizes: tuple, backend: str, compact: bool, repeat: int, baseline_file: str, tolerance: float, save: bool):
+    '''
+    Benchmarks every Stash command on synthetic ledgers of growing size.
+
+    Exits with status 1 if any command regressed against the baseline.
+    '''
+
+    baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, "r") as file:
+            baseline = json.load(file)
+
+    current = {}
+    for size in sizes or [size for size in SIZES if size != "1m"]:
+        key = f"{backend}{'+compact' if compact else ''}:{size}"
+        click.echo(f"-- Benchmarking {click.style(key, fg='cyan')} ...", err=True)
+        current[key] = bench_size(size, backend, compact, repeat)
+
+    rows = compare(current, baseline, tolerance)
+    click.echo(tabulate.tabulate(rows, ["ledger", "command", "time", "peak memory", "vs. baseline", "status"], tablefmt="grid"))
+
+    for key, commands in current.items():
+        click.echo(f"-- {key} ledger size: {click.style(str(commands['ledger size']['mb']) + ' MB', fg='yellow')}")
+
+    if save:
+        utils.atomic_write(baseline_file, json.dumps(dict(baseline, **current), indent=2))
+        click.echo(click.style(f"Saved the results as the baseline in {baseline_file}", fg="green"))
+
+    if any("REGRESSION" in click.unstyle(row[-1]) for row in rows):
+        click.echo(click.style("Some commands regressed against the baseline.", fg="red"))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    bench()
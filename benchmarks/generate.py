@@ -0,0 +1,119 @@
+import os
+import json
+import random
+import click
+from pathlib import Path
+from datetime import datetime, timedelta
+from stash_basic import backends, columns, ids, utils
+
+
+# -------------------- GENERATOR SETTINGS --------------------
+FIRST_DAY = datetime(2020, 1, 1)
+DAYS = 5 * 365
+DESCRIPTIONS = ["Amount CREDITED.", "Amount DEBITED.", "Groceries", "Rent", "Salary", "Coffee", "Refund", "Transfer"]
+
+def holder(number: int) -> tuple:
+
+    '''
+    Returns the full name and date of birth of the generated account with the given number.
+    '''
+
+    return f"Holder {number:06d}", datetime(1990, 1, 1) + timedelta(days=number % 3650)
+
+def account_id(number: int) -> str:
+
+    '''
+    Returns the ID of the generated account with the given number, the same
+    way `stash accounts add` would create it.
+    '''
+
+    return utils.create_unique_id(*holder(number))
+
+def generate_accounts(account_count: int, transaction_count: int, seed: int = 0):
+
+    '''
+    Yields account_count accounts in the records.json schema with
+    transaction_count transactions spread evenly over them. Transaction IDs
+    follow ids.py, are unique and increase with the date within each account,
+    and balances match the transactions. The same seed gives the same ledger.
+    '''
+
+    generator = random.Random(seed)
+    # A sequence of its own instead of the shared one, to stay reproducible
+    sequence = 0
+
+    for number in range(account_count):
+        count = transaction_count // account_count + (1 if number < transaction_count % account_count else 0)
+        moments = sorted(FIRST_DAY + timedelta(seconds=generator.randrange(DAYS * 86400)) for _ in range(count))
+
+        transactions = []
+        for moment in moments:
+            transaction_type = "CREDIT" if generator.random() < 0.6 else "DEBIT"
+            transactions.append({
+                "transaction_id": ids.milliseconds(moment) << ids.SEQUENCE_BITS | sequence & ids.SEQUENCE_MASK,
+                "date": moment.strftime("%d-%m-%Y"),
+                "time": moment.strftime("%H:%M:%S"),
+                "description": generator.choice(DESCRIPTIONS),
+                "type": transaction_type,
+                "amount": generator.randrange(1, 500_000) / 100
+            })
+            sequence += 1
+
+        full_name, dob = holder(number)
+        yield {
+            "full_name": full_name,
+            "email": f"holder{number:06d}@example.com",
+            "dob": dob.strftime("%Y-%m-%d"),
+            "id": account_id(number),
+            "balance": backends.balance_of(transactions),
+            "transactions": transactions
+        }
+
+def write_ledger(config: dict, accounts) -> None:
+
+    '''
+    Creates the ledger described by config from the generated accounts. JSON
+    ledgers are written one account at a time, so even the largest sizes
+    never hold the whole ledger in memory.
+    '''
+
+    if config["backend"] != backends.JsonBackend.name:
+        backend = backends.get_backend(config, local=True)
+        backend.create()
+        backend.load(list(accounts))
+        backend.close()
+        return
+
+    with open(config["path"], "w") as json_file:
+        json_file.write("[")
+        for i, account in enumerate(accounts):
+            if config.get("compact"):
+                account["transactions"] = columns.encode(account["transactions"])
+                data = json.dumps(account, separators=(",", ":"), ensure_ascii=True)
+            else:
+                data = json.dumps(account, indent=2, ensure_ascii=True)
+            json_file.write(("," if i else "") + "\n" + data)
+        json_file.write("\n]")
+
+
+@click.command()
+@click.argument("folder_path", type=click.Path(file_okay=False, dir_okay=True))
+@click.option("--accounts", "account_count", type=click.IntRange(min=1), default=10, show_default=True, help="Number of accounts.")
+@click.option("--transactions", "transaction_count", type=click.IntRange(min=0), default=1000, show_default=True, help="Number of transactions over all accounts.")
+@click.option("--backend", type=click.Choice(list(backends.BACKENDS)), default="json", show_default=True, help="The storage engine to write.")
+@click.option("--compact", is_flag=True, help="Use the compact storage format.")
+@click.option("--seed", type=click.INT, default=0, show_default=True, help="Seed of the random generator.")
+def generate(folder_path: str, account_count: int, transaction_count: int, backend: str, compact: bool, seed: int):
+    '''
+    Generates a synthetic ledger for benchmarks in FOLDER_PATH.
+    '''
+
+    Path(folder_path).mkdir(parents=True, exist_ok=True)
+    path = Path(os.path.join(folder_path, "records" + backends.BACKENDS[backend].extension)).resolve().as_posix()
+
+    write_ledger({"path": path, "backend": backend, "compact": compact}, generate_accounts(account_count, transaction_count, seed))
+    click.echo(click.style(f"Generated {account_count} accounts with {transaction_count} transactions in {path}", fg="green"))
+
+
+if __name__ == "__main__":
+    generate()
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import click
+
+
+# -------------------- STARTUP SETTINGS --------------------
+# Modules that `stash --help` must not import, they belong to single commands
+LAZY_MODULES = [
+    "tabulate",
+    "sqlite3",
+    "asyncio",
+    "stash_basic.accounts_handler",
+    "stash_basic.transactions_handler",
+    "stash_basic.importer",
+    "stash_basic.initializer",
+    "stash_basic.migrator",
+    "stash_basic.server",
+    "stash_basic.cache",
+    "stash_basic.archive",
+    "stash_basic.search",
+    "stash_basic.ids",
+    "stash_basic.balances",
+    "stash_basic.reports",
+    "numpy",
+    "stash_basic.exporter",
+    "stash_basic.verifier",
+    "stash_basic.scheduler",
+    "stash_basic.backends"
+]
+
+LIST_MODULES = '''
+import sys, json
+from stash_basic.main import cli
+try:
+    cli(["--help"])
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+'''
+
+def run_stash(args: list, env: dict) -> subprocess.CompletedProcess:
+
+    '''
+    Runs `stash` with args in a fresh Python process.
+    '''
+
+    return subprocess.run(
+        [sys.executable, "-c", "from stash_basic.main import cli; cli()"] + args,
+        env=env, capture_output=True, text=True
+    )
+
+def import_time_ms(env: dict) -> float:
+
+    '''
+    Returns the cumulative import time of stash_basic.main as reported by -X importtime.
+    '''
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import stash_basic.main"], env=env, capture_output=True, text=True)
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == "stash_basic.main":
+            return int(parts[1]) / 1000
+
+    raise click.ClickException(f"Could not import stash_basic.main: {result.stderr.strip()}")
+
+
+@click.command()
+@click.option("--budget", type=click.FLOAT, default=150.0, show_default=True, help="Milliseconds `stash --help` may take from process start to exit.")
+@click.option("--import-budget", type=click.FLOAT, default=80.0, show_default=True, help="Milliseconds importing stash_basic.main may take.")
+@click.option("--runs", type=click.IntRange(min=1), default=5, show_default=True, help="Measurements per check, the fastest one counts.")
+def startup(budget: float, import_budget: float, runs: int):
+    '''
+    Checks that starting `stash` stays within its time budget and that
+    `stash --help` imports none of the command modules.
+
+    Exits with status 1 if a check fails.
+    '''
+
+    # An empty config directory, so nothing depends on the local setup
+    env = dict(os.environ, XDG_CONFIG_HOME=tempfile.mkdtemp(prefix="stash-startup-"))
+    failures = []
+
+    # Modules loaded by `stash --help`
+    result = subprocess.run([sys.executable, "-c", LIST_MODULES], env=env, capture_output=True, text=True)
+    loaded = set(json.loads(result.stderr.splitlines()[-1]))
+    eager = [module for module in LAZY_MODULES if module in loaded]
+    if eager:
+        failures.append(f"`stash --help` imports {', '.join(eager)}")
+
+    # Import time of the entry point
+    import_ms = min(import_time_ms(env) for _ in range(runs))
+    if import_ms > import_budget:
+        failures.append(f"importing stash_basic.main took {import_ms:.1f} ms (budget {import_budget:.0f} ms)")
+
+    # Wall time of the whole process
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run_stash(["--help"], env)
+        timings.append((time.perf_counter() - start) * 1000)
+    help_ms = min(timings)
+    if help_ms > budget:
+        failures.append(f"`stash --help` took {help_ms:.1f} ms (budget {budget:.0f} ms)")
+
+    click.echo(f"-- Import stash_basic.main: {click.style(f'{import_ms:.1f} ms', fg='cyan')} (budget {import_budget:.0f} ms)")
+    click.echo(f"-- stash --help: {click.style(f'{help_ms:.1f} ms', fg='cyan')} (budget {budget:.0f} ms)")
+    click.echo(f"-- Modules loaded by stash --help: {click.style(str(len(loaded)), fg='cyan')}")
+
+    if failures:
+        for failure in failures:
+            click.echo(f"{click.style('ERROR:', bg='red')} {failure}")
+        sys.exit(1)
+
+    click.echo(click.style("Startup is within budget.", fg="green"))
+
+
+if __name__ == "__main__":
+    startup()
@@ -1,7 +1,22 @@
 import click
 import tabulate
-import json
-from stash_basic import utils
+import itertools
+from stash_basic import utils, backends, statements, tracing
+
+def new_account(full_name: str, email: str, dob) -> dict:
+
+    '''
+    Creates an account object/dictionary with no transactions.
+    '''
+
+    account = {}
+    account["full_name"] = full_name
+    account["email"] = email
+    account["dob"] = dob.strftime("%Y-%m-%d")
+    account["id"] = utils.create_unique_id(full_name, dob)
+    account["balance"] = 0.0
+    account["transactions"] = []
+    return account
 
 @click.command()
 @click.argument("full_name", type=click.STRING)
@@ -20,25 +35,14 @@ def add(obj: dict, full_name: str, email: str, dob: click.DateTime):
     '''
 
     # Populate the account object/dictionary
-    account = {}
-    account["full_name"] = full_name
-    account["email"] = email
-    account["dob"] = dob.strftime("%Y-%m-%d")
-    account["id"] = utils.create_unique_id(full_name, dob)
-    account["balance"] = 0.0
-    account["transactions"] = []
+    account = new_account(full_name, email, dob)
     
-    # Read the current JSON file and retreive the contents
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
-
-    # Append the current account to the existing contents
-    if not utils.is_duplicate_account(contents, full_name, dob):
-        contents.append(account)
+    # Open the storage backend
+    backend = backends.get_backend(obj)
 
-        # Write back the new data
-        with open(obj["path"], "w") as new_json:
-            json.dump(contents, new_json, indent=2, ensure_ascii=True)
+    # Add the current account to the existing accounts
+    if not utils.is_duplicate_account(backend, full_name, dob):
+        backend.add_account(account)
         
         # Display to console
         click.echo("\n")
@@ -67,19 +71,12 @@ def delete(obj: dict, id: str):
     ID is the unique identifier for the account.
     '''
 
-    # Load the contents from the JSON
-    with open(obj["path"], 'r') as json_file:
-        contents = json.load(json_file)
-
     # Search for the account to delete
-    account_index = -1
-    for i, account in enumerate(contents):
-        if account["id"] == id:
-            account_index = account_index + i + 1
-            break
+    backend = backends.get_backend(obj)
+    account = backend.get_account(id, transactions=False)
     
     # If account does not exist
-    if account_index == -1:
+    if account is None:
         click.echo(f"{click.style("ERROR:", fg="black", bg="red")} Cannot find the account. Please re-check the ID.")
     else:
         # Ask user via prompt for confirmation
@@ -94,27 +91,24 @@ def delete(obj: dict, id: str):
             ,tablefmt="grid"))
         
         if click.confirm("Do you want to proceed to delete the above account?"):
-            contents.pop(account_index)
-
-            # Save the new contents
-            with open(obj["path"], 'w') as new_json_file:
-                json.dump(contents, new_json_file, indent=2)
+            backend.delete_account(id)
             
             click.echo(click.style("Account removed successfully", fg="green"))
         else:
             click.echo(click.style("Account was not removed.", fg="yellow"))
 
 @click.command()
+@click.option("--check", is_flag=True, help="Recompute every balance from its transactions and flag accounts whose stored balance is off.")
 @click.pass_obj
-def summary(obj: dict):
+def summary(obj: dict, check: bool):
     '''
     Display all accounts on Stash with their details. Included details 
     are account holder's name, email, DOB and account ID.
     '''
 
-    # Load the contents of the JSON
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
+    # Load the accounts (without their transactions)
+    backend = backends.get_backend(obj)
+    contents = backend.accounts()
     
     # Ensure contents are not empty, i.e. there are no accounts in Stash
     if not contents:
@@ -125,81 +119,104 @@ def summary(obj: dict):
         table = []
         headers = []
 
+        # Only the check has to read the transactions
+        recomputed = backend.recompute_balances() if check else {}
+        mismatches = 0
+
         for account in contents:
             row = []
             for key, value in account.items():
-                if key != "transactions":
-                    if key == "balance":
-                        row.append(click.style(f"{obj["currency"]} {value}", fg="cyan"))
-                    else:
-                        row.append(value)
+                if key == "balance":
+                    row.append(click.style(f"{obj["currency"]} {value}", fg="cyan"))
+                else:
+                    row.append(value)
+
+            if check:
+                if abs(recomputed.get(account["id"], 0.0) - account["balance"]) < 0.005:
+                    row.append(click.style("OK", fg="green"))
+                else:
+                    mismatches += 1
+                    row.append(click.style(f"MISMATCH ({obj['currency']} {recomputed.get(account['id'], 0.0)})", fg="red"))
             table.append(row)
         
         # Populate headers
         for header_item in contents[0].keys():
-            if header_item != "transactions":
-                headers.append(header_item)
+            headers.append(header_item)
+        if check:
+            headers.append("check")
+
+        with tracing.phase("rendering"):
+            rendered = tabulate.tabulate(table, headers, tablefmt="grid")
 
         click.echo(click.style("Here is a summary of all accounts on Stash", fg="yellow"))
-        click.echo(tabulate.tabulate(table, headers, tablefmt="grid"))
+        click.echo(rendered)
+
+        if mismatches:
+            click.echo(f"{click.style("ERROR:", fg="black", bg="red")} {mismatches} account balance(s) do not match their transactions.")
 
 @click.command()
 @click.argument("id", type=click.STRING)
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only show transactions on or after this date (YYYY-MM-DD).")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only show transactions on or before this date (YYYY-MM-DD).")
+@click.option("--limit", type=click.IntRange(min=0), default=None, help="Show at most this many transactions.")
+@click.option("--offset", type=click.IntRange(min=0), default=0, help="Skip this many transactions first.")
+@click.option("--format", "output_format", type=click.Choice(["table", "csv", "jsonl"]), default="table", help="Output format. Defaults to table.")
+@click.option("--pager", is_flag=True, help="Show the statement in the system pager.")
+@click.option("--pending/--no-pending", default=True, help="Include scheduled postings that are due but not posted yet. Included by default.")
 @click.pass_obj
-def statement(obj: dict, id: str):
+def statement(obj: dict, id: str, since, until, limit: int | None, offset: int, output_format: str, pager: bool, pending: bool):
     '''
     Prints the account statement for an account.
 
     ID is the unique ID of the account for which you want the statement.
+
+    Transactions are streamed as they are read, so statements of any size
+    start printing right away. Transactions moved out by `stash compact` are
+    read back from the archive when the date range reaches back to them.
+    Scheduled postings that are due but not posted by `stash schedule run`
+    yet come last, marked as pending.
     '''
 
-    # Load contents
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
-    
+    # Imported here, the other account commands need neither the archive nor the schedules
+    from stash_basic import archive, scheduler
+
     # Search for the account
-    account_index = -1
-    for i, account in enumerate(contents):
-        if account["id"] == id:
-            account_index += i + 1
+    backend = backends.get_backend(obj)
+    account = backend.get_account(id, transactions=False)
     
     # Account not found
-    if account_index == -1:
+    if account is None:
         click.echo(f"{click.style("ERROR:", fg="black", bg="red")} Cannot find the account. Please re-check the ID.")
-    # Account found
+        return
+
+    since = since.strftime("%Y-%m-%d") if since else None
+    until = until.strftime("%Y-%m-%d") if until else None
+    scheduled = scheduler.pending(backend, obj["path"], [id]).get(id, []) if pending else []
+
+    if scheduled:
+        # Paged together with the posted transactions, which then cannot jump straight to the page
+        transactions = itertools.islice(
+            itertools.chain(archive.iter_statement(backend, obj["path"], id, since=since, until=until), backends.select_transactions(scheduled, since, until, 0, None)),
+            offset,
+            None if limit is None else offset + limit
+        )
     else:
-        transactions = contents[account_index]["transactions"]
+        transactions = archive.iter_statement(backend, obj["path"], id, since=since, until=until, offset=offset, limit=limit)
 
+    if output_format == "csv":
+        statements.emit(statements.render_csv(transactions), pager)
+    elif output_format == "jsonl":
+        statements.emit(statements.render_jsonl(transactions), pager)
+    else:
         # Check if transactions are empty
-        if not transactions:
+        first = next(transactions, None)
+        if first is None:
             click.echo(f"{click.style("INFO:", bg="blue")} There are no transactions to display.")
-        else:
-            table_data = []
-            table_headers = []
-
-            # Populate table_data
-            for transaction in transactions:
-                row = []
-                for key, value in transaction.items():
-                    if key == "type":
-                        row.append(click.style(f"{value}", fg="red" if value == "DEBIT" else "green"))
-                    elif key == "amount":
-                        row.append(f"{click.style(obj["currency"], fg="cyan")} {click.style(value, fg="red" if transaction["type"] == "DEBIT" else "green")}")
-                    else:
-                        row.append(value)
-                table_data.append(row)
-            
-            # Populate table_headers
-            for header_item in transactions[0].keys():
-                table_headers.append(header_item)
-            
-            # Add total balance
-            total_columns = len(transactions[0].keys())
-            data_row = [""] * total_columns
-            data_row[-1] = click.style(f"{obj["currency"]} {contents[account_index]["balance"]}", fg="yellow")
-            data_row[-2] = click.style("Total:", fg="cyan")
+            return
 
-            table_data.append(data_row)
+        # The total balance only makes sense for the complete statement
+        filtered = since or until or limit is not None or offset
+        balance = None if filtered else utils.from_cents(utils.to_cents(account["balance"]) + sum(utils.signed_cents(transaction) for transaction in scheduled))
 
-            # Display the statement
-            click.echo(tabulate.tabulate(table_data, table_headers, tablefmt="grid"))
\ No newline at end of file
+        # Display the statement
+        statements.emit(statements.render_table(itertools.chain([first], transactions), obj["currency"], balance), pager)
@@ -0,0 +1,403 @@
+import os
+import gzip
+import json
+import itertools
+import click
+from datetime import datetime, timedelta
+from stash_basic import backends, ids, tracing, utils
+
+
+# -------------------- ARCHIVE SETTINGS --------------------
+# Segments live in <ledger>.archive/, one per `stash compact`, e.g. segment-0001-before-2024-01-01.jsonl.gz
+ARCHIVE_SUFFIX = ".archive"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+PENDING_SUFFIX = ".pending"
+COMPRESS_LEVEL = 6
+
+OPENING_DESCRIPTION = "Opening balance before {before}"
+
+def archive_path(ledger_path: str) -> str:
+    return ledger_path + ARCHIVE_SUFFIX
+
+def segment_paths(ledger_path: str, pending: bool = False) -> list:
+
+    '''
+    Returns the paths of the archive segments of a ledger, oldest first. With
+    pending set, the segments of interrupted compactions instead.
+    '''
+
+    directory = archive_path(ledger_path)
+    if not os.path.isdir(directory):
+        return []
+
+    suffix = SEGMENT_SUFFIX + PENDING_SUFFIX if pending else SEGMENT_SUFFIX
+    return [
+        os.path.join(directory, file_name)
+        for file_name in sorted(os.listdir(directory))
+        if file_name.startswith(SEGMENT_PREFIX) and file_name.endswith(suffix)
+    ]
+
+def read_header(segment_path: str) -> dict:
+
+    '''
+    Returns the header of a segment (its first line): the date it was cut at
+    and, per account, the number of transactions, their first and last date
+    and the ID of the opening balance record left in the live ledger.
+    '''
+
+    with gzip.open(segment_path, "rt", encoding="utf-8") as segment_file:
+        return json.loads(segment_file.readline())
+
+def account_cuts(ledger_path: str) -> dict:
+
+    '''
+    Returns the latest cut (YYYY-MM-DD) of every account with archived transactions.
+    '''
+
+    cuts = {}
+    for segment_path in segment_paths(ledger_path):
+        header = read_header(segment_path)
+        for account_id in header["accounts"]:
+            cuts[account_id] = max(cuts.get(account_id, ""), header["before"])
+    return cuts
+
+def iter_segment(segment_path: str, account_id: str):
+
+    '''
+    Yields the archived transactions of one account from a segment.
+    '''
+
+    with gzip.open(segment_path, "rt", encoding="utf-8") as segment_file:
+        segment_file.readline()
+        for line in segment_file:
+            transaction = json.loads(line)
+            if transaction.pop("account_id") == account_id:
+                yield transaction
+
+def reached_segments(ledger_path: str, account_ids, since: str | None = None) -> list:
+
+    '''
+    Returns (path, header) of the segments with transactions of any of the
+    accounts dated from since (YYYY-MM-DD) on, oldest first.
+    '''
+
+    account_ids = set(account_ids)
+    segments = []
+    for segment_path in segment_paths(ledger_path):
+        header = read_header(segment_path)
+        if header["accounts"].keys() & account_ids and (since is None or since < header["before"]):
+            segments.append((segment_path, header))
+    return segments
+
+def segment_openings(segments: list) -> dict:
+
+    '''
+    Returns the IDs of the opening balance records that stand for the
+    segments (see reached_segments()) with their cut, per account.
+    '''
+
+    openings = {}
+    for _, header in segments:
+        for account_id, account_header in header["accounts"].items():
+            openings.setdefault(account_id, {})[account_header["opening"]] = header["before"]
+    return openings
+
+def iter_archive(segments: list, account_ids, since: str | None = None, until: str | None = None):
+
+    '''
+    Yields the archived transactions of several accounts dated from since to
+    until (inclusive YYYY-MM-DD dates), with their account_id, reading every
+    segment only once.
+    '''
+
+    account_ids = set(account_ids)
+    for segment_path, _ in segments:
+        with gzip.open(segment_path, "rt", encoding="utf-8") as segment_file:
+            segment_file.readline()
+            for line in segment_file:
+                transaction = json.loads(line)
+                if transaction["account_id"] not in account_ids:
+                    continue
+                if since is not None or until is not None:
+                    day = utils.iso_date(transaction["date"])
+                    if (since is not None and day < since) or (until is not None and day > until):
+                        continue
+                yield transaction
+
+def without_openings(transactions, openings: dict):
+
+    '''
+    Yields the live transactions of an account except the opening balance
+    records in openings (see segment_openings()), whose archived transactions
+    are read instead.
+    '''
+
+    for transaction in transactions:
+        before = openings.get(transaction["transaction_id"])
+        if before is None or not is_opening_record(transaction, transaction["transaction_id"], before):
+            yield transaction
+
+def opening_record(transaction_id: int, before: str, cents: int) -> dict:
+
+    '''
+    Returns the record that carries the balance of the archived transactions
+    forward. It is dated the last second before the cut, so date filters put
+    it on the archived side, and its ID (see split_ledger()) stands for that
+    second, so it sorts before the transactions that were kept.
+    '''
+
+    last_day = datetime.strptime(before, "%Y-%m-%d") - timedelta(days=1)
+    return {
+        "transaction_id": transaction_id,
+        "date": last_day.strftime("%d-%m-%Y"),
+        "time": "23:59:59",
+        "description": OPENING_DESCRIPTION.format(before=before),
+        "type": "DEBIT" if cents < 0 else "CREDIT",
+        "amount": utils.from_cents(abs(cents))
+    }
+
+def is_opening_record(transaction: dict | None, transaction_id: int, before: str) -> bool:
+    return (
+        transaction is not None
+        and transaction["transaction_id"] == transaction_id
+        and transaction["description"] == OPENING_DESCRIPTION.format(before=before)
+    )
+
+
+# -------------------- COMPACTION --------------------
+def split_ledger(contents: list, before: str, openings: set) -> tuple:
+
+    '''
+    Splits every account into the transactions dated before the cut
+    (YYYY-MM-DD) and the ones it keeps. The archived ones are replaced by a
+    single opening balance record, so balances stay the same.
+
+    Opening records of earlier compactions (their IDs are in openings) are
+    folded into the new opening record instead of being archived again.
+
+    Returns (the new ledger, the segment header, the archived transactions).
+    '''
+
+    live_contents = []
+    header = {"before": before, "accounts": {}}
+    archived = []
+
+    for account in contents:
+        kept, moved = [], []
+        carried_cents = 0
+        for transaction in account["transactions"]:
+            if utils.iso_date(transaction["date"]) >= before:
+                kept.append(transaction)
+                continue
+
+            carried_cents += utils.signed_cents(transaction)
+            if (account["id"], transaction["transaction_id"]) in openings:
+                # Already archived by an earlier compaction
+                continue
+            moved.append(transaction)
+
+        if not moved:
+            live_contents.append(account)
+            continue
+
+        opening = opening_record(ids.new_id(datetime.strptime(before, "%Y-%m-%d") - timedelta(seconds=1)), before, carried_cents)
+        header["accounts"][account["id"]] = {
+            "count": len(moved),
+            "first": min(utils.iso_date(transaction["date"]) for transaction in moved),
+            "last": max(utils.iso_date(transaction["date"]) for transaction in moved),
+            "opening": opening["transaction_id"]
+        }
+        archived.extend(dict(transaction, account_id=account["id"]) for transaction in moved)
+        live_contents.append(dict(account, transactions=[opening] + kept))
+
+    return live_contents, header, archived
+
+def write_segment(ledger_path: str, header: dict, transactions: list) -> str:
+
+    '''
+    Writes a new segment next to the ledger as a pending, read-only file and
+    returns its path. It only becomes part of the archive once finish_segment()
+    renames it, after the live ledger no longer has its transactions.
+    '''
+
+    directory = archive_path(ledger_path)
+    os.makedirs(directory, exist_ok=True)
+
+    number = len(segment_paths(ledger_path)) + len(segment_paths(ledger_path, pending=True)) + 1
+    path = os.path.join(directory, f"{SEGMENT_PREFIX}{number:04d}-before-{header['before']}{SEGMENT_SUFFIX}{PENDING_SUFFIX}")
+
+    with tracing.phase("serialization"):
+        with open(path, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb", compresslevel=COMPRESS_LEVEL) as segment_file:
+                segment_file.write((json.dumps(header, ensure_ascii=True) + "\n").encode("utf-8"))
+                for transaction in transactions:
+                    segment_file.write((json.dumps(transaction, ensure_ascii=True) + "\n").encode("utf-8"))
+            raw_file.flush()
+            with tracing.phase("fsync"):
+                os.fsync(raw_file.fileno())
+
+    os.chmod(path, 0o444)
+    return path
+
+def finish_segment(pending_path: str) -> str:
+    path = pending_path[:-len(PENDING_SUFFIX)]
+    utils.replace_file(pending_path, path)
+    return path
+
+def rewrite_header(segment_path: str, header: dict) -> None:
+
+    '''
+    Replaces the header of a segment, e.g. after `stash migrate-ids` gave its
+    opening records new IDs. The archived transactions are copied as they are.
+    '''
+
+    with gzip.open(segment_path, "rb") as segment_file:
+        segment_file.readline()
+        body = segment_file.read()
+
+    temp_path = segment_path + ".tmp"
+    with open(temp_path, "wb") as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode="wb", compresslevel=COMPRESS_LEVEL) as new_file:
+            new_file.write((json.dumps(header, ensure_ascii=True) + "\n").encode("utf-8"))
+            new_file.write(body)
+        raw_file.flush()
+        with tracing.phase("fsync"):
+            os.fsync(raw_file.fileno())
+
+    os.chmod(temp_path, 0o444)
+    utils.replace_file(temp_path, segment_path)
+
+def recover(ledger_path: str, backend: backends.Backend) -> list:
+
+    '''
+    Completes or rolls back compactions that were interrupted. A pending
+    segment whose opening records made it into the live ledger is added to
+    the archive, otherwise the ledger still has its transactions and the
+    segment is deleted. Returns the paths of the recovered segments.
+    '''
+
+    recovered = []
+    for pending_path in segment_paths(ledger_path, pending=True):
+        header = read_header(pending_path)
+        committed = all(
+            is_opening_record(backend.get_transaction(account_id, account_header["opening"]), account_header["opening"], header["before"])
+            for account_id, account_header in header["accounts"].items()
+        )
+
+        if committed:
+            recovered.append(finish_segment(pending_path))
+        else:
+            os.remove(pending_path)
+
+    return recovered
+
+
+# -------------------- ARCHIVE READING --------------------
+def iter_statement(backend: backends.Backend, ledger_path: str, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+
+    '''
+    Yields the transactions of an account like Backend.iter_transactions(),
+    including the archived ones when the date range reaches back before a
+    compaction. The opening balance records then make way for the archived
+    transactions they stand for.
+
+    Segments are only opened if the account has transactions in them within
+    the range, so recent statements never touch the archive.
+    '''
+
+    segments = []
+    for segment_path in segment_paths(ledger_path):
+        header = read_header(segment_path)
+        if account_id in header["accounts"]:
+            segments.append((segment_path, header["before"], header["accounts"][account_id]))
+
+    # Everything archived, opening records included, is dated before the last cut
+    reaches_archive = segments and (since is None or since < max(before for _, before, _ in segments))
+    if not reaches_archive:
+        yield from backend.iter_transactions(account_id, since=since, until=until, offset=offset, limit=limit)
+        return
+
+    openings = {account_header["opening"]: before for _, before, account_header in segments}
+
+    def archived():
+        for segment_path, _, account_header in segments:
+            if (since is None or account_header["last"] >= since) and (until is None or account_header["first"] <= until):
+                yield from backends.select_transactions(iter_segment(segment_path, account_id), since, until, 0, None)
+
+    live = (
+        transaction for transaction in backend.iter_transactions(account_id, since=since, until=until)
+        if not is_opening_record(transaction, transaction["transaction_id"], openings.get(transaction["transaction_id"], ""))
+    )
+
+    yield from itertools.islice(itertools.chain(archived(), live), offset, None if limit is None else offset + limit)
+
+
+# -------------------- COMPACT COMMAND --------------------
+@click.command()
+@click.option("--before", type=click.DateTime(formats=["%Y-%m-%d"]), required=True, help="Archive the transactions dated before this day (YYYY-MM-DD).")
+@click.pass_obj
+def compact(obj: dict, before):
+
+    '''
+    Moves old transactions out of the live ledger into an archive segment.
+
+    The transactions of every account dated before --before are written to
+    a compressed, read-only segment next to the ledger and replaced by a
+    single opening balance record, so balances do not change. Statements
+    read the archive only when their date range reaches back into it.
+
+    Other commands can keep writing meanwhile: the ledger is read and
+    rewritten without letting any other write in between.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    # Imported here, it loads asyncio which nothing else of this module needs
+    from stash_basic import server
+
+    if server.is_running(obj):
+        raise click.UsageError("Stop `stash serve` before compacting the ledger.")
+
+    ledger_path = obj["path"]
+    before = before.strftime("%Y-%m-%d")
+    backend = backends.get_backend(obj, local=True)
+
+    recovered = recover(ledger_path, backend)
+    if recovered:
+        click.echo(f"{click.style('INFO:', bg='blue')} Finished {len(recovered)} interrupted compaction(s).")
+
+    compacted = {}
+
+    def compact_contents(contents: list) -> list | None:
+        # Opening records of earlier compactions are not archived again
+        openings = {
+            (account_id, account_header["opening"])
+            for segment_path in segment_paths(ledger_path)
+            for account_id, account_header in read_header(segment_path)["accounts"].items()
+        }
+
+        contents, header, archived = split_ledger(contents, before, openings)
+        if not archived:
+            return None
+
+        # Segment first: if the ledger write does not happen the next run deletes it
+        compacted.update(pending_path=write_segment(ledger_path, header, archived), header=header, archived=len(archived))
+        compacted["live_count"] = sum(len(account["transactions"]) for account in contents)
+        return contents
+
+    try:
+        backend.rewrite(compact_contents)
+    finally:
+        backend.close()
+
+    if not compacted:
+        click.echo(f"{click.style('INFO:', bg='blue')} There are no transactions before {before} to archive.")
+        return
+
+    segment_path = finish_segment(compacted["pending_path"])
+    header, live_count = compacted["header"], compacted["live_count"]
+    click.echo(click.style(f"Archived {compacted['archived']} transactions of {len(header['accounts'])} accounts dated before {before}.", fg="green"))
+    click.echo(f"-- Segment: {click.style(segment_path, fg='yellow')} ({os.path.getsize(segment_path) / 1024:,.0f} KB)")
+    click.echo(f"-- Transactions left in the live ledger (incl. opening balances): {click.style(str(live_count), fg='cyan')}")
@@ -0,0 +1,1250 @@
+import os
+import json
+import time
+import itertools
+import urllib.parse
+from collections.abc import Sequence
+from contextlib import contextmanager
+from stash_basic import cache, columns, ids, journal, locking, scanner, tracing, utils
+from stash_basic.ledger import Ledger
+
+
+# -------------------- BASE BACKEND --------------------
+class Backend:
+
+    '''
+    Interface every storage engine implements. The command handlers only talk
+    to a backend and never open the ledger file themselves.
+
+    Accounts are plain dictionaries with the keys full_name, email, dob, id,
+    balance and (where requested) transactions. Transactions are dictionaries
+    with the keys transaction_id, date, time, description, type and amount.
+    '''
+
+    name = None
+    extension = None
+
+    def __init__(self, obj: dict):
+        self.obj = obj
+        self.path = obj["path"]
+
+    def create(self) -> None:
+        '''Creates an empty ledger at the configured path.'''
+        raise NotImplementedError
+
+    def accounts(self) -> list:
+        '''Returns all accounts without their transactions.'''
+        raise NotImplementedError
+
+    def get_account(self, account_id: str, transactions: bool = True) -> dict | None:
+        '''Returns the account (including transactions unless told otherwise) or None if it does not exist.'''
+        raise NotImplementedError
+
+    def add_account(self, account: dict) -> None:
+        '''Adds a new account.'''
+        raise NotImplementedError
+
+    def delete_account(self, account_id: str) -> None:
+        '''Removes an account together with all of its transactions.'''
+        raise NotImplementedError
+
+    def get_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+        '''Returns a single transaction of an account or None if it does not exist.'''
+        raise NotImplementedError
+
+    def add_transaction(self, account_id: str, transaction: dict) -> float:
+        '''Appends a transaction to an account and returns the new balance.'''
+        return self.add_transactions(account_id, [transaction])
+
+    def add_transactions(self, account_id: str, transactions: list) -> float:
+        '''Appends several transactions to an account at once and returns the new balance.'''
+        raise NotImplementedError
+
+    def delete_transaction(self, account_id: str, transaction_id: int) -> float:
+        '''Removes a transaction from an account and returns the new balance.'''
+        raise NotImplementedError
+
+    def iter_transactions(self, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+
+        '''
+        Yields the transactions of an account in posting order. since and until
+        are inclusive YYYY-MM-DD dates; offset and limit page through the
+        matching transactions.
+        '''
+
+        account = self.get_account(account_id)
+        if account is not None:
+            yield from select_transactions(account["transactions"], since, until, offset, limit)
+
+    def dump(self) -> list:
+        '''Returns the complete ledger (all accounts with transactions).'''
+        raise NotImplementedError
+
+    def load(self, contents: list) -> None:
+        '''Replaces the complete ledger with contents in a single write.'''
+        raise NotImplementedError
+
+    def rewrite(self, function) -> None:
+        '''
+        Replaces the complete ledger with function(contents) in a single
+        write. The latest contents are read and the result is written while
+        holding off every other writer, so no concurrent change is lost.
+        Nothing is written if function returns None.
+        '''
+        raise NotImplementedError
+
+    def recompute_balances(self) -> dict:
+        '''Returns {account ID: balance} with every balance recomputed from the account's transactions.'''
+        return {account["id"]: balance_of(account["transactions"]) for account in self.dump()}
+
+    def repair_balances(self, account_ids: list) -> dict:
+        '''
+        Sets the stored balance of accounts to the one recomputed from their
+        transactions, as part of the same write so a concurrent change is not
+        undone. Returns {account ID: repaired balance}.
+        '''
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self):
+        '''
+        Groups all changes made inside the with-block into a single write.
+        Nothing is written if the block raises an exception.
+        '''
+        raise NotImplementedError
+
+    def refresh(self) -> None:
+        '''Drops cached data if another process changed the ledger. Used by long-running processes.'''
+        pass
+
+    def close(self) -> None:
+        '''Releases any resources held by the backend.'''
+        pass
+
+
+def select_transactions(transactions, since: str | None, until: str | None, offset: int, limit: int | None, ordered: bool = False):
+
+    '''
+    Filters an iterable of transactions by date and pages through them lazily.
+
+    ordered tells that the IDs of the transactions are in date order (see
+    Ledger.ids_ordered()), the date range is then found by binary search.
+    '''
+
+    if ordered and (since is not None or until is not None):
+        if isinstance(transactions, columns.TransactionColumns):
+            start, stop = ids.window(transactions.ids, since, until)
+        else:
+            start, stop = ids.window(transactions, since, until, key=lambda transaction: ids.day_of(transaction["transaction_id"]))
+        start = min(start + offset, stop)
+        return iter(transactions[start:stop if limit is None else min(stop, start + limit)])
+
+    if since is None and until is None and (limit is not None or offset) and isinstance(transactions, Sequence):
+        # Jump straight to the page instead of skipping offset transactions
+        return iter(transactions[offset:] if limit is None else transactions[offset:offset + limit])
+
+    if since is not None or until is not None:
+        transactions = (
+            transaction for transaction in transactions
+            if (since is None or utils.iso_date(transaction["date"]) >= since)
+            and (until is None or utils.iso_date(transaction["date"]) <= until)
+        )
+
+    return itertools.islice(transactions, offset, None if limit is None else offset + limit)
+
+
+def balance_of(transactions) -> float:
+
+    '''
+    Returns the balance that results from posting transactions to an empty account.
+    '''
+
+    if isinstance(transactions, columns.TransactionColumns):
+        return utils.from_cents(transactions.balance_cents())
+    return utils.from_cents(sum(utils.signed_cents(transaction) for transaction in transactions))
+
+
+def appended_since(backend: Backend, account_id: str, count: int, last_id: int | None) -> list | None:
+
+    '''
+    Returns the transactions posted to an account since it had count
+    transactions, the last one with ID last_id, reading only from that one
+    on. None if the transactions changed in some other way than by appending.
+    '''
+
+    rest = list(backend.iter_transactions(account_id, offset=max(count - 1, 0)))
+    if count == 0:
+        return rest
+    if rest and rest[0]["transaction_id"] == last_id:
+        return rest[1:]
+    return None
+
+
+def encode_transactions(transactions, compact: bool) -> str:
+
+    '''
+    Returns the JSON of a list of transactions: column-wise and without any
+    whitespace when compact is set, otherwise as a list of transactions.
+    '''
+
+    if compact:
+        return json.dumps(columns.encode(transactions), separators=(",", ":"), ensure_ascii=True)
+    return json.dumps(transactions, ensure_ascii=True, default=columns.to_json)
+
+def decode_transactions(transactions, compact: bool):
+
+    '''
+    Returns the transactions of an account as read from disk, kept in
+    TransactionColumns when compact is set or they were stored column-wise.
+    '''
+
+    transactions = columns.decode(transactions)
+    if compact and not isinstance(transactions, columns.TransactionColumns):
+        transactions = columns.TransactionColumns(transactions)
+    return transactions
+
+
+# -------------------- JSON BACKEND --------------------
+# Single-account operations read up to this many accounts on their own, beyond that the whole ledger is loaded
+PARTIAL_ACCOUNTS = 8
+
+class JsonBackend(Backend):
+
+    '''
+    Stores the whole ledger as a list of accounts in a single JSON file.
+
+    Transaction changes are first appended to the journal next to the file
+    (see journal.py) and then folded into the file. When the journal is
+    enabled that only happens once the journal grows too large, otherwise it
+    happens right away as a group commit: every writer queues its records in
+    the journal and waits for the commit lock, and whoever gets the lock first
+    writes the records of all waiting writers with a single rewrite.
+
+    Every rewrite is atomic (temporary file plus rename) and done under the
+    commit lock after re-reading the file if another process changed it, so
+    concurrent writers never lose each other's changes.
+
+    With the compact setting the transactions are kept in TransactionColumns
+    in memory and written column-wise without indentation.
+
+    Unless the cache setting is off, the parsed file is also kept in a binary
+    sidecar cache (see cache.py) that is loaded instead of parsing the file
+    while the file is unchanged, and rewritten after every rewrite of the file.
+
+    Operations on a single account (e.g. `stash statement`, `stash credit`)
+    do not load the whole ledger: the file is memory-mapped and only that
+    account is parsed (see scanner.py). Their changes are written back by
+    splicing the account's new bytes into a copy of the file, without
+    parsing or serializing any other account.
+    '''
+
+    name = "json"
+    extension = ".json"
+
+    def __init__(self, obj: dict):
+        super().__init__(obj)
+        self.journal = obj.get("journal", False)
+        self.compact = obj.get("compact", False)
+        self.cache = obj.get("cache", True)
+        self._ledger = None
+
+        # Only the accounts single-account operations asked for, while the whole ledger is not loaded
+        self._partial = None
+        self._requested = set()
+        self._ranges = None
+
+        # State of the file and the journal and number of journal records the ledger reflects
+        self._signature = None
+        self._journal_signature = None
+        self._applied = 0
+
+        # Changes collected while inside batch(), None outside of a batch
+        self._pending = None
+
+    @property
+    def _commit_lock(self) -> str:
+        return locking.commit_lock_path(self.path)
+
+    @property
+    def _journal_lock(self) -> str:
+        return locking.journal_lock_path(self.path)
+
+    def _load(self, records: list | None = None) -> Ledger:
+
+        '''
+        Reads the file and replays the journal records on top of it. The
+        caller must hold the journal lock, unless it holds the commit lock and
+        passes the records it read.
+        '''
+
+        if records is None:
+            records = journal.read(self.path)
+
+        contents = self._read_contents()
+        ledger = Ledger(contents)
+
+        with tracing.phase("journal replay"):
+            journal.replay(ledger, records)
+
+        self._signature = utils.file_signature(self.path)
+        self._journal_signature = utils.file_signature(journal.journal_path(self.path))
+        self._applied = len(records)
+        return ledger
+
+    def _load_accounts(self, account_ids: set, records: list | None = None) -> Ledger:
+
+        '''
+        Like _load(), but only reads the accounts with the given IDs from the
+        file. Raises ValueError if the file cannot be walked (see
+        scanner.AccountRanges.find()).
+        '''
+
+        if records is None:
+            records = journal.read(self.path)
+
+        contents, self._ranges = scanner.read_accounts(self.path, account_ids)
+        for account in contents:
+            account["transactions"] = decode_transactions(account["transactions"], self.compact)
+        ledger = Ledger(contents)
+
+        with tracing.phase("journal replay"):
+            journal.replay(ledger, records)
+
+        self._requested = set(account_ids)
+        self._signature = utils.file_signature(self.path)
+        self._journal_signature = utils.file_signature(journal.journal_path(self.path))
+        self._applied = len(records)
+        return ledger
+
+    def _read_contents(self) -> list:
+
+        '''
+        Returns the accounts in the file, from the cache if it matches the file.
+        '''
+
+        start = time.perf_counter()
+        fingerprint = cache.fingerprint(self.path) if self.cache else None
+
+        if fingerprint is not None:
+            contents = cache.load(self.path, fingerprint)
+            if contents is not None:
+                for account in contents:
+                    account["transactions"] = decode_transactions(account["transactions"], self.compact)
+                cache.record(self.path, hit=True, seconds=time.perf_counter() - start)
+                return contents
+
+        with tracing.phase("ledger read"):
+            with open(self.path, "r") as json_file:
+                data = json_file.read()
+
+        with tracing.phase("json parse"):
+            contents = json.loads(data)
+            for account in contents:
+                account["transactions"] = decode_transactions(account["transactions"], self.compact)
+
+        if fingerprint is not None:
+            # Before the journal replay changes the accounts
+            elapsed = time.perf_counter() - start
+            cache.store(self.path, contents, fingerprint)
+            cache.record(self.path, miss=True, seconds=elapsed)
+
+        return contents
+
+    @property
+    def ledger(self) -> Ledger:
+
+        '''
+        The indexed list of accounts, loaded from the file on first access
+        with the pending journal records replayed on top.
+        '''
+
+        if self._ledger is None:
+            with locking.lock(self._journal_lock, shared=True):
+                self._ledger = self._load()
+            self._partial = None
+
+        return self._ledger
+
+    def _account_ledger(self, account_id: str) -> Ledger:
+
+        '''
+        The ledger to look up or change one account in: the whole ledger if
+        it is loaded or a batch is running, otherwise one with only the
+        accounts asked for so far.
+        '''
+
+        if self._ledger is not None or self._pending is not None:
+            return self.ledger
+
+        if self._partial is None or account_id not in self._requested:
+            account_ids = self._requested | {account_id} if self._partial is not None else {account_id}
+            if len(account_ids) > PARTIAL_ACCOUNTS:
+                return self.ledger
+
+            try:
+                with locking.lock(self._journal_lock, shared=True):
+                    self._partial = self._load_accounts(account_ids)
+            except ValueError:
+                # Laid out in a way the scanner does not know, parse it as a whole
+                self._partial = None
+                return self.ledger
+
+        return self._partial
+
+    def _is_stale(self, records: list) -> bool:
+
+        '''
+        Returns True if another process rewrote the file or appended journal
+        records since the ledger was loaded.
+        '''
+
+        return utils.file_signature(self.path) != self._signature or len(records) != self._applied
+
+    def _append(self, records: list) -> str:
+
+        '''
+        Appends records (already applied to the ledger) to the journal and
+        returns the commit token they were stamped with.
+        '''
+
+        token = os.urandom(16).hex()
+
+        with locking.lock(self._journal_lock):
+            journal.append(self.path, records, token)
+            self._journal_signature = utils.file_signature(journal.journal_path(self.path))
+
+        self._applied += len(records)
+        return token
+
+    def _write_file(self) -> None:
+
+        '''
+        Atomically writes the ledger to the file. The caller must hold the
+        commit lock and have rotated the journal, whose records are now part
+        of the file. Only the final rename blocks readers and other writers.
+        '''
+
+        with tracing.phase("serialization"):
+            data, positions = scanner.encode_ledger(self.ledger.contents, self.compact)
+
+        temp_path = utils.write_temp_file(self.path, data)
+
+        with locking.lock(self._journal_lock):
+            utils.replace_file(temp_path, self.path)
+            journal.discard_rotated(self.path)
+            self._journal_signature = utils.file_signature(journal.journal_path(self.path))
+
+        self._signature = utils.file_signature(self.path)
+        self._applied = 0
+        fingerprint = cache.fingerprint(self.path)
+
+        if self.compact or os.linesep == "\n":
+            # Where the accounts were written, unless the line endings were translated
+            scanner.AccountRanges(fingerprint, positions, resume=None).save(self.path)
+
+        if self.cache:
+            # The ledger in memory is exactly what was written
+            cache.store(self.path, self.ledger.contents, fingerprint)
+            cache.record(self.path, rebuild=True)
+
+    def _splice_file(self) -> None:
+
+        '''
+        Like _write_file() for the partial ledger: only its accounts are
+        written again, every other byte of the file is copied as it is. The
+        cache is rebuilt the next time the whole ledger is read.
+        '''
+
+        with tracing.phase("serialization"):
+            replacements = {account["id"]: scanner.encode_account(account, self.compact) for account in self._partial}
+
+        temp_path = None
+        if replacements:
+            temp_path, ranges = scanner.write_spliced(self.path, self._ranges, replacements)
+
+        with locking.lock(self._journal_lock):
+            if temp_path is not None:
+                utils.replace_file(temp_path, self.path)
+            journal.discard_rotated(self.path)
+            self._journal_signature = utils.file_signature(journal.journal_path(self.path))
+
+        self._signature = utils.file_signature(self.path)
+        self._applied = 0
+
+        if temp_path is not None:
+            ranges.fingerprint = cache.fingerprint(self.path)
+            ranges.save(self.path)
+            self._ranges = ranges
+
+    def _flush(self, changes: list = (), token: str | None = None) -> None:
+
+        '''
+        Folds all journal records and changes into the file with a single
+        rewrite. If another process changed the ledger since it was loaded it
+        is re-read and the changes are applied again on top of it.
+
+        With a token this is the group commit of a writer whose records are in
+        the journal: if they are gone, a writer that got the commit lock
+        earlier already wrote them together with its own, so there is nothing
+        left to do.
+        '''
+
+        with locking.lock(self._commit_lock):
+            with locking.lock(self._journal_lock):
+                records = journal.read(self.path)
+
+                if token is not None and not any(record.get("commit") == token for record in records):
+                    # Someone else's write included ours, re-read on next access
+                    self._ledger = None
+                    self._partial = None
+                    return
+
+                stale = self._is_stale(records)
+                journal.rotate(self.path)
+
+            if self._ledger is None and self._partial is not None:
+                # Only the accounts with records are read and written again, all their changes are in the records
+                try:
+                    self._partial = self._load_accounts(self._requested | {record["account"] for record in records}, records)
+                except ValueError:
+                    self._partial = None
+                    stale = True
+                else:
+                    self._splice_file()
+                    return
+
+            if stale:
+                self._ledger = self._load(records)
+                for apply, _ in changes:
+                    apply(self._ledger)
+
+            self._write_file()
+
+    def _commit(self, changes: list) -> None:
+
+        '''
+        Persists changes that were already applied to the ledger. Each change
+        is a tuple (apply, records): apply(ledger) re-applies it to a freshly
+        read ledger, records are its journal records or None if the change
+        cannot be journaled.
+        '''
+
+        if any(records is None for _, records in changes) or (len(changes) > 1 and not self.journal):
+            self._flush(changes)
+            return
+
+        token = self._append([record for _, records in changes for record in records])
+
+        if not self.journal:
+            self._flush(token=token)
+        elif journal.needs_checkpoint(self.path):
+            self._flush()
+
+    def _change(self, apply, records: list | None = None, account_id: str | None = None) -> None:
+
+        '''
+        Applies a change to the ledger and persists it, or holds it back until
+        the end of the current batch. Journaled changes of a single account
+        (account_id) do not need the whole ledger.
+        '''
+
+        ledger = self.ledger if account_id is None or records is None else self._account_ledger(account_id)
+        with tracing.phase("mutation"):
+            apply(ledger)
+
+        if self._pending is not None:
+            self._pending.append((apply, records))
+        else:
+            self._commit([(apply, records)])
+
+    def _record(self, op: str, account_id: str, transactions: list) -> None:
+
+        '''
+        Applies and persists transaction changes ("post" or "delete") of one account.
+        '''
+
+        records = [journal.make_record(op, account_id, transaction) for transaction in transactions]
+        self._change(lambda ledger: journal.replay(ledger, records), records, account_id)
+
+    def _replace(self, contents: list) -> None:
+        with locking.lock(self._commit_lock):
+            with locking.lock(self._journal_lock):
+                journal.rotate(self.path)
+
+            self._ledger = Ledger(contents)
+            self._write_file()
+
+    def create(self) -> None:
+        # Also discards any journal left behind by a previous ledger at the same path
+        self._replace([])
+
+    def accounts(self) -> list:
+        return [{key: value for key, value in account.items() if key != "transactions"} for account in self.ledger]
+
+    def get_account(self, account_id: str, transactions: bool = True) -> dict | None:
+        ledger = self._account_ledger(account_id)
+        with tracing.phase("account search"):
+            account = ledger.account(account_id)
+            if account is None or transactions:
+                return account
+            return {key: value for key, value in account.items() if key != "transactions"}
+
+    def add_account(self, account: dict) -> None:
+        def apply(ledger):
+            if ledger.account(account["id"]) is None:
+                ledger.add_account(account)
+
+        self._change(apply)
+
+    def delete_account(self, account_id: str) -> None:
+        self._change(lambda ledger: ledger.remove_account(account_id))
+
+    def repair_balances(self, account_ids: list) -> dict:
+        repaired = {}
+
+        def apply(ledger):
+            # Applied again to the latest ledger under the commit lock if another process wrote in between
+            for account_id in account_ids:
+                account = ledger.account(account_id)
+                if account is not None:
+                    account["balance"] = repaired[account_id] = balance_of(account["transactions"])
+
+        self._change(apply)
+        return repaired
+
+    def get_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+        ledger = self._account_ledger(account_id)
+        with tracing.phase("account search"):
+            return ledger.transaction(account_id, transaction_id)
+
+    def iter_transactions(self, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+        ledger = self._account_ledger(account_id)
+        account = ledger.account(account_id)
+        if account is not None:
+            # Only date ranges need to know whether the IDs are in order
+            ordered = (since is not None or until is not None) and ledger.ids_ordered(account_id)
+            yield from select_transactions(account["transactions"], since, until, offset, limit, ordered=ordered)
+
+    def _balance(self, account_id: str) -> float:
+        account = self._account_ledger(account_id).account(account_id)
+        return account["balance"] if account is not None else 0.0
+
+    def add_transactions(self, account_id: str, transactions: list) -> float:
+        self._record("post", account_id, transactions)
+        return self._balance(account_id)
+
+    def delete_transaction(self, account_id: str, transaction_id: int) -> float:
+        if self._account_ledger(account_id).transaction(account_id, transaction_id) is not None:
+            self._record("delete", account_id, [{"transaction_id": transaction_id}])
+        return self._balance(account_id)
+
+    def dump(self) -> list:
+        return self.ledger.contents
+
+    def refresh(self) -> None:
+        if (self._ledger is not None or self._partial is not None) and self._pending is None:
+            changed = (
+                utils.file_signature(self.path) != self._signature
+                or utils.file_signature(journal.journal_path(self.path)) != self._journal_signature
+            )
+            if changed:
+                self._ledger = None
+                self._partial = None
+
+    def load(self, contents: list) -> None:
+        self._replace(contents)
+
+    def rewrite(self, function) -> None:
+        with locking.lock(self._commit_lock):
+            with locking.lock(self._journal_lock):
+                records = journal.read(self.path)
+                journal.rotate(self.path)
+
+            # Every committed change, the journal records included
+            self._ledger = self._load(records)
+            self._partial = None
+            contents = function(self._ledger.contents)
+
+            if contents is None:
+                # The records stay aside, the next write folds them in
+                return
+
+            self._ledger = Ledger(contents)
+            self._write_file()
+
+    @contextmanager
+    def batch(self):
+        if self._pending is not None:
+            yield self
+            return
+
+        self._pending = []
+
+        try:
+            yield self
+        except BaseException:
+            # Throw away the half-applied changes, they are re-read on next access
+            self._pending = None
+            self._ledger = None
+            raise
+
+        changes, self._pending = self._pending, None
+
+        if changes:
+            self._commit(changes)
+
+
+# -------------------- SQLITE BACKEND --------------------
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    full_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    dob TEXT NOT NULL,
+    balance REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id TEXT NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    transaction_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    description TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_id ON transactions (account_id, transaction_id);
+CREATE INDEX IF NOT EXISTS transactions_by_day ON transactions (account_id, day);
+'''
+
+ACCOUNT_COLUMNS = "full_name, email, dob, id, balance"
+TRANSACTION_COLUMNS = "transaction_id, date, time, description, type, amount"
+
+class SqliteBackend(Backend):
+
+    '''
+    Stores the ledger in an SQLite database. Accounts are indexed by their ID
+    and transactions by (account ID, transaction ID) and (account ID, date),
+    so single account operations never load the rest of the ledger.
+    '''
+
+    name = "sqlite"
+    extension = ".db"
+
+    def __init__(self, obj: dict):
+        super().__init__(obj)
+        self._connection = None
+        self._batching = False
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # Imported here so the other backends do not pay for it on every command
+            import sqlite3
+
+            # Wait for other writers instead of failing with "database is locked"
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA foreign_keys = ON")
+            self._connection.execute("PRAGMA journal_mode = WAL")
+        return self._connection
+
+    @contextmanager
+    def _write(self):
+
+        '''
+        Runs the statements of the with-block in one SQL transaction, unless a
+        batch() is already open, in which case the batch commits them.
+        '''
+
+        with tracing.phase("mutation"):
+            if self._batching:
+                yield
+            else:
+                with self.connection:
+                    yield
+
+    def _insert_transactions(self, account_id: str, transactions: list) -> None:
+        self.connection.executemany(
+            f"INSERT INTO transactions (account_id, {TRANSACTION_COLUMNS}, day) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (account_id, t["transaction_id"], t["date"], t["time"], t["description"], t["type"], t["amount"], utils.iso_date(t["date"]))
+                for t in transactions
+            )
+        )
+
+    def _balance(self, account_id: str) -> float:
+        return self.connection.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()["balance"]
+
+    def create(self) -> None:
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS transactions")
+            self.connection.execute("DROP TABLE IF EXISTS accounts")
+            self.connection.executescript(SQLITE_SCHEMA)
+
+    def accounts(self) -> list:
+        rows = self.connection.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts ORDER BY position")
+        return [dict(row) for row in rows]
+
+    def get_account(self, account_id: str, transactions: bool = True) -> dict | None:
+        with tracing.phase("account search"):
+            row = self.connection.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            return None
+
+        account = dict(row)
+        if not transactions:
+            return account
+
+        with tracing.phase("ledger read"):
+            rows = self.connection.execute(
+                f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id = ? ORDER BY position", (account_id,)
+            )
+            account["transactions"] = [dict(transaction) for transaction in rows]
+        return account
+
+    def add_account(self, account: dict) -> None:
+        with self._write():
+            self.connection.execute(
+                f"INSERT INTO accounts ({ACCOUNT_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                (account["full_name"], account["email"], account["dob"], account["id"], account["balance"])
+            )
+            self._insert_transactions(account["id"], account.get("transactions", []))
+
+    def delete_account(self, account_id: str) -> None:
+        with self._write():
+            self.connection.execute("DELETE FROM accounts WHERE id = ?", (account_id,))
+
+    def repair_balances(self, account_ids: list) -> dict:
+        with self._write():
+            self.connection.executemany(
+                "UPDATE accounts SET balance = (SELECT coalesce(sum(CASE type WHEN 'DEBIT' THEN -round(amount * 100) ELSE round(amount * 100) END), 0) / 100.0 "
+                "FROM transactions WHERE transactions.account_id = accounts.id) WHERE id = ?",
+                [(account_id,) for account_id in account_ids]
+            )
+            rows = [self.connection.execute("SELECT id, balance FROM accounts WHERE id = ?", (account_id,)).fetchone() for account_id in account_ids]
+        return {row["id"]: row["balance"] for row in rows if row is not None}
+
+    def get_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+        with tracing.phase("account search"):
+            row = self.connection.execute(
+                f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id = ? AND transaction_id = ? ORDER BY position LIMIT 1",
+                (account_id, transaction_id)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def add_transactions(self, account_id: str, transactions: list) -> float:
+        with self._write():
+            self._insert_transactions(account_id, transactions)
+            self.connection.execute(
+                "UPDATE accounts SET balance = (round(balance * 100) + ?) / 100.0 WHERE id = ?",
+                (sum(utils.signed_cents(transaction) for transaction in transactions), account_id)
+            )
+        return self._balance(account_id)
+
+    def delete_transaction(self, account_id: str, transaction_id: int) -> float:
+        transaction = self.get_transaction(account_id, transaction_id)
+        if transaction is not None:
+            with self._write():
+                self.connection.execute(
+                    "DELETE FROM transactions WHERE position = "
+                    "(SELECT position FROM transactions WHERE account_id = ? AND transaction_id = ? ORDER BY position LIMIT 1)",
+                    (account_id, transaction_id)
+                )
+                self.connection.execute(
+                    "UPDATE accounts SET balance = (round(balance * 100) - ?) / 100.0 WHERE id = ?",
+                    (utils.signed_cents(transaction), account_id)
+                )
+        return self._balance(account_id)
+
+    def iter_transactions(self, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+        query = f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id = ?"
+        parameters = [account_id]
+
+        if since is not None:
+            query += " AND day >= ?"
+            parameters.append(since)
+        if until is not None:
+            query += " AND day <= ?"
+            parameters.append(until)
+
+        query += " ORDER BY position LIMIT ? OFFSET ?"
+        parameters += [-1 if limit is None else limit, offset]
+
+        # The cursor fetches rows as they are consumed
+        for row in self.connection.execute(query, parameters):
+            yield dict(row)
+
+    def dump(self) -> list:
+        return [self.get_account(account["id"]) for account in self.accounts()]
+
+    def recompute_balances(self) -> dict:
+        rows = self.connection.execute(
+            "SELECT accounts.id, coalesce(sum(CASE transactions.type WHEN 'DEBIT' THEN -round(transactions.amount * 100) ELSE round(transactions.amount * 100) END), 0) / 100.0 AS balance "
+            "FROM accounts LEFT JOIN transactions ON transactions.account_id = accounts.id GROUP BY accounts.id ORDER BY accounts.position"
+        )
+        return {row["id"]: row["balance"] for row in rows}
+
+    def load(self, contents: list) -> None:
+        with self._write():
+            self.connection.execute("DELETE FROM transactions")
+            self.connection.execute("DELETE FROM accounts")
+            for account in contents:
+                self.connection.execute(
+                    f"INSERT INTO accounts ({ACCOUNT_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                    (account["full_name"], account["email"], account["dob"], account["id"], account["balance"])
+                )
+                self._insert_transactions(account["id"], account["transactions"])
+
+    def rewrite(self, function) -> None:
+        with self.connection:
+            # Takes the write lock before reading, other writers wait until the commit
+            self.connection.execute("BEGIN IMMEDIATE")
+            contents = function(self.dump())
+            if contents is not None:
+                self._batching = True
+                try:
+                    self.load(contents)
+                finally:
+                    self._batching = False
+
+    @contextmanager
+    def batch(self):
+        self._batching = True
+
+        try:
+            with self.connection:
+                yield self
+        finally:
+            self._batching = False
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# -------------------- SHARDED BACKEND --------------------
+SHARD_INDEX = "accounts.json"
+SHARD_DIRECTORY = "ledgers"
+
+# Below this many accounts starting worker processes costs more than it saves
+PARALLEL_MIN_ACCOUNTS = 32
+
+def parallel_map(function, arguments: dict) -> dict:
+
+    '''
+    Returns {key: function(argument)} for {key: argument}. With at least
+    PARALLEL_MIN_ACCOUNTS arguments the calls are spread over a process pool,
+    so function must be a module-level function.
+    '''
+
+    keys = list(arguments)
+    if len(keys) < PARALLEL_MIN_ACCOUNTS:
+        return dict(zip(keys, map(function, arguments.values())))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor() as pool:
+        return dict(zip(keys, pool.map(function, arguments.values(), chunksize=max(1, len(keys) // (4 * (os.cpu_count() or 1))))))
+
+def shard_balance(shard_path: str) -> float:
+
+    '''
+    Recomputes the balance of one account from its shard file. Runs in the
+    worker processes of ShardedBackend.map_shards().
+    '''
+
+    with open(shard_path, "r") as shard_file:
+        return balance_of(columns.decode(json.load(shard_file)))
+
+class ShardedBackend(Backend):
+
+    '''
+    Stores the ledger in a directory: a small index file with the details and
+    balance of every account (accounts.json) and one JSON file per account
+    with its transactions (ledgers/<account ID>.json).
+
+    Posting to an account only rewrites its own shard and the index, and
+    commands that only need account details (e.g. `stash accounts summary`)
+    never read a shard. Shards are only loaded when an account's transactions
+    are needed, and scans over every account run in a process pool.
+
+    Every change happens under the commit lock next to the directory, on the
+    latest index, and each file is replaced atomically. Shards are written
+    before the index, so the index never names a shard that is not there yet.
+
+    With the compact setting shards are stored column-wise and loaded into
+    TransactionColumns.
+    '''
+
+    name = "sharded"
+    extension = ".stash"
+
+    def __init__(self, obj: dict):
+        super().__init__(obj)
+        self.compact = obj.get("compact", False)
+        self._ledger = None
+        self._signature = None
+
+        # Account IDs whose shard has to be written/removed at the end of the current batch, None outside of a batch
+        self._dirty = None
+        self._removed = None
+
+    @property
+    def _commit_lock(self) -> str:
+        return locking.commit_lock_path(self.path)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, SHARD_INDEX)
+
+    def _shard_path(self, account_id: str) -> str:
+        # Account IDs are derived from names, keep them safe to use as file names
+        return os.path.join(self.path, SHARD_DIRECTORY, urllib.parse.quote(account_id, safe="") + ".json")
+
+    @property
+    def ledger(self) -> Ledger:
+
+        '''
+        The indexed list of accounts, read from the index file on first access.
+        An account only has a "transactions" key once its shard was loaded.
+        '''
+
+        if self._ledger is None:
+            with tracing.phase("ledger read"):
+                with open(self._index_path, "r") as index_file:
+                    data = index_file.read()
+            with tracing.phase("json parse"):
+                self._ledger = Ledger(json.loads(data))
+            self._signature = utils.file_signature(self._index_path)
+
+        return self._ledger
+
+    def _account(self, account_id: str) -> dict | None:
+
+        '''
+        Returns the account with its transactions, loading its shard if needed.
+        '''
+
+        account = self.ledger.account(account_id)
+        if account is not None and "transactions" not in account:
+            with tracing.phase("ledger read"):
+                with open(self._shard_path(account_id), "r") as shard_file:
+                    data = shard_file.read()
+            with tracing.phase("json parse"):
+                account["transactions"] = decode_transactions(json.loads(data), self.compact)
+        return account
+
+    def _write(self, dirty: set, removed: set) -> None:
+
+        '''
+        Writes the changed shards and then the index. The caller must hold the commit lock.
+        '''
+
+        for account_id in dirty:
+            account = self.ledger.account(account_id)
+            # Shards can be large, so unlike the index they are not indented
+            with tracing.phase("serialization"):
+                data = encode_transactions(account["transactions"], self.compact)
+            utils.atomic_write(self._shard_path(account_id), data)
+
+        with tracing.phase("serialization"):
+            index = [{key: value for key, value in account.items() if key != "transactions"} for account in self.ledger]
+            data = json.dumps(index, indent=2, ensure_ascii=True)
+        utils.atomic_write(self._index_path, data)
+        self._signature = utils.file_signature(self._index_path)
+
+        for account_id in removed:
+            try:
+                os.remove(self._shard_path(account_id))
+            except FileNotFoundError:
+                pass
+
+    def _write_all(self, contents: list) -> None:
+
+        '''
+        Writes contents as the complete ledger. The caller must hold the commit lock.
+        '''
+
+        os.makedirs(os.path.join(self.path, SHARD_DIRECTORY), exist_ok=True)
+
+        # Shards of accounts that are not part of the new ledger
+        stale = {
+            urllib.parse.unquote(file_name[:-len(".json")])
+            for file_name in os.listdir(os.path.join(self.path, SHARD_DIRECTORY))
+            if file_name.endswith(".json")
+        }
+
+        self._ledger = Ledger(contents)
+        self._write({account["id"] for account in contents}, stale - {account["id"] for account in contents})
+
+    def _replace(self, contents: list) -> None:
+        with locking.lock(self._commit_lock):
+            self._write_all(contents)
+
+    def create(self) -> None:
+        self._replace([])
+
+    def accounts(self) -> list:
+        return [{key: value for key, value in account.items() if key != "transactions"} for account in self.ledger]
+
+    def get_account(self, account_id: str, transactions: bool = True) -> dict | None:
+        if transactions:
+            return self._account(account_id)
+
+        account = self.ledger.account(account_id)
+        if account is None:
+            return None
+        return {key: value for key, value in account.items() if key != "transactions"}
+
+    def add_account(self, account: dict) -> None:
+        with self.batch():
+            if self.ledger.account(account["id"]) is None:
+                self.ledger.add_account(dict(account, transactions=account.get("transactions", [])))
+                self._dirty.add(account["id"])
+                self._removed.discard(account["id"])
+
+    def delete_account(self, account_id: str) -> None:
+        with self.batch():
+            if self.ledger.remove_account(account_id) is not None:
+                self._removed.add(account_id)
+                self._dirty.discard(account_id)
+
+    def repair_balances(self, account_ids: list) -> dict:
+        repaired = {}
+        with self.batch():
+            for account_id in account_ids:
+                account = self._account(account_id)
+                if account is not None:
+                    account["balance"] = repaired[account_id] = balance_of(account["transactions"])
+                    self._dirty.add(account_id)
+        return repaired
+
+    def get_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+        if self._account(account_id) is None:
+            return None
+        return self.ledger.transaction(account_id, transaction_id)
+
+    def iter_transactions(self, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+        account = self._account(account_id)
+        if account is not None:
+            ordered = (since is not None or until is not None) and self.ledger.ids_ordered(account_id)
+            yield from select_transactions(account["transactions"], since, until, offset, limit, ordered=ordered)
+
+    def add_transactions(self, account_id: str, transactions: list) -> float:
+        with self.batch():
+            if self._account(account_id) is None:
+                return 0.0
+
+            self._dirty.add(account_id)
+            with tracing.phase("mutation"):
+                return self.ledger.append_transactions(account_id, transactions)
+
+    def delete_transaction(self, account_id: str, transaction_id: int) -> float:
+        with self.batch():
+            if self._account(account_id) is None:
+                return 0.0
+
+            with tracing.phase("mutation"):
+                removed = self.ledger.remove_transaction(account_id, transaction_id)
+            if removed is not None:
+                self._dirty.add(account_id)
+            return self.ledger.account(account_id)["balance"]
+
+    def dump(self) -> list:
+        return [self._account(account["id"]) for account in list(self.ledger)]
+
+    def load(self, contents: list) -> None:
+        self._replace(contents)
+
+    def rewrite(self, function) -> None:
+        with locking.lock(self._commit_lock):
+            # Read again under the lock, the ledger in memory may be outdated
+            self._ledger = None
+            contents = function(self.dump())
+            if contents is not None:
+                self._write_all(contents)
+
+    def shard_signature(self, account_id: str) -> tuple | None:
+        # Every write of an account replaces its shard
+        return utils.file_signature(self._shard_path(account_id))
+
+    def map_shards(self, function, account_ids: list | None = None) -> dict:
+
+        '''
+        Calls function(shard path) for every account (or the given ones) and
+        returns {account ID: result}. With many accounts the shards are spread
+        over a process pool, so function must be a module-level function.
+        '''
+
+        if account_ids is None:
+            account_ids = [account["id"] for account in self.ledger]
+        return parallel_map(function, {account_id: self._shard_path(account_id) for account_id in account_ids})
+
+    def recompute_balances(self) -> dict:
+        return self.map_shards(shard_balance)
+
+    def refresh(self) -> None:
+        # Every commit replaces the index, so its signature tells whether anything changed
+        if self._ledger is not None and self._dirty is None:
+            if utils.file_signature(self._index_path) != self._signature:
+                self._ledger = None
+
+    @contextmanager
+    def batch(self):
+        if self._dirty is not None:
+            yield self
+            return
+
+        with locking.lock(self._commit_lock):
+            # Apply the changes on top of the latest state of the ledger
+            self.refresh()
+            self._dirty, self._removed = set(), set()
+
+            try:
+                yield self
+            except BaseException:
+                # Throw away the half-applied changes, they are re-read on next access
+                self._dirty = self._removed = None
+                self._ledger = None
+                raise
+
+            (dirty, removed), self._dirty, self._removed = (self._dirty, self._removed), None, None
+
+            if dirty or removed:
+                self._write(dirty, removed)
+
+
+# -------------------- BACKEND REGISTRY --------------------
+# Unix socket of `stash serve` next to the ledger, see server.py
+SOCKET_SUFFIX = ".sock"
+
+BACKENDS = {
+    JsonBackend.name: JsonBackend,
+    SqliteBackend.name: SqliteBackend,
+    ShardedBackend.name: ShardedBackend
+}
+
+def get_backend(obj: dict, name: str | None = None, local: bool = False) -> Backend:
+
+    '''
+    Returns the storage engine for the given config object. Configs written
+    before backends existed have no "backend" key and use the JSON backend.
+
+    If `stash serve` is running for the ledger, the returned backend forwards
+    every call to it, unless local is set.
+    '''
+
+    # Without a socket file no server can be running, skip importing the server (and asyncio)
+    if not local and name is None and os.path.exists(obj["path"] + SOCKET_SUFFIX):
+        # Imported here, the server module itself depends on this one
+        from stash_basic import server
+
+        remote = server.connect(obj)
+        if remote is not None:
+            return remote
+
+    return BACKENDS[name or obj.get("backend", JsonBackend.name)](obj)
@@ -0,0 +1,338 @@
+import heapq
+import bisect
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+import tabulate
+from stash_basic import archive, backends, columns, scheduler, search, tracing, utils
+
+
+# -------------------- INDEX SETTINGS --------------------
+# The running balances live next to the ledger in <ledger>.balances and can always be rebuilt from it
+INDEX_SUFFIX = ".balances"
+MAGIC = b"STASHB01"
+
+def index_path(ledger_path: str) -> str:
+    return ledger_path + INDEX_SUFFIX
+
+def entry(transaction: dict) -> tuple:
+    # What the running balances keep of a transaction: (timestamp, ID, signed cents)
+    return columns.to_timestamp(transaction["date"], transaction["time"]), transaction["transaction_id"], utils.signed_cents(transaction)
+
+
+class RunningBalance:
+
+    '''
+    The transactions of one account in date order with the balance after
+    each of them (a prefix sum in cents), so the balance at any moment is
+    one binary search away.
+
+    Transactions dated after the last one are appended in constant time.
+    Any other change only recomputes the running balances from the earliest
+    changed position on.
+    '''
+
+    __slots__ = ("timestamps", "ids", "cents", "running")
+
+    def __init__(self, packed: tuple | None = None):
+        self.timestamps = array("q")
+        self.ids = array("q")
+        self.cents = array("q")
+        self.running = array("q")
+        if packed is not None:
+            for column, data in zip((self.timestamps, self.ids, self.cents, self.running), packed):
+                column.frombytes(data)
+
+    def pack(self) -> tuple:
+        return (self.timestamps.tobytes(), self.ids.tobytes(), self.cents.tobytes(), self.running.tobytes())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def balance_cents(self) -> int:
+        return self.running[-1] if self.running else 0
+
+    def as_of(self, timestamp: int) -> int:
+
+        '''
+        Returns the balance in cents just before timestamp.
+        '''
+
+        position = bisect.bisect_left(self.timestamps, timestamp)
+        return self.running[position - 1] if position else 0
+
+    def update(self, added: list, removed: Counter) -> None:
+
+        '''
+        Adds entries (see entry(), in posting order) and removes transactions
+        (a count per ID), then recomputes the running balances from the first
+        changed position on.
+        '''
+
+        dropped = set()
+        for transaction_id, count in removed.items():
+            position = -1
+            for _ in range(count):
+                position = self.ids.index(transaction_id, position + 1)
+                dropped.add(position)
+
+        # Transactions at the same moment stay in posting order
+        added = sorted(added, key=lambda new_entry: new_entry[0])
+        start = len(self)
+        if dropped:
+            start = min(dropped)
+        if added:
+            start = min(start, bisect.bisect_right(self.timestamps, added[0][0]))
+
+        kept = [
+            (self.timestamps[position], self.ids[position], self.cents[position])
+            for position in range(start, len(self))
+            if position not in dropped
+        ]
+        merged = list(heapq.merge(kept, added, key=lambda new_entry: new_entry[0]))
+
+        balance = self.running[start - 1] if start else 0
+        for column in (self.timestamps, self.ids, self.cents, self.running):
+            del column[start:]
+
+        running = []
+        for _, _, cents in merged:
+            balance += cents
+            running.append(balance)
+
+        self.timestamps.fromlist([timestamp for timestamp, _, _ in merged])
+        self.ids.fromlist([transaction_id for _, transaction_id, _ in merged])
+        self.cents.fromlist([cents for _, _, cents in merged])
+        self.running.fromlist(running)
+
+
+class BalanceIndex:
+
+    '''
+    Running balances of every account of a ledger, brought up to date with
+    the ledger before they are used. Like the search index it remembers, per
+    account, the number of transactions, the last ID and the balance it saw:
+
+    - transactions appended since are added at the end (or merged in if they
+      are dated earlier)
+    - for any other change, e.g. deleted transactions, the transaction IDs
+      are compared with the index and only the running balances after the
+      first difference are recomputed
+    '''
+
+    def __init__(self):
+        self.signature = None
+        self.states = {}
+        self._packed = {}
+        self._balances = {}
+
+    # ----- PERSISTENCE -----
+    @classmethod
+    def load(cls, ledger_path: str) -> "BalanceIndex":
+
+        '''
+        Reads the index of a ledger, or returns an empty one if there is none
+        or it cannot be read. Accounts are only unpacked when they are used.
+        '''
+
+        index = cls()
+        with tracing.phase("index read"):
+            data = utils.load_sidecar(index_path(ledger_path), MAGIC)
+        if data is None:
+            return index
+
+        index.signature = data["signature"]
+        index.states = data["states"]
+        index._packed = data["accounts"]
+
+        return index
+
+    def save(self, ledger_path: str) -> None:
+
+        '''
+        Writes the index next to the ledger. It is not synced to disk, a lost
+        index is rebuilt on the next query.
+        '''
+
+        with tracing.phase("serialization"):
+            accounts = dict(self._packed)
+            accounts.update((account_id, balance.pack()) for account_id, balance in self._balances.items())
+            data = {"signature": self.signature, "states": self.states, "accounts": accounts}
+
+        with tracing.phase("index write"):
+            utils.save_sidecar(index_path(ledger_path), MAGIC, data)
+
+    def balance(self, account_id: str) -> RunningBalance:
+        balance = self._balances.get(account_id)
+        if balance is None:
+            balance = self._balances[account_id] = RunningBalance(self._packed.pop(account_id, None))
+        return balance
+
+    def _drop(self, account_id: str) -> None:
+        self.states.pop(account_id, None)
+        self._packed.pop(account_id, None)
+        self._balances.pop(account_id, None)
+
+    # ----- UPDATES -----
+    def sync_account(self, backend: backends.Backend, account: dict) -> bool:
+
+        '''
+        Brings the running balances of one account up to date. Returns False
+        if it did not change since the last sync.
+        '''
+
+        account_id = account["id"]
+        state = self.states.get(account_id)
+        balance = self.balance(account_id)
+        added, removed = None, Counter()
+
+        if state is not None:
+            count, last_id, known_balance = state
+            appended = backends.appended_since(backend, account_id, count, last_id)
+            if appended is not None:
+                added = [entry(transaction) for transaction in appended]
+
+            if added == [] and account["balance"] == known_balance:
+                return False
+
+        with tracing.phase("index sync"):
+            if added is None:
+                # Changed in some other way: compare the IDs with the index
+                transactions = list(backend.iter_transactions(account_id))
+                current = Counter(transaction["transaction_id"] for transaction in transactions)
+                known = Counter(balance.ids)
+                removed = known - current
+                missing = current - known
+
+                added = []
+                for transaction in transactions:
+                    if missing[transaction["transaction_id"]]:
+                        missing[transaction["transaction_id"]] -= 1
+                        added.append(entry(transaction))
+
+                count, last_id = len(transactions), transactions[-1]["transaction_id"] if transactions else None
+            else:
+                count, last_id = count + len(added), added[-1][1] if added else last_id
+
+            balance.update(added, removed)
+
+            if balance.balance_cents() != utils.to_cents(account["balance"]):
+                # The stored balance and the transactions disagree, start over from the transactions
+                balance = self._balances[account_id] = RunningBalance()
+                balance.update([entry(transaction) for transaction in backend.iter_transactions(account_id)], Counter())
+
+        self.states[account_id] = (count, last_id, account["balance"])
+        return True
+
+    def sync(self, backend: backends.Backend, signature: tuple, accounts: list, full: bool = True) -> bool:
+
+        '''
+        Brings the index up to date with the ledger for the given accounts
+        (without transactions). full says they are all accounts of the ledger,
+        so those missing from it are dropped. Returns False if nothing
+        changed, without reading the ledger if its files did not change.
+        '''
+
+        if signature == self.signature:
+            return False
+
+        changed = False
+        for account in accounts:
+            changed = self.sync_account(backend, account) or changed
+
+        if full:
+            for account_id in set(self.states) - {account["id"] for account in accounts}:
+                self._drop(account_id)
+            # Only now every account matches the ledger
+            self.signature = signature
+            changed = True
+
+        return changed
+
+
+# -------------------- BALANCE COMMAND --------------------
+@click.command()
+@click.argument("id", type=click.STRING, required=False, default=None)
+@click.option("--as-of", "as_of", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Show the balance at the end of this day (YYYY-MM-DD). Defaults to today.")
+@click.option("--pending/--no-pending", default=True, help="Include scheduled postings that are due but not posted yet. Included by default.")
+@click.pass_obj
+def balance(obj: dict, id: str | None, as_of, pending: bool):
+    '''
+    Shows the balance of accounts at the end of a day.
+
+    ID is the unique ID of the account. Without it every account is listed.
+
+    Balances come from running balances kept next to the ledger, which are
+    updated with the changes since the last query, so a query never replays
+    every transaction. Days before a `stash compact` cut are answered from
+    the archive. Scheduled postings that are due but not posted by `stash
+    schedule run` yet are added on top.
+    '''
+
+    ledger_path = obj["path"]
+    backend = backends.get_backend(obj)
+    as_of = as_of or datetime.now()
+    day = as_of.strftime("%Y-%m-%d")
+
+    if id is not None:
+        account = backend.get_account(id, transactions=False)
+        if account is None:
+            click.echo(f"{click.style('ERROR:', fg='black', bg='red')} Cannot find the account. Please re-check the ID.")
+            return
+        accounts = [account]
+    else:
+        accounts = backend.accounts()
+        if not accounts:
+            click.echo(f"{click.style('INFO:', bg='blue')} There are no accounts in stash to show balances of.")
+            return
+
+    index = BalanceIndex.load(ledger_path)
+    if index.sync(backend, search.ledger_signature(ledger_path), accounts, full=id is None):
+        index.save(ledger_path)
+
+    # Everything dated before the start of the next day
+    end = columns.to_timestamp(as_of.strftime("%d-%m-%Y"), "00:00:00") + columns.SECONDS_PER_DAY
+    cuts = archive.account_cuts(ledger_path)
+
+    balances = {}
+    with tracing.phase("index query"):
+        for account in accounts:
+            if day < cuts.get(account["id"], ""):
+                # The live ledger only has the opening balance of the archived days
+                transactions = archive.iter_statement(backend, ledger_path, account["id"], until=day)
+                balances[account["id"]] = sum(utils.signed_cents(transaction) for transaction in transactions)
+            else:
+                balances[account["id"]] = index.balance(account["id"]).as_of(end)
+
+    # Computed from the schedules, nothing is written
+    scheduled = scheduler.pending(backend, ledger_path, [account["id"] for account in accounts], as_of.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)) if pending else {}
+    for account_id, transactions in scheduled.items():
+        balances[account_id] += sum(utils.signed_cents(transaction) for transaction in transactions)
+    pending_note = f"-- Includes {sum(map(len, scheduled.values()))} scheduled posting(s) not posted yet, see `stash schedule run`" if scheduled else None
+
+    currency = obj["currency"]
+    if id is not None:
+        amount = f"{currency} {utils.from_cents(balances[id])}"
+        click.echo(f"-- Account: {click.style(id, fg='yellow')} ({account['full_name']})")
+        click.echo(f"-- Balance at the end of {day}: {click.style(amount, fg='cyan')}")
+        if pending_note:
+            click.echo(pending_note)
+        return
+
+    with tracing.phase("rendering"):
+        rendered = tabulate.tabulate(
+            [
+                [account["id"], account["full_name"], click.style(f"{currency} {utils.from_cents(balances[account['id']])}", fg="cyan")]
+                for account in accounts
+            ],
+            ["id", "full_name", f"balance on {day}"],
+            tablefmt="grid"
+        )
+
+    total = f"{currency} {utils.from_cents(sum(balances.values()))}"
+    click.echo(click.style(f"Balances of all accounts at the end of {day}", fg="yellow"))
+    click.echo(rendered)
+    click.echo(f"-- Total: {click.style(total, fg='cyan')}")
+    if pending_note:
+        click.echo(pending_note)
@@ -0,0 +1,198 @@
+import shlex
+import time
+import click
+from stash_basic import accounts_handler, backends, transactions_handler, utils
+
+
+# -------------------- OPERATIONS --------------------
+# Operation name -> the command whose arguments and options it takes
+OPERATIONS = {
+    "add": accounts_handler.add,
+    "credit": transactions_handler.credit,
+    "debit": transactions_handler.debit,
+    "delete": transactions_handler.delete
+}
+
+# Lines may also be written like the stash command they replace
+COMMAND_ALIASES = {
+    ("accounts", "add"): "add",
+    ("transactions", "credit"): "credit",
+    ("transactions", "debit"): "debit",
+    ("transactions", "delete"): "delete"
+}
+
+class LineError(Exception):
+
+    '''
+    Raised for an operation line that cannot be applied.
+    '''
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+
+
+def parse_line(line_number: int, line: str) -> tuple | None:
+
+    '''
+    Turns an operation line into (operation, parameters), or None for blank
+    and comment lines. Arguments and options are parsed and converted by the
+    matching stash command, so they are exactly the ones it accepts.
+    '''
+
+    try:
+        words = shlex.split(line, comments=True)
+    except ValueError as error:
+        raise LineError(line_number, str(error))
+
+    if words[:1] == ["stash"]:
+        words = words[1:]
+    if not words:
+        return None
+
+    operation = COMMAND_ALIASES.get(tuple(words[:2]))
+    if operation is not None:
+        arguments = words[2:]
+    else:
+        operation, arguments = words[0], words[1:]
+
+    if operation not in OPERATIONS:
+        raise LineError(line_number, f"unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+
+    try:
+        with OPERATIONS[operation].make_context(operation, arguments) as ctx:
+            return operation, ctx.params
+    except click.exceptions.Exit:
+        raise LineError(line_number, "--help is not an operation")
+    except click.ClickException as error:
+        raise LineError(line_number, error.format_message())
+
+class Validator:
+
+    '''
+    Checks operations against the ledger as it will be once the operations
+    before them are applied, without changing anything.
+    '''
+
+    def __init__(self, backend: backends.Backend):
+        self.backend = backend
+        self.accounts = {}
+        self.posted = {}
+        self.deleted = set()
+
+    def account_exists(self, account_id: str) -> bool:
+        if account_id not in self.accounts:
+            self.accounts[account_id] = self.backend.get_account(account_id, transactions=False) is not None
+        return self.accounts[account_id]
+
+    def check(self, line_number: int, operation: str, params: dict, transaction_id: int | None) -> None:
+        if operation == "add":
+            account_id = utils.create_unique_id(params["full_name"], params["dob"])
+            if self.account_exists(account_id):
+                raise LineError(line_number, f"account {account_id!r} already exists")
+            self.accounts[account_id] = True
+
+        elif operation in ("credit", "debit"):
+            if not self.account_exists(params["id"]):
+                raise LineError(line_number, f"account {params['id']!r} not found")
+            self.posted.setdefault(params["id"], set()).add(transaction_id)
+
+        else:
+            account_id, transaction_id = params["account_id"], params["transaction_id"]
+            if not self.account_exists(account_id):
+                raise LineError(line_number, f"account {account_id!r} not found")
+            if (account_id, transaction_id) in self.deleted:
+                raise LineError(line_number, f"transaction {transaction_id} is already deleted by an earlier line")
+
+            exists = transaction_id in self.posted.get(account_id, ()) or self.backend.get_transaction(account_id, transaction_id) is not None
+            if not exists:
+                raise LineError(line_number, f"transaction {transaction_id} not found in account {account_id!r}")
+            self.deleted.add((account_id, transaction_id))
+
+
+def apply(backend: backends.Backend, operation: str, params: dict, transaction: dict | None) -> None:
+
+    '''
+    Applies one validated operation to the backend.
+    '''
+
+    if operation == "add":
+        backend.add_account(accounts_handler.new_account(params["full_name"], params["email"], params["dob"]))
+    elif operation in ("credit", "debit"):
+        backend.add_transaction(params["id"], transaction)
+    else:
+        backend.delete_transaction(params["account_id"], params["transaction_id"])
+
+
+# -------------------- BATCH COMMAND --------------------
+@click.command()
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"), default="-")
+@click.option("--all-or-nothing", is_flag=True, help="Apply nothing if any line is invalid, instead of skipping the invalid lines.")
+@click.pass_obj
+def batch(obj: dict, file, all_or_nothing: bool):
+    '''
+    Applies many operations with a single write at the end.
+
+    FILE has one operation per line and defaults to stdin. Operations take
+    the same arguments and options as the commands they stand for:
+
+    \b
+      add FULL_NAME EMAIL DOB
+      credit ID AMOUNT [--desc DESCRIPTION]
+      debit ID AMOUNT [--desc DESCRIPTION]
+      delete ACCOUNT_ID TRANSACTION_ID
+
+    Lines may also start with the full command, e.g. "stash transactions
+    credit ...". Blank lines and everything after # are ignored.
+
+    All lines are validated first. Invalid lines are reported and skipped
+    unless --all-or-nothing is given.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    start = time.perf_counter()
+    backend = backends.get_backend(obj)
+    validator = Validator(backend)
+
+    # Parse and validate every line before anything is written
+    operations = []
+    errors = []
+    for line_number, line in enumerate(file, start=1):
+        try:
+            parsed = parse_line(line_number, line)
+            if parsed is None:
+                continue
+
+            operation, params = parsed
+            transaction = None
+            if operation in ("credit", "debit"):
+                transaction = transactions_handler.new_transaction(operation.upper(), params["amount"], params["description"])
+
+            validator.check(line_number, operation, params, transaction["transaction_id"] if transaction else None)
+            operations.append((operation, params, transaction))
+        except LineError as error:
+            errors.append(error)
+
+    if errors:
+        for error in errors[:20]:
+            click.echo(f"{click.style('ERROR:', bg='red')} {error}")
+        if len(errors) > 20:
+            click.echo(f"... and {len(errors) - 20} more errors")
+
+        if all_or_nothing:
+            click.echo(click.style("Nothing was applied. Fix the lines above or leave out --all-or-nothing.", fg="yellow"))
+            raise SystemExit(1)
+
+    # Apply everything and commit once
+    with backend.batch():
+        for operation, params, transaction in operations:
+            apply(backend, operation, params, transaction)
+
+    elapsed = time.perf_counter() - start
+    counts = {operation: sum(1 for applied, _, _ in operations if applied == operation) for operation in OPERATIONS}
+
+    click.echo(click.style(f"Applied {len(operations)} operations in one commit.", fg="green"))
+    click.echo(f"-- Accounts added: {click.style(str(counts['add']), fg='cyan')}, credits: {click.style(str(counts['credit']), fg='cyan')}, debits: {click.style(str(counts['debit']), fg='cyan')}, deletes: {click.style(str(counts['delete']), fg='cyan')}")
+    click.echo(f"-- Skipped lines: {click.style(str(len(errors)), fg='yellow')}")
+    click.echo(f"-- Time: {click.style(f'{elapsed:.2f}s', fg='cyan')}")
@@ -0,0 +1,200 @@
+import os
+import hashlib
+import click
+from stash_basic import columns, tracing, utils
+
+
+# -------------------- CACHE SETTINGS --------------------
+# The parsed ledger is kept next to it in <ledger>.cache, the counters in <ledger>.cache.stats
+CACHE_SUFFIX = ".cache"
+STATS_SUFFIX = ".cache.stats"
+
+# Caches written by another cache format are ignored (see utils.load_sidecar())
+MAGIC = b"STASHC02"
+STATS_MAGIC = b"STASHT01"
+
+# Bytes hashed from the start and from the end of the ledger
+SAMPLE_BYTES = 64 * 1024
+
+EMPTY_STATS = {"hits": 0, "misses": 0, "rebuilds": 0, "saved_seconds": 0.0, "parse_seconds": 0.0}
+
+def cache_path(ledger_path: str) -> str:
+    return ledger_path + CACHE_SUFFIX
+
+def stats_path(ledger_path: str) -> str:
+    return ledger_path + STATS_SUFFIX
+
+def fingerprint(ledger_path: str) -> tuple | None:
+
+    '''
+    Returns what a cache must match to be used for the ledger: its
+    modification time, size and inode plus a hash of its first and last
+    bytes. The hash catches a ledger rewritten within the time resolution of
+    the file system without reading the whole file. None if it does not exist.
+    '''
+
+    signature = utils.file_signature(ledger_path)
+    if signature is None:
+        return None
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(ledger_path, "rb") as ledger_file:
+        digest.update(ledger_file.read(SAMPLE_BYTES))
+        if signature[1] > SAMPLE_BYTES:
+            ledger_file.seek(max(SAMPLE_BYTES, signature[1] - SAMPLE_BYTES))
+            digest.update(ledger_file.read(SAMPLE_BYTES))
+
+    return signature + (digest.hexdigest(),)
+
+
+def load(ledger_path: str, expected: tuple) -> list | None:
+
+    '''
+    Returns the accounts stored in the cache of the ledger, or None if there
+    is no cache or it does not match the expected fingerprint.
+    '''
+
+    with tracing.phase("cache read"):
+        contents = utils.load_sidecar(cache_path(ledger_path), MAGIC, header=expected)
+    if contents is None:
+        # Missing, for another ledger or otherwise unreadable, rebuilt from the ledger
+        return None
+
+    with tracing.phase("cache decode"):
+        for account in contents:
+            if isinstance(account["transactions"], tuple):
+                account["transactions"] = columns.TransactionColumns.unpack(account["transactions"])
+
+    return contents
+
+def store(ledger_path: str, contents: list, expected: tuple) -> None:
+
+    '''
+    Writes the accounts to the cache of the ledger, tagged with the
+    fingerprint of the ledger file they were read from or written to.
+
+    The cache is only an optimization: it is not synced to disk and failing
+    to write it is ignored.
+    '''
+
+    if expected is None:
+        return
+
+    with tracing.phase("cache write"):
+        accounts = []
+        for account in contents:
+            transactions = account["transactions"]
+            if isinstance(transactions, columns.TransactionColumns):
+                transactions = transactions.pack()
+            accounts.append(dict(account, transactions=transactions))
+
+        utils.save_sidecar(cache_path(ledger_path), MAGIC, accounts, header=expected)
+
+def remove(ledger_path: str) -> bool:
+
+    '''
+    Removes the cache and its counters. Returns True if there was a cache.
+    '''
+
+    existed = os.path.exists(cache_path(ledger_path))
+    for path in (cache_path(ledger_path), stats_path(ledger_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    return existed
+
+
+# -------------------- CACHE STATISTICS --------------------
+def read_stats(ledger_path: str) -> dict:
+    return dict(EMPTY_STATS, **(utils.load_sidecar(stats_path(ledger_path), STATS_MAGIC) or {}))
+
+def record(ledger_path: str, hit: bool = False, miss: bool = False, rebuild: bool = False, seconds: float = 0.0) -> None:
+
+    '''
+    Updates the counters of the cache. A miss records how long parsing the
+    ledger took (seconds), a hit how long loading the cache took, so the
+    difference adds up to the time the cache saved.
+
+    Concurrent commands may overwrite each other's update, the counters are
+    only meant to give an idea of how well the cache works.
+    '''
+
+    stats = read_stats(ledger_path)
+    if hit:
+        stats["hits"] += 1
+        stats["saved_seconds"] += max(stats["parse_seconds"] - seconds, 0.0)
+    if miss:
+        stats["misses"] += 1
+        stats["parse_seconds"] = seconds
+    if rebuild:
+        stats["rebuilds"] += 1
+
+    utils.save_sidecar(stats_path(ledger_path), STATS_MAGIC, stats)
+
+
+# -------------------- CACHE COMMANDS --------------------
+@click.group()
+@click.pass_context
+def cache(ctx):
+    '''
+    Inspect or clear the cache of the parsed ledger.
+
+    Read-only commands of the json backend load the ledger from a binary
+    copy next to it instead of parsing the JSON file, as long as the file
+    did not change. The copy is rebuilt after every write.
+    '''
+    ctx.ensure_object(dict)
+    tracing.label(ctx.invoked_subcommand)
+
+    if not ctx.obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+@cache.command()
+@click.pass_obj
+def stats(obj: dict):
+    '''
+    Shows how often the cache was used and how much time it saved.
+    '''
+
+    ledger_path = obj["path"]
+    counters = read_stats(ledger_path)
+    lookups = counters["hits"] + counters["misses"]
+
+    if obj.get("backend", "json") != "json":
+        status = f"not used by the {obj['backend']} backend"
+    elif not obj.get("cache", True):
+        status = "disabled"
+    elif not os.path.exists(cache_path(ledger_path)):
+        status = "empty"
+    elif load(ledger_path, fingerprint(ledger_path)) is None:
+        status = "outdated, rebuilt on next use"
+    else:
+        status = "up to date"
+
+    signature = utils.file_signature(cache_path(ledger_path))
+    size = f"{signature[1] / 1024:,.0f} KB" if signature else "-"
+    hit_rate = f"{counters['hits'] / lookups:.1%}" if lookups else "-"
+    parse_time = f"{counters['parse_seconds']:.3f}s"
+    saved_time = f"{counters['saved_seconds']:.2f}s"
+
+    click.echo(f"-- Cache: {click.style(cache_path(ledger_path), fg='yellow')}")
+    click.echo(f"-- Status: {click.style(status, fg='cyan')}")
+    click.echo(f"-- Size: {click.style(size, fg='cyan')}")
+    click.echo(f"-- Hits: {click.style(str(counters['hits']), fg='cyan')}, misses: {click.style(str(counters['misses']), fg='cyan')}, rebuilds after writes: {click.style(str(counters['rebuilds']), fg='cyan')}")
+    click.echo(f"-- Hit rate: {click.style(hit_rate, fg='cyan')}")
+    click.echo(f"-- Last parse of the ledger: {click.style(parse_time, fg='cyan')}")
+    click.echo(f"-- Time saved: {click.style(saved_time, fg='green')}")
+
+@cache.command()
+@click.pass_obj
+def clear(obj: dict):
+    '''
+    Deletes the cache and resets its statistics.
+    '''
+
+    if remove(obj["path"]):
+        click.echo(click.style("Cache cleared.", fg="green"))
+    else:
+        click.echo(f"{click.style('INFO:', bg='blue')} There is no cache to clear.")
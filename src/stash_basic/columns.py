@@ -0,0 +1,235 @@
+import sys
+from array import array
+from datetime import date
+from functools import lru_cache
+from collections.abc import Sequence
+from stash_basic import utils
+
+
+# -------------------- COLUMN SETTINGS --------------------
+# Timestamps are the seconds since 1970-01-01 00:00:00 of the wall clock time
+# the transaction was recorded at, so they turn back into the same date and time
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+
+# Keys of the compact on-disk encoding of a list of transactions
+COLUMN_KEYS = ("transaction_id", "timestamp", "cents", "debit", "description")
+
+# Joins the descriptions packed for the cache, unless one of them contains it
+PACK_SEPARATOR = "\x00"
+
+@lru_cache(maxsize=65536)
+def _day_seconds(transaction_date: str) -> int:
+    # Ledgers have many transactions per day, parse every date only once
+    return (date(int(transaction_date[6:]), int(transaction_date[3:5]), int(transaction_date[:2])).toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+@lru_cache(maxsize=65536)
+def _day_string(day: int) -> str:
+    # The other way round, exports and statements format every day only once
+    moment = date.fromordinal(day + EPOCH_ORDINAL)
+    return f"{moment.day:02d}-{moment.month:02d}-{moment.year}"
+
+def to_timestamp(transaction_date: str, transaction_time: str) -> int:
+
+    '''
+    Converts a transaction date (DD-MM-YYYY) and time (HH:MM:SS) to a timestamp.
+    '''
+
+    return _day_seconds(transaction_date) + int(transaction_time[:2]) * 3600 + int(transaction_time[3:5]) * 60 + int(transaction_time[6:8])
+
+def from_timestamp(timestamp: int) -> tuple:
+
+    '''
+    Converts a timestamp back to the transaction date (DD-MM-YYYY) and time (HH:MM:SS).
+    '''
+
+    day, seconds = divmod(timestamp, SECONDS_PER_DAY)
+    return _day_string(day), f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class TransactionColumns(Sequence):
+
+    '''
+    Memory-efficient list of transactions. Every field is kept in its own
+    column: IDs, timestamps and amounts (integer cents) in typed arrays and
+    the descriptions, which repeat a lot, as interned strings. That is a few
+    dozen bytes per transaction instead of a dictionary with six objects.
+
+    Indexing and iterating return transactions as the usual dictionaries,
+    created on the fly, and append(), extend() and pop() take and return
+    them, so the Ledger can use it in place of a list.
+    '''
+
+    __slots__ = ("ids", "timestamps", "cents", "debits", "descriptions")
+
+    def __init__(self, transactions=()):
+        self.ids = array("q")
+        self.timestamps = array("q")
+        self.cents = array("q")
+        self.debits = array("b")
+        self.descriptions = []
+        self.extend(transactions)
+
+    @classmethod
+    def decode(cls, columns: dict) -> "TransactionColumns":
+
+        '''
+        Builds the columns from their compact on-disk encoding (see encode()).
+        '''
+
+        transactions = cls()
+        transactions.ids = array("q", columns["transaction_id"])
+        transactions.timestamps = array("q", columns["timestamp"])
+        transactions.cents = array("q", columns["cents"])
+        transactions.debits = array("b", columns["debit"])
+        transactions.descriptions = [sys.intern(description) for description in columns["description"]]
+        return transactions
+
+    def encode(self) -> dict:
+
+        '''
+        Returns the compact on-disk encoding: one JSON list per column.
+        '''
+
+        return {
+            "transaction_id": self.ids.tolist(),
+            "timestamp": self.timestamps.tolist(),
+            "cents": self.cents.tolist(),
+            "debit": self.debits.tolist(),
+            "description": self.descriptions
+        }
+
+    def pack(self) -> tuple:
+
+        '''
+        Returns the columns as a tuple of flat values for the binary cache
+        (see cache.py). The descriptions are stored once each, joined into a
+        single string that splits much faster than a list of strings loads,
+        plus one index per transaction.
+        '''
+
+        table = list(dict.fromkeys(self.descriptions))
+        positions = {description: i for i, description in enumerate(table)}
+        codes = array("l", [positions[description] for description in self.descriptions])
+
+        joined = PACK_SEPARATOR.join(table)
+        if joined.count(PACK_SEPARATOR) == len(table) - 1:
+            table = joined
+
+        return (self.ids.tobytes(), self.timestamps.tobytes(), self.cents.tobytes(), self.debits.tobytes(), table, codes.tobytes())
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> "TransactionColumns":
+
+        '''
+        Builds the columns from the output of pack().
+        '''
+
+        ids, timestamps, cents, debits, table, codes = packed
+        transactions = cls()
+        transactions.ids.frombytes(ids)
+        transactions.timestamps.frombytes(timestamps)
+        transactions.cents.frombytes(cents)
+        transactions.debits.frombytes(debits)
+
+        # Repeated descriptions already share one string, like interned ones
+        if isinstance(table, str):
+            table = table.split(PACK_SEPARATOR)
+        transactions.descriptions = list(map(table.__getitem__, array("l", codes)))
+        return transactions
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _transaction(self, i: int) -> dict:
+        transaction_date, transaction_time = from_timestamp(self.timestamps[i])
+        return {
+            "transaction_id": self.ids[i],
+            "date": transaction_date,
+            "time": transaction_time,
+            "description": self.descriptions[i],
+            "type": "DEBIT" if self.debits[i] else "CREDIT",
+            "amount": utils.from_cents(self.cents[i])
+        }
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._transaction(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("transaction index out of range")
+        return self._transaction(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._transaction(i)
+
+    def append(self, transaction: dict) -> None:
+        self.ids.append(transaction["transaction_id"])
+        self.timestamps.append(to_timestamp(transaction["date"], transaction["time"]))
+        self.cents.append(utils.to_cents(transaction["amount"]))
+        self.debits.append(transaction["type"] == "DEBIT")
+        self.descriptions.append(sys.intern(transaction["description"]))
+
+    def extend(self, transactions) -> None:
+        # Collect plain lists first, appending to the arrays one by one is much slower
+        ids, timestamps, cents, debits, descriptions = [], [], [], [], []
+        for transaction in transactions:
+            ids.append(transaction["transaction_id"])
+            timestamps.append(to_timestamp(transaction["date"], transaction["time"]))
+            cents.append(utils.to_cents(transaction["amount"]))
+            debits.append(transaction["type"] == "DEBIT")
+            descriptions.append(sys.intern(transaction["description"]))
+
+        self.ids.fromlist(ids)
+        self.timestamps.fromlist(timestamps)
+        self.cents.fromlist(cents)
+        self.debits.fromlist(debits)
+        self.descriptions.extend(descriptions)
+
+    def pop(self, i: int = -1) -> dict:
+        transaction = self[i]
+        for column in (self.ids, self.timestamps, self.cents, self.debits, self.descriptions):
+            del column[i]
+        return transaction
+
+    def balance_cents(self) -> int:
+
+        '''
+        Returns the exact balance of the transactions in cents.
+        '''
+
+        return sum(-cents if debit else cents for cents, debit in zip(self.cents, self.debits))
+
+
+def encode(transactions) -> dict:
+
+    '''
+    Returns the compact on-disk encoding of a list of transactions.
+    '''
+
+    if not isinstance(transactions, TransactionColumns):
+        transactions = TransactionColumns(transactions)
+    return transactions.encode()
+
+def decode(transactions):
+
+    '''
+    Returns the transactions read from disk: TransactionColumns for the compact
+    encoding, or the plain list of dictionaries as it is.
+    '''
+
+    if isinstance(transactions, dict):
+        return TransactionColumns.decode(transactions)
+    return transactions
+
+def to_json(value):
+
+    '''
+    json.dumps() default hook that writes TransactionColumns as a plain list of transactions.
+    '''
+
+    if isinstance(value, TransactionColumns):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
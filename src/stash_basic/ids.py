@@ -0,0 +1,182 @@
+import bisect
+from datetime import datetime, timedelta
+from stash_basic import locking, utils
+
+
+# -------------------- ID LAYOUT --------------------
+# A transaction ID is the wall clock time of its transaction in milliseconds
+# since 1970-01-01 00:00:00, shifted left to make room for a sequence number:
+#
+#     transaction ID = milliseconds << SEQUENCE_BITS | sequence
+#
+# IDs sort by the date and time of their transaction, turn back into it and
+# fit the signed 64 bit integers of SQLite and the compact columns (until 2248).
+SEQUENCE_BITS = 20
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+EPOCH = datetime(1970, 1, 1)
+MILLISECONDS_PER_DAY = 86400 * 1000
+
+# The earliest supported moment. Every ID of this scheme is at least FIRST_ID,
+# the UNIX timestamps (seconds) used as IDs before are all below it.
+FIRST_MOMENT = datetime(1970, 1, 2)
+FIRST_ID = int((FIRST_MOMENT - EPOCH).total_seconds() * 1000) << SEQUENCE_BITS
+
+# Sequence numbers are handed out by a counter shared by every stash process
+# of the user, a block at a time, so concurrent writers never use the same one
+SEQUENCE_FILE = utils.CONFIG_DIR / "sequence"
+SEQUENCE_LOCK = utils.CONFIG_DIR / "sequence.lock"
+BLOCK_SIZE = 1024
+
+# Sequence numbers reserved by this process and the last ID it handed out for "now"
+_block = iter(())
+_last_id = 0
+
+def _reserve(count: int) -> range:
+
+    '''
+    Takes the next count sequence numbers from the shared counter.
+
+    The counter is not synced to disk: if a crash loses an update, numbers are
+    handed out again, but only for later milliseconds, so IDs stay unique.
+    '''
+
+    utils.CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+    with locking.lock(str(SEQUENCE_LOCK)):
+        try:
+            start = int(SEQUENCE_FILE.read_text())
+        except (OSError, ValueError):
+            start = 0
+        SEQUENCE_FILE.write_text(str(start + count))
+
+    return range(start, start + count)
+
+def _next_sequence() -> int:
+    global _block
+
+    sequence = next(_block, None)
+    if sequence is None:
+        _block = iter(_reserve(BLOCK_SIZE))
+        sequence = next(_block)
+    return sequence & SEQUENCE_MASK
+
+def milliseconds(moment: datetime) -> int:
+
+    '''
+    Returns the milliseconds since 1970-01-01 00:00:00 of a wall clock time.
+    '''
+
+    return (moment - EPOCH) // timedelta(milliseconds=1)
+
+def is_supported(moment: datetime) -> bool:
+    return moment >= FIRST_MOMENT
+
+def new_id(moment: datetime | None = None) -> int:
+
+    '''
+    Returns a new transaction ID for a transaction dated moment, or for now.
+
+    Two IDs only collide if they share the millisecond and their sequence
+    numbers are a multiple of 2^20 apart, so bulk imports and concurrent
+    writers get unique IDs. IDs for now are also strictly increasing within
+    the process, even if the clock is set back: the ID then moves on by a
+    millisecond and moment_of() gives the time to record.
+    '''
+
+    global _last_id
+
+    if moment is not None:
+        return milliseconds(moment) << SEQUENCE_BITS | _next_sequence()
+
+    transaction_id = milliseconds(datetime.now()) << SEQUENCE_BITS | _next_sequence()
+    if transaction_id <= _last_id:
+        transaction_id = ((_last_id >> SEQUENCE_BITS) + 1) << SEQUENCE_BITS | transaction_id & SEQUENCE_MASK
+
+    _last_id = transaction_id
+    return transaction_id
+
+def scheduled_id(moment: datetime, schedule_number: int) -> int:
+
+    '''
+    Returns the ID of the occurrence of a recurring posting (see
+    scheduler.py) dated moment. It is the same every time, so an occurrence
+    that was already posted is recognized. Sequence numbers are taken from
+    the top down, the shared counter hands them out from the bottom up.
+    '''
+
+    return milliseconds(moment) << SEQUENCE_BITS | (SEQUENCE_MASK - schedule_number) & SEQUENCE_MASK
+
+def moment_of(transaction_id: int) -> datetime:
+
+    '''
+    Returns the wall clock time (to the millisecond) a transaction ID stands for.
+    '''
+
+    return EPOCH + timedelta(milliseconds=transaction_id >> SEQUENCE_BITS)
+
+def is_sortable(transaction_id: int) -> bool:
+
+    '''
+    True for IDs of this scheme, False for the UNIX timestamps used before.
+    '''
+
+    return transaction_id >= FIRST_ID
+
+def matches(transaction_id: int, moment: datetime) -> bool:
+
+    '''
+    True if an ID of this scheme stands for the second of moment.
+    '''
+
+    return is_sortable(transaction_id) and (transaction_id >> SEQUENCE_BITS) // 1000 == milliseconds(moment) // 1000
+
+
+# -------------------- ID RANGES --------------------
+def day_of(transaction_id: int) -> int:
+
+    '''
+    Returns the day (days since 1970-01-01) an ID of this scheme stands for.
+    '''
+
+    return (transaction_id >> SEQUENCE_BITS) // MILLISECONDS_PER_DAY
+
+def day_number(day: str) -> int:
+
+    '''
+    Returns the days since 1970-01-01 of a YYYY-MM-DD date.
+    '''
+
+    return (datetime.fromisoformat(day) - EPOCH).days
+
+def window(transactions, since: str | None, until: str | None, key=day_of) -> tuple:
+
+    '''
+    Returns the positions (start, stop) of the transactions dated from since
+    to until (inclusive YYYY-MM-DD dates, None for no limit), found by binary
+    search in a list of IDs in day order (see is_ordered()). For a list of
+    transactions, key must return the day of a transaction.
+    '''
+
+    start = 0 if since is None else bisect.bisect_left(transactions, day_number(since), key=key)
+    stop = len(transactions) if until is None else bisect.bisect_right(transactions, day_number(until), lo=start, key=key)
+    return start, stop
+
+def is_ordered(transaction_ids) -> bool:
+
+    '''
+    True if every ID is of this scheme and their days never go back, i.e. the
+    transactions were posted in date order and window() works on them.
+
+    Only the day counts: writers that draw IDs at the same time may commit
+    them in the other order, which does not move any transaction to another
+    day (short of midnight).
+    '''
+
+    previous = 0
+    for transaction_id in transaction_ids:
+        if transaction_id < FIRST_ID:
+            return False
+        day = (transaction_id >> SEQUENCE_BITS) // MILLISECONDS_PER_DAY
+        if day < previous:
+            return False
+        previous = day
+    return True
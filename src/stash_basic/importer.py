@@ -0,0 +1,207 @@
+import csv
+import json
+import math
+import time
+import click
+from datetime import datetime, date
+from stash_basic import backends, ids
+
+
+# -------------------- PIPELINE STAGES --------------------
+class RowError(Exception):
+
+    '''
+    Raised for a row of the import file that cannot be turned into a transaction.
+    '''
+
+    def __init__(self, line: int | None, message: str):
+        super().__init__(f"line {line}: {message}" if line is not None else message)
+
+
+def read_rows(file, file_format: str):
+
+    '''
+    Streams the rows of a CSV (with a header line) or JSONL file as
+    (line number, dict) tuples.
+    '''
+
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield line_number, error
+
+def parse_timestamp(date_value: str, time_value: str) -> datetime:
+
+    '''
+    Parses a date in either YYYY-MM-DD or DD-MM-YYYY format and a time in
+    HH:MM:SS format. Raises ValueError for anything else. (Much cheaper than
+    datetime.strptime, which matters for millions of rows.)
+    '''
+
+    date_value = date_value.strip()
+    if len(date_value) == 10 and date_value[2] == "-":
+        date_value = date_value[6:] + date_value[2:6] + date_value[:2]
+
+    parsed = date.fromisoformat(date_value)
+    hour, minute, second = (int(part) for part in time_value.split(":"))
+    return datetime(parsed.year, parsed.month, parsed.day, hour, minute, second)
+
+def parse_rows(rows, default_account: str | None, now: datetime):
+
+    '''
+    Validates rows and turns them into (account ID, transaction) tuples.
+
+    Every row needs a finite, non-zero amount. The account comes from the
+    "account_id" column or default_account. The type comes from the "type"
+    column (CREDIT/DEBIT) or, if missing, from the sign of the amount; a
+    negative amount is always a debit, so a CREDIT row with one is invalid. "date" (YYYY-MM-DD or DD-MM-YYYY),
+    "time" (HH:MM:SS), "description" and "transaction_id" are optional. Without
+    a transaction_id the row gets a new ID for its date and time (see ids.py).
+
+    Invalid rows are yielded as RowError instances so the caller decides
+    whether to stop or skip them.
+    '''
+
+    default_date = now.strftime("%Y-%m-%d")
+    default_time = now.strftime("%H:%M:%S")
+
+    for line, row in rows:
+        if isinstance(row, Exception):
+            yield RowError(line, f"invalid JSON ({row.msg})")
+            continue
+
+        account_id = row.get("account_id") or default_account
+        if not account_id:
+            yield RowError(line, "no account_id given")
+            continue
+
+        try:
+            amount = float(row.get("amount", ""))
+        except (TypeError, ValueError):
+            yield RowError(line, f"invalid amount {row.get('amount')!r}")
+            continue
+
+        # float() takes "nan" and "inf", and round(abs()) would turn 0.001 into 0
+        if not math.isfinite(amount) or round(amount, 2) == 0:
+            yield RowError(line, f"invalid amount {row.get('amount')!r}")
+            continue
+
+        transaction_type = (row.get("type") or ("DEBIT" if amount < 0 else "CREDIT")).upper()
+        if transaction_type not in ("CREDIT", "DEBIT"):
+            yield RowError(line, f"invalid type {row.get('type')!r}")
+            continue
+
+        if transaction_type == "CREDIT" and amount < 0:
+            yield RowError(line, f"type {row.get('type')!r} does not match the negative amount {row.get('amount')!r}")
+            continue
+
+        try:
+            moment = parse_timestamp(row.get("date") or default_date, row.get("time") or default_time)
+        except ValueError:
+            yield RowError(line, f"invalid date/time {row.get('date')!r} {row.get('time')!r}")
+            continue
+
+        if not ids.is_supported(moment):
+            yield RowError(line, f"dates before {ids.FIRST_MOMENT:%Y-%m-%d} are not supported")
+            continue
+
+        try:
+            transaction_id = int(row["transaction_id"]) if row.get("transaction_id") else ids.new_id(moment)
+        except ValueError:
+            yield RowError(line, f"invalid transaction_id {row.get('transaction_id')!r}")
+            continue
+
+        # Given IDs must stand for the date and time of their row (or be old-style ones)
+        if ids.is_sortable(transaction_id) and not ids.matches(transaction_id, moment):
+            yield RowError(line, f"transaction_id {transaction_id} does not match the date and time of the row")
+            continue
+
+        yield account_id, {
+            "transaction_id": transaction_id,
+            "date": f"{moment.day:02d}-{moment.month:02d}-{moment.year}",
+            "time": f"{moment.hour:02d}:{moment.minute:02d}:{moment.second:02d}",
+            "description": row.get("description") or f"Amount {transaction_type}ED.",
+            "type": transaction_type,
+            "amount": round(abs(amount), 2)
+        }
+
+def group_by_account(postings, errors: list) -> dict:
+
+    '''
+    Collects the transactions of every account (in file order) and moves
+    invalid rows into errors.
+    '''
+
+    grouped = {}
+    for posting in postings:
+        if isinstance(posting, RowError):
+            errors.append(posting)
+        else:
+            account_id, transaction = posting
+            grouped.setdefault(account_id, []).append(transaction)
+
+    return grouped
+
+
+# -------------------- IMPORT COMMAND --------------------
+@click.command(name="import")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), default=None, help="The format of FILE. Defaults to the file extension.")
+@click.option("--account", "default_account", default=None, help="Account ID to use for rows without an account_id column.")
+@click.option("--skip-invalid", is_flag=True, help="Skip rows that fail validation instead of aborting the import.")
+@click.pass_obj
+def import_(obj: dict, file, file_format: str | None, default_account: str | None, skip_invalid: bool):
+    '''
+    Imports transactions in bulk from a CSV or JSONL bank export.
+
+    FILE is the export to import. Each row needs an amount and an account
+    (account_id column or --account). Optional columns are type, date,
+    time, description and transaction_id.
+
+    All rows are validated first and then written in a single commit.
+    '''
+
+    if file_format is None:
+        file_format = "jsonl" if file.name.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+    start = time.perf_counter()
+
+    # Stream and validate the rows, grouped per account
+    errors = []
+    grouped = group_by_account(parse_rows(read_rows(file, file_format), default_account, datetime.now()), errors)
+
+    # Check every referenced account once
+    backend = backends.get_backend(obj)
+    for account_id in list(grouped):
+        if backend.get_account(account_id, transactions=False) is None:
+            errors.append(RowError(None, f"account {account_id!r} not found ({len(grouped[account_id])} rows)"))
+            del grouped[account_id]
+
+    if errors:
+        for error in errors[:20]:
+            click.echo(f"{click.style('ERROR:', bg='red')} {error}")
+        if len(errors) > 20:
+            click.echo(f"... and {len(errors) - 20} more errors")
+
+        if not skip_invalid:
+            click.echo(click.style("Nothing was imported. Fix the rows above or use --skip-invalid.", fg="yellow"))
+            return
+
+    # Apply the batched balance updates and commit once
+    with backend.batch():
+        for account_id, transactions in grouped.items():
+            backend.add_transactions(account_id, transactions)
+
+    elapsed = time.perf_counter() - start
+    row_count = sum(len(transactions) for transactions in grouped.values())
+
+    click.echo(click.style(f"Imported {row_count} transactions into {len(grouped)} accounts.", fg="green"))
+    click.echo(f"-- Skipped rows: {click.style(str(len(errors)), fg='yellow')}")
+    click.echo(f"-- Time: {click.style(f'{elapsed:.2f}s', fg='cyan')} ({click.style(f'{row_count / elapsed if elapsed else 0:,.0f}', fg='cyan')} rows/second)")
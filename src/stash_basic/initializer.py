@@ -1,29 +1,33 @@
 import os
-import json
 import click
 from pathlib import Path
-from stash_basic import utils
+from stash_basic import utils, backends
 
 
 @click.command()
 @click.argument("folder_path", type=click.Path(file_okay=False, dir_okay=True))
-@click.option("--file_name", default="records.json", help="The name of the JSON file which will store all the data. Defaults to 'records.json'")
+@click.option("--file_name", default="records", help="The name of the file which will store all the data. Defaults to 'records' with the extension of the selected backend, e.g. 'records.json'")
 @click.option("--currency", default="€", help="The currency to set for all the accounts in Stash. Defaults to €.")
+@click.option("--backend", type=click.Choice(list(backends.BACKENDS)), default="json", help="The storage engine for the data. Defaults to json.")
+@click.option("--journal", is_flag=True, help="Record credits, debits and transaction deletes in an append-only journal instead of rewriting the JSON file every time.")
+@click.option("--compact", is_flag=True, help="Store transactions column-wise without indentation (json and sharded backends). Smaller files that load faster.")
+@click.option("--cache/--no-cache", default=True, help="Keep a binary copy of the parsed ledger next to it so read-only commands skip parsing the JSON file (json backend). Enabled by default.")
 @click.option("--reset", is_flag=True)
 @click.pass_obj
-def init(obj: dict, folder_path: str, file_name: str, currency: str, reset: bool):
+def init(obj: dict, folder_path: str, file_name: str, currency: str, backend: str, journal: bool, compact: bool, cache: bool, reset: bool):
 
     '''
     Initializes the Stash CLI for first use.
     
-    FOLDER_PATH is the directory path where the JSON file will be stored.
+    FOLDER_PATH is the directory path where the data file will be stored.
     '''
 
     # Run initialization only if no previous config found or reset flag is set
     if not obj or reset:
         # Make sure file_name contains the file extension
-        if ".json" not in file_name:
-            file_name = file_name + ".json"
+        extension = backends.BACKENDS[backend].extension
+        if not file_name.endswith(extension):
+            file_name = file_name + extension
 
         # Make sure directory path exists 
         Path(folder_path).mkdir(parents=True, exist_ok=True)
@@ -38,17 +42,26 @@ def init(obj: dict, folder_path: str, file_name: str, currency: str, reset: bool
         click.echo(f"-- Selected File Name: {click.style(file_name, fg="yellow")}")
         click.echo(f"-- Full Path: {click.style(full_file_path, fg="yellow")}")
         click.echo(f"-- Currency: {click.style(currency, fg="cyan")}")
+        click.echo(f"-- Backend: {click.style(backend, fg='cyan')}")
+        click.echo(f"-- Journal: {click.style('enabled' if journal else 'disabled', fg='cyan')}")
+        click.echo(f"-- Compact storage: {click.style('enabled' if compact else 'disabled', fg='cyan')}")
+        click.echo(f"-- Ledger cache: {click.style('enabled' if cache else 'disabled', fg='cyan')}")
 
-        # Create an empty JSON file (main JSON file to hold all data)
-        with open(full_file_path, "w") as json_file:
-            json.dump([], json_file, ensure_ascii=True)
-        
         # Create the config object
         config = {
             "path": Path(full_file_path).expanduser().resolve().as_posix(),
-            "currency": currency
+            "currency": currency,
+            "backend": backend,
+            "journal": journal,
+            "compact": compact,
+            "cache": cache
         }
 
+        # Create an empty ledger (main file to hold all data)
+        storage = backends.get_backend(config, local=True)
+        storage.create()
+        storage.close()
+
         # Save the config object
         utils.save_config(config)
 
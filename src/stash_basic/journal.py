@@ -0,0 +1,161 @@
+import os
+import json
+from stash_basic import tracing
+
+
+# -------------------- JOURNAL SETTINGS --------------------
+JOURNAL_SUFFIX = ".wal"
+ROTATED_SUFFIX = ".wal.checkpoint"
+CHECKPOINT_BYTES = 1024 * 1024
+
+def journal_path(ledger_path: str) -> str:
+
+    '''
+    Returns the path of the write-ahead log that belongs to a ledger file.
+    '''
+
+    return ledger_path + JOURNAL_SUFFIX
+
+def rotated_path(ledger_path: str) -> str:
+
+    '''
+    Returns the path the journal is moved to while a checkpoint is running.
+    '''
+
+    return ledger_path + ROTATED_SUFFIX
+
+def make_record(op: str, account_id: str, transaction: dict) -> dict:
+
+    '''
+    Builds a journal record. Every record has the same shape:
+    {"op": ..., "account": ..., "transaction": {...}, "commit": ...}
+
+    op is either "post" (a credit or debit was added) or "delete" (a tombstone
+    for a removed transaction, only the transaction_id is kept). commit is the
+    token of the writer that appended the record (see append()).
+    '''
+
+    if op == "delete":
+        transaction = {"transaction_id": transaction["transaction_id"]}
+
+    return {"op": op, "account": account_id, "transaction": transaction, "commit": None}
+
+def append(ledger_path: str, records: list, commit: str | None = None) -> None:
+
+    '''
+    Appends records to the journal in a single write and forces them to disk.
+    The cost of this call does not depend on the size of the ledger.
+
+    commit is stamped on every record so the writer can later tell whether its
+    records were already folded into the ledger file by another process.
+    The caller must hold the journal lock (see locking.py).
+    '''
+
+    for record in records:
+        record["commit"] = commit
+
+    with tracing.phase("serialization"):
+        lines = "".join(json.dumps(record, ensure_ascii=True, separators=(",", ":")) + "\n" for record in records)
+
+    with open(journal_path(ledger_path), "a") as journal_file:
+        with tracing.phase("file write"):
+            journal_file.write(lines)
+            journal_file.flush()
+        with tracing.phase("fsync"):
+            os.fsync(journal_file.fileno())
+
+def _read_file(path: str) -> list:
+    records = []
+
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "r") as journal_file:
+        for line in journal_file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Torn line from a crash in the middle of an append
+                continue
+
+    return records
+
+def read(ledger_path: str) -> list:
+
+    '''
+    Reads all the records that are not yet part of the ledger file: those of
+    a checkpoint in progress (see rotate()) followed by those in the journal.
+    '''
+
+    with tracing.phase("journal read"):
+        return _read_file(rotated_path(ledger_path)) + _read_file(journal_path(ledger_path))
+
+def apply_record(ledger, record: dict) -> None:
+
+    '''
+    Applies a single journal record to a Ledger. Records for accounts that no
+    longer exist are skipped.
+    '''
+
+    if ledger.account(record["account"]) is None:
+        return
+
+    if record["op"] == "post":
+        ledger.append_transactions(record["account"], [record["transaction"]])
+    elif record["op"] == "delete":
+        ledger.remove_transaction(record["account"], record["transaction"]["transaction_id"])
+
+def replay(ledger, records: list):
+
+    '''
+    Replays journal records on top of the Ledger loaded from the main file.
+    '''
+
+    for record in records:
+        apply_record(ledger, record)
+
+    return ledger
+
+def needs_checkpoint(ledger_path: str) -> bool:
+
+    '''
+    Returns True once the journal has grown past CHECKPOINT_BYTES.
+    '''
+
+    path = journal_path(ledger_path)
+    return os.path.exists(path) and os.path.getsize(path) >= CHECKPOINT_BYTES
+
+def rotate(ledger_path: str) -> None:
+
+    '''
+    Moves the journal aside at the start of a checkpoint, so other writers can
+    keep appending to a fresh journal while its records are folded into the
+    ledger file. Records left aside by a checkpoint that crashed are kept in
+    front. The caller must hold the journal lock.
+    '''
+
+    path = journal_path(ledger_path)
+    if not os.path.exists(path):
+        return
+
+    rotated = rotated_path(ledger_path)
+    if os.path.exists(rotated):
+        with open(path, "r") as journal_file, open(rotated, "a") as rotated_file:
+            rotated_file.write(journal_file.read())
+            rotated_file.flush()
+            os.fsync(rotated_file.fileno())
+        os.remove(path)
+    else:
+        os.replace(path, rotated)
+
+def discard_rotated(ledger_path: str) -> None:
+
+    '''
+    Removes the records moved aside by rotate(). Must only be called right
+    after the ledger file containing them was put in place, with the journal
+    lock held.
+    '''
+
+    rotated = rotated_path(ledger_path)
+    if os.path.exists(rotated):
+        os.remove(rotated)
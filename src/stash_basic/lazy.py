@@ -0,0 +1,46 @@
+import importlib
+import click
+from stash_basic import tracing
+
+
+class LazyGroup(click.Group):
+
+    '''
+    Click group whose subcommands are only imported when they are invoked.
+
+    lazy_subcommands maps each command name to ("module:attribute", short
+    help). The short help is what `--help` lists, so printing the help of a
+    group imports none of its commands (and none of their dependencies).
+    '''
+
+    def __init__(self, *args, lazy_subcommands: dict | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> list:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str):
+        if cmd_name not in self.commands and cmd_name in self.lazy_subcommands:
+            module_name, attribute = self.lazy_subcommands[cmd_name][0].split(":")
+            with tracing.phase("command import"):
+                module = importlib.import_module(module_name)
+
+            # Register the loaded command so it is only imported once
+            self.add_command(getattr(module, attribute), cmd_name)
+
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                if not command.hidden:
+                    rows.append((name, command.get_short_help_str(formatter.width - 6 - len(name))))
+            else:
+                rows.append((name, self.lazy_subcommands[name][1]))
+
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
@@ -0,0 +1,166 @@
+from stash_basic import ids, utils
+from stash_basic.columns import TransactionColumns
+
+
+class Ledger:
+
+    '''
+    In-memory model of the list of accounts stored in a JSON ledger.
+
+    Builds hash indexes once per load so lookups stay constant-time however
+    many accounts and transactions there are:
+    - account ID -> account
+    - account ID -> {transaction_id -> position in the account's transactions}
+
+    The transaction positions of an account are only indexed the first time a
+    transaction of that account is looked up, and re-indexed after a delete
+    shifted them. When two transactions share an ID the first one wins, which
+    matches the order the original linear scans used.
+
+    It also remembers which accounts have the IDs of their transactions in date
+    order (see ids.py), so date ranges can be found by binary search on them.
+    '''
+
+    def __init__(self, contents: list):
+        self.contents = contents
+        self._accounts = {account["id"]: account for account in contents}
+        self._positions = {}
+        self._ordered = {}
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def account(self, account_id: str) -> dict | None:
+
+        '''
+        Returns the account with the given ID or None.
+        '''
+
+        return self._accounts.get(account_id)
+
+    def add_account(self, account: dict) -> None:
+
+        '''
+        Appends a new account and indexes it.
+        '''
+
+        self.contents.append(account)
+        self._accounts[account["id"]] = account
+
+    def remove_account(self, account_id: str) -> dict | None:
+
+        '''
+        Removes the account with the given ID and returns it (or None).
+        '''
+
+        account = self._accounts.pop(account_id, None)
+        if account is not None:
+            self._positions.pop(account_id, None)
+            self._ordered.pop(account_id, None)
+            self.contents.remove(account)
+        return account
+
+    def _transaction_positions(self, account_id: str) -> dict:
+        positions = self._positions.get(account_id)
+        if positions is None:
+            positions = {}
+            transactions = self._accounts[account_id]["transactions"]
+
+            # Columns have the IDs at hand without creating every transaction
+            if isinstance(transactions, TransactionColumns):
+                transaction_ids = transactions.ids
+            else:
+                transaction_ids = (transaction["transaction_id"] for transaction in transactions)
+
+            for i, transaction_id in enumerate(transaction_ids):
+                positions.setdefault(transaction_id, i)
+            self._positions[account_id] = positions
+        return positions
+
+    def transaction_position(self, account_id: str, transaction_id: int) -> int | None:
+
+        '''
+        Returns the position of a transaction in its account's transactions,
+        or None if the account or the transaction does not exist.
+        '''
+
+        if account_id not in self._accounts:
+            return None
+        return self._transaction_positions(account_id).get(transaction_id)
+
+    def transaction(self, account_id: str, transaction_id: int) -> dict | None:
+
+        '''
+        Returns a transaction of an account or None.
+        '''
+
+        position = self.transaction_position(account_id, transaction_id)
+        if position is None:
+            return None
+        return self._accounts[account_id]["transactions"][position]
+
+    def append_transactions(self, account_id: str, transactions: list) -> float:
+
+        '''
+        Appends transactions to an account, updates its balance and returns it.
+        '''
+
+        account = self._accounts[account_id]
+        positions = self._positions.get(account_id)
+
+        if positions is not None:
+            offset = len(account["transactions"])
+            for i, transaction in enumerate(transactions, start=offset):
+                positions.setdefault(transaction["transaction_id"], i)
+
+        # Still in order if the new transactions continue it
+        if self._ordered.get(account_id):
+            tail = account["transactions"][-1:] + list(transactions)
+            self._ordered[account_id] = ids.is_ordered(transaction["transaction_id"] for transaction in tail)
+
+        account["transactions"].extend(transactions)
+        account["balance"] = utils.from_cents(utils.to_cents(account["balance"]) + sum(utils.signed_cents(transaction) for transaction in transactions))
+        return account["balance"]
+
+    def remove_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+
+        '''
+        Removes a transaction from an account, updates the balance and returns
+        the removed transaction (or None if it does not exist).
+        '''
+
+        position = self.transaction_position(account_id, transaction_id)
+        if position is None:
+            return None
+
+        account = self._accounts[account_id]
+        transaction = account["transactions"].pop(position)
+        account["balance"] = utils.from_cents(utils.to_cents(account["balance"]) - utils.signed_cents(transaction))
+
+        # Later positions shifted, re-index this account on the next lookup.
+        # Removing a transaction keeps the IDs in order, but may also restore it.
+        del self._positions[account_id]
+        if not self._ordered.get(account_id, True):
+            del self._ordered[account_id]
+        return transaction
+
+    def ids_ordered(self, account_id: str) -> bool:
+
+        '''
+        True if the IDs of an account's transactions are in date order, i.e.
+        ids.window() finds date ranges in them.
+        '''
+
+        ordered = self._ordered.get(account_id)
+        if ordered is None:
+            transactions = self._accounts[account_id]["transactions"]
+            if isinstance(transactions, TransactionColumns):
+                transaction_ids = transactions.ids
+            else:
+                transaction_ids = (transaction["transaction_id"] for transaction in transactions)
+
+            ordered = self._ordered[account_id] = ids.is_ordered(transaction_ids)
+        return ordered
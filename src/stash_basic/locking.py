@@ -0,0 +1,67 @@
+import os
+import time
+from contextlib import contextmanager
+from stash_basic import tracing
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+# -------------------- LOCK FILES --------------------
+COMMIT_LOCK_SUFFIX = ".lock"
+JOURNAL_LOCK_SUFFIX = ".wal.lock"
+
+def commit_lock_path(ledger_path: str) -> str:
+
+    '''
+    Returns the path of the lock that serializes rewrites of a ledger file.
+    '''
+
+    return ledger_path + COMMIT_LOCK_SUFFIX
+
+def journal_lock_path(ledger_path: str) -> str:
+
+    '''
+    Returns the path of the lock that guards the journal of a ledger file.
+    '''
+
+    return ledger_path + JOURNAL_LOCK_SUFFIX
+
+@contextmanager
+def lock(path: str, shared: bool = False):
+
+    '''
+    Holds an advisory lock on the file at path for the duration of the
+    with-block, waiting for other processes to release it first.
+
+    shared locks can be held by several readers at once. Windows has no
+    shared locks, so there every lock is exclusive.
+
+    Locks are not re-entrant: never acquire a lock that is already held by
+    the same process.
+    '''
+
+    with open(path, "a+") as lock_file:
+        with tracing.phase("lock wait"):
+            if os.name == "nt":
+                lock_file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after ~10 seconds, keep waiting
+                        time.sleep(0.1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
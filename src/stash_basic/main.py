@@ -1,50 +1,73 @@
 import click
-from stash_basic import accounts_handler, transactions_handler, initializer, utils
+from stash_basic import tracing, utils
+from stash_basic.lazy import LazyGroup
 
 # -------------------- MAIN CLI GROUP --------------------
-@click.group()
+# Sub-commands are only imported when they run, see lazy.py
+@click.group(cls=LazyGroup, lazy_subcommands={
+    "init": ("stash_basic.initializer:init", "Initializes the Stash CLI for first use."),
+    "backup": ("stash_basic.exporter:backup", "Backs up the ledger to a compressed JSONL file."),
+    "batch": ("stash_basic.batcher:batch", "Applies many operations with a single write."),
+    "cache": ("stash_basic.cache:cache", "Inspect or clear the cache of the parsed ledger."),
+    "compact": ("stash_basic.archive:compact", "Moves old transactions out of the live ledger into an archive segment."),
+    "export": ("stash_basic.exporter:export", "Exports transactions to a CSV or JSONL file."),
+    "migrate": ("stash_basic.migrator:migrate", "Converts the existing ledger to another storage backend."),
+    "migrate-ids": ("stash_basic.migrator:migrate_ids", "Gives old transactions sortable IDs."),
+    "reports": ("stash_basic.reports:reports", "Shows credit and debit totals per period, the top descriptions and a comparison of the accounts."),
+    "schedule": ("stash_basic.scheduler:schedule", "Defines recurring postings and posts them when they are due."),
+    "serve": ("stash_basic.server:serve", "Runs the Stash server in the foreground."),
+    "verify": ("stash_basic.verifier:verify", "Checks that every stored balance matches its transactions.")
+})
+@click.option("--trace", is_flag=True, envvar="STASH_TRACE", help="Print how long each phase of the command took to stderr. Also set by the STASH_TRACE environment variable.")
+@click.option("--trace-format", type=click.Choice(tracing.TRACE_FORMATS), default="human", envvar="STASH_TRACE_FORMAT", help="Print the trace as a table (human) or as a single JSON line (json).")
+@click.option("--trace-profile", type=click.Path(dir_okay=False), default=None, envvar="STASH_TRACE_PROFILE", help="Also run the command under cProfile and write the statistics to this file.")
 @click.pass_context
-def cli(ctx):
+def cli(ctx, trace: bool, trace_format: str, trace_profile: str | None):
     '''The CLI tool for recording all your money related transactions!'''
     ctx.ensure_object(dict)
-    ctx.obj.update(utils.load_config())
 
-# Add sub-commands to the main cli group
-cli.add_command(initializer.init)
+    if trace or trace_profile:
+        tracing.start(trace_format, trace_profile)
+        tracing.label(ctx.invoked_subcommand)
+        ctx.call_on_close(tracing.finish)
+
+    # The only config load of the command, sub-groups and commands use ctx.obj
+    ctx.obj.update(utils.load_config())
 
 # -------------------- ACCOUNTS GROUP --------------------
-@cli.group()
+@cli.group(cls=LazyGroup, lazy_subcommands={
+    "add": ("stash_basic.accounts_handler:add", "Creates a new account and adds it to Stash."),
+    "delete": ("stash_basic.accounts_handler:delete", "Deletes the account of the provided account ID."),
+    "summary": ("stash_basic.accounts_handler:summary", "Display all accounts on Stash with their details."),
+    "statement": ("stash_basic.accounts_handler:statement", "Prints the account statement for an account."),
+    "balance": ("stash_basic.balances:balance", "Shows the balance of accounts at the end of a day.")
+})
 @click.pass_context
 def accounts(ctx):
     '''
     Utilities to manage accounts.
     '''
     ctx.ensure_object(dict)
-    config = utils.load_config()
+    tracing.label(ctx.invoked_subcommand)
 
-    if not config:
+    if not ctx.obj:
         raise click.UsageError("No configuration found – run `stash init` first.")
 
-# Add sub-commands to accounts group
-accounts.add_command(accounts_handler.add)
-accounts.add_command(accounts_handler.delete)
-accounts.add_command(accounts_handler.summary)
-accounts.add_command(accounts_handler.statement)
-
 # -------------------- TRANSACTIONS GROUP --------------------
-@cli.group()
+@cli.group(cls=LazyGroup, lazy_subcommands={
+    "credit": ("stash_basic.transactions_handler:credit", "Adds money to an account."),
+    "debit": ("stash_basic.transactions_handler:debit", "Removes money from an account."),
+    "delete": ("stash_basic.transactions_handler:delete", "Remove a transaction from an account."),
+    "import": ("stash_basic.importer:import_", "Imports transactions in bulk from a CSV or JSONL bank export."),
+    "search": ("stash_basic.search:search", "Finds transactions by description, type, amount and date.")
+})
 @click.pass_context
 def transactions(ctx):
     '''
     Utilities to manage transactions.
     '''
     ctx.ensure_object(dict)
-    config = utils.load_config()
+    tracing.label(ctx.invoked_subcommand)
 
-    if not config:
+    if not ctx.obj:
         raise click.UsageError("No configuration found – run `stash init` first.")
-    
-# Add sub-commands to transactions group
-transactions.add_command(transactions_handler.credit)
-transactions.add_command(transactions_handler.debit)
-transactions.add_command(transactions_handler.delete)
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import csv
+import click
+import shutil
+from pathlib import Path
+from datetime import timedelta
+from stash_basic import utils, archive, backends, balances, columns, exporter, ids, scheduler, search, verifier
+from stash_basic.ledger import Ledger
+
+# Old and new ID of every transaction `stash migrate-ids` renumbered, next to the ledger
+ID_MAP_SUFFIX = ".id-map.csv"
+
+
+def copy_sidecars(ledger_path: str, new_path: str) -> list:
+
+    '''
+    Copies what is kept next to the ledger and named after it (the archive
+    segments, the schedules, the backups, the checksums of the last verify,
+    the search index and the running balances) next to the new ledger.
+    Returns the names of what was copied.
+    '''
+
+    copied = []
+    for path_of in (archive.archive_path, scheduler.schedules_path, exporter.backups_path, verifier.state_path, search.index_path, balances.index_path):
+        path = path_of(ledger_path)
+        if os.path.isdir(path):
+            shutil.copytree(path, path_of(new_path))
+        elif os.path.exists(path):
+            shutil.copy2(path, path_of(new_path))
+        else:
+            continue
+        copied.append(os.path.basename(path_of(new_path)))
+
+    # The backup chain goes on with the new ledger, `stash backup --incremental` only has its changes
+    marker = exporter.BackupMarker.load(exporter.backups_path(new_path))
+    if marker is not None and marker.ledger_path == os.path.abspath(ledger_path):
+        marker.ledger_path = os.path.abspath(new_path)
+        marker.save(exporter.backups_path(new_path))
+
+    return copied
+
+@click.command()
+@click.argument("backend", type=click.Choice(list(backends.BACKENDS)))
+@click.option("--file_name", default=None, help="The name of the new data file. Defaults to the current file name with the extension of the new backend.")
+@click.pass_obj
+def migrate(obj: dict, backend: str, file_name: str):
+
+    '''
+    Converts the existing ledger to another storage backend.
+
+    BACKEND is the storage engine to move the data to, e.g. sqlite.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    # Imported here, it loads asyncio which nothing else of this module needs
+    from stash_basic import server
+
+    if server.is_running(obj):
+        raise click.UsageError("Stop `stash serve` before migrating the ledger.")
+
+    current = obj.get("backend", backends.JsonBackend.name)
+    if current == backend:
+        click.echo(f"{click.style('INFO:', bg='blue')} Stash already uses the {click.style(backend, fg='cyan')} backend.")
+        return
+
+    # Work out the path of the new data file
+    extension = backends.BACKENDS[backend].extension
+    if file_name is None:
+        file_name = Path(obj["path"]).stem
+    if not file_name.endswith(extension):
+        file_name = file_name + extension
+
+    new_path = Path(os.path.join(os.path.dirname(obj["path"]), file_name)).expanduser().resolve().as_posix()
+    if os.path.exists(new_path):
+        raise click.UsageError(f"{new_path} already exists. Use --file_name to choose another file.")
+
+    # Copy all accounts and transactions over in one bulk write
+    source = backends.get_backend(obj, local=True)
+    contents = source.dump()
+    source.close()
+
+    config = dict(obj, path=new_path, backend=backend)
+    target = backends.get_backend(config, local=True)
+    target.create()
+    target.load(contents)
+    target.close()
+
+    # Archived transactions, schedules and backups are only found next to the ledger,
+    # the next verify still tells what changed since the last one and the indexes are not built again
+    copied = copy_sidecars(obj["path"], new_path)
+
+    # Switch over to the new ledger
+    utils.save_config(config)
+    obj.update(config)
+
+    transaction_count = sum(len(account["transactions"]) for account in contents)
+    click.echo(click.style(f"Migrated {len(contents)} accounts and {transaction_count} transactions to {backend}.", fg="green"))
+    click.echo(f"-- New Path: {click.style(new_path, fg='yellow')}")
+    if copied:
+        click.echo(f"-- Copied next to it: {click.style(', '.join(copied), fg='yellow')}")
+    click.echo(f"-- Old data file {click.style(source.path, fg='yellow')} was left untouched.")
+
+
+def renumber(contents: list) -> list:
+
+    '''
+    Gives every transaction with an old-style ID (a UNIX timestamp in seconds)
+    a new ID for its date and time (see ids.py), in posting order. Returns the
+    (account ID, old ID, new ID) of every renumbered transaction.
+    '''
+
+    renumbered = []
+    for account in contents:
+        transactions = []
+        for transaction in account["transactions"]:
+            if not ids.is_sortable(transaction["transaction_id"]):
+                moment = ids.EPOCH + timedelta(seconds=columns.to_timestamp(transaction["date"], transaction["time"]))
+                new_id = ids.new_id(moment)
+                renumbered.append((account["id"], transaction["transaction_id"], new_id))
+                transaction = dict(transaction, transaction_id=new_id)
+            transactions.append(transaction)
+        account["transactions"] = transactions
+
+    return renumbered
+
+@click.command(name="migrate-ids")
+@click.pass_obj
+def migrate_ids(obj: dict):
+
+    '''
+    Gives old transactions sortable IDs.
+
+    Transactions recorded before IDs carried the time to the millisecond
+    have their UNIX timestamp as ID, which is not unique when several are
+    recorded within a second. They get new IDs for their date and time, and
+    the old and new IDs are written to a CSV file next to the ledger.
+
+    Accounts whose transactions are then in ID order find date ranges (e.g.
+    `stash accounts statement --since`) by binary search on the IDs.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    # Imported here, it loads asyncio which nothing else of this module needs
+    from stash_basic import server
+
+    if server.is_running(obj):
+        raise click.UsageError("Stop `stash serve` before migrating the ledger.")
+
+    map_path = obj["path"] + ID_MAP_SUFFIX
+    backend = backends.get_backend(obj, local=True)
+    # An interrupted compaction names opening records by their old IDs, it is finished first
+    archive.recover(obj["path"], backend)
+
+    migrated = {}
+
+    def renumber_contents(contents: list) -> list | None:
+        renumbered = renumber(contents)
+        if not renumbered:
+            return None
+
+        # Keep the map of old to new IDs before anything changes
+        with open(map_path, "w", newline="") as map_file:
+            writer = csv.writer(map_file)
+            writer.writerow(["account_id", "old_transaction_id", "new_transaction_id"])
+            writer.writerows(renumbered)
+
+        # Archive segments name the opening balance records they left in the ledger
+        new_ids = {}
+        for account_id, old_id, new_id in renumbered:
+            new_ids.setdefault((account_id, old_id), new_id)
+
+        for segment_path in archive.segment_paths(obj["path"]):
+            header = archive.read_header(segment_path)
+            openings = {account_id: new_ids.get((account_id, account_header["opening"])) for account_id, account_header in header["accounts"].items()}
+            if any(openings.values()):
+                for account_id, new_id in openings.items():
+                    if new_id is not None:
+                        header["accounts"][account_id]["opening"] = new_id
+                archive.rewrite_header(segment_path, header)
+
+        migrated.update(contents=contents, renumbered=renumbered)
+        return contents
+
+    # Read and written without letting another write in between, a concurrent posting keeps its ID
+    try:
+        backend.rewrite(renumber_contents)
+    finally:
+        backend.close()
+
+    if not migrated:
+        click.echo(f"{click.style('INFO:', bg='blue')} Every transaction already has a sortable ID.")
+        return
+
+    contents, renumbered = migrated["contents"], migrated["renumbered"]
+    ledger = Ledger(contents)
+    ordered = sum(ledger.ids_ordered(account["id"]) for account in contents)
+    in_order = f"{ordered} of {len(contents)}"
+
+    click.echo(click.style(f"Gave {len(renumbered)} transactions of {len({account_id for account_id, _, _ in renumbered})} accounts new IDs.", fg="green"))
+    click.echo(f"-- ID map: {click.style(map_path, fg='yellow')}")
+    click.echo(f"-- Accounts in date order (date ranges found by ID): {click.style(in_order, fg='cyan')}")
@@ -0,0 +1,326 @@
+import time
+import itertools
+from array import array
+from datetime import date
+import click
+import tabulate
+from stash_basic import archive, backends, columns, tracing, utils
+
+try:
+    import numpy
+except ImportError:
+    # Optional (pip install stash-basic[reports]), the reports then use plain Python
+    numpy = None
+
+
+# -------------------- REPORT SETTINGS --------------------
+PERIODS = ("day", "week", "month", "quarter", "year")
+
+def period_label(day: date, period: str) -> str:
+
+    '''
+    Returns the label of the period a day falls in, e.g. 2024-03 for a month.
+    Labels sort in the order of their periods.
+    '''
+
+    if period == "day":
+        return day.isoformat()
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{day.year}-{day.month:02d}"
+    if period == "quarter":
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    return str(day.year)
+
+
+class ReportColumns:
+
+    '''
+    The transactions of every account in a report as flat columns, like
+    TransactionColumns but for the whole ledger: timestamps, amounts in
+    cents, debit flags, the position of the account and of the description
+    (in descriptions) of every transaction.
+    '''
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.cents = array("q")
+        self.debits = array("b")
+        self.accounts = array("q")
+        self.description_codes = array("q")
+        self.descriptions = {}
+
+    def add(self, account_number: int, transactions: columns.TransactionColumns) -> None:
+        self.timestamps.extend(transactions.timestamps)
+        self.cents.extend(transactions.cents)
+        self.debits.extend(transactions.debits)
+        self.accounts.extend(array("q", [account_number]) * len(transactions))
+
+        # Number the descriptions in the order they are first seen
+        descriptions = self.descriptions
+        for description in dict.fromkeys(transactions.descriptions):
+            descriptions.setdefault(description, len(descriptions))
+        self.description_codes.fromlist(list(map(descriptions.__getitem__, transactions.descriptions)))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+# -------------------- ENGINES --------------------
+class PythonEngine:
+
+    '''
+    Aggregates the columns with plain Python: one pass over them per step,
+    without creating any transaction dictionaries.
+    '''
+
+    name = "python"
+
+    def __init__(self, data: ReportColumns):
+        self.timestamps = data.timestamps
+        self.cents = data.cents
+        self.debits = data.debits
+        self.accounts = data.accounts
+        self.description_codes = data.description_codes
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def select(self, low: int | None, high: int | None) -> None:
+        rows = [i for i, timestamp in enumerate(self.timestamps) if (low is None or timestamp >= low) and (high is None or timestamp < high)]
+        for name in ("timestamps", "cents", "debits", "accounts", "description_codes"):
+            column = getattr(self, name)
+            setattr(self, name, [column[i] for i in rows])
+
+    def day_range(self) -> tuple:
+        return min(self.timestamps) // columns.SECONDS_PER_DAY, max(self.timestamps) // columns.SECONDS_PER_DAY
+
+    def period_codes(self, first_day: int, period_of_day: list) -> list:
+        return [period_of_day[timestamp // columns.SECONDS_PER_DAY - first_day] for timestamp in self.timestamps]
+
+    def totals(self, codes, size: int) -> tuple:
+
+        '''
+        Returns the credits, debits (both in cents) and number of
+        transactions of every group, codes giving the group of every row.
+        '''
+
+        credits, debits, counts = [0] * size, [0] * size, [0] * size
+        for code, cents, debit in zip(codes, self.cents, self.debits):
+            if debit:
+                debits[code] += cents
+            else:
+                credits[code] += cents
+            counts[code] += 1
+        return credits, debits, counts
+
+
+class NumpyEngine(PythonEngine):
+
+    '''
+    Aggregates the columns with NumPy: the arrays are used without copying
+    them and every step is a handful of vectorized operations.
+    '''
+
+    name = "numpy"
+
+    def __init__(self, data: ReportColumns):
+        self.timestamps = numpy.frombuffer(data.timestamps, dtype=numpy.int64)
+        self.cents = numpy.frombuffer(data.cents, dtype=numpy.int64)
+        self.debits = numpy.frombuffer(data.debits, dtype=numpy.int8)
+        self.accounts = numpy.frombuffer(data.accounts, dtype=numpy.int64)
+        self.description_codes = numpy.frombuffer(data.description_codes, dtype=numpy.int64)
+
+    def select(self, low: int | None, high: int | None) -> None:
+        mask = numpy.ones(len(self.timestamps), dtype=bool)
+        if low is not None:
+            mask &= self.timestamps >= low
+        if high is not None:
+            mask &= self.timestamps < high
+        for name in ("timestamps", "cents", "debits", "accounts", "description_codes"):
+            setattr(self, name, getattr(self, name)[mask])
+
+    def day_range(self) -> tuple:
+        return int(self.timestamps.min()) // columns.SECONDS_PER_DAY, int(self.timestamps.max()) // columns.SECONDS_PER_DAY
+
+    def period_codes(self, first_day: int, period_of_day: list):
+        days = self.timestamps // columns.SECONDS_PER_DAY
+        days -= first_day
+        return numpy.asarray(period_of_day, dtype=numpy.int64)[days]
+
+    def totals(self, codes, size: int) -> tuple:
+        # Credits of group i are summed in bin 2i, debits in bin 2i + 1. Sums
+        # of whole cents stay exact in float64 up to 2^53 cents.
+        sums = numpy.bincount(codes * 2 + self.debits, weights=self.cents, minlength=2 * size)
+        sums = sums.round().astype(numpy.int64)
+        counts = numpy.bincount(codes, minlength=size)
+        return sums[0::2].tolist(), sums[1::2].tolist(), counts.tolist()
+
+ENGINE = NumpyEngine if numpy is not None else PythonEngine
+
+
+# -------------------- REPORTS --------------------
+def gather(backend: backends.Backend, ledger_path: str, accounts: list, since: str | None) -> ReportColumns:
+
+    '''
+    Collects the transactions of the accounts into ReportColumns. When the
+    report reaches back before a `stash compact` cut, the archived
+    transactions are read too (every segment once) and take the place of
+    their opening balance records.
+    '''
+
+    account_ids = [account["id"] for account in accounts]
+    segments = archive.reached_segments(ledger_path, account_ids, since)
+    openings = archive.segment_openings(segments)
+
+    archived = {}
+    for transaction in archive.iter_archive(segments, account_ids):
+        archived.setdefault(transaction.pop("account_id"), []).append(transaction)
+
+    data = ReportColumns()
+    for number, account in enumerate(accounts):
+        transactions = backend.get_account(account["id"])["transactions"]
+        if account["id"] in openings:
+            live = archive.without_openings(transactions, openings[account["id"]])
+            transactions = columns.TransactionColumns(itertools.chain(archived.get(account["id"], ()), live))
+        elif not isinstance(transactions, columns.TransactionColumns):
+            transactions = columns.TransactionColumns(transactions)
+        data.add(number, transactions)
+
+    return data
+
+def build_report(data: ReportColumns, accounts: list, period: str, top: int, low: int | None, high: int | None) -> dict:
+
+    '''
+    Aggregates the columns into the report: totals per period, the top
+    descriptions by volume (credits plus debits) and totals per account, as
+    lists of (label, credits, debits, transactions) rows with cents.
+    '''
+
+    engine = ENGINE(data)
+    if low is not None or high is not None:
+        engine.select(low, high)
+
+    report = {"engine": engine.name, "transactions": len(engine), "periods": [], "descriptions": [], "accounts": []}
+    if not len(engine):
+        return report
+
+    # Label every day in the range once instead of every transaction
+    first_day, last_day = engine.day_range()
+    day_labels = [period_label(date.fromordinal(day + columns.EPOCH_ORDINAL), period) for day in range(first_day, last_day + 1)]
+    labels = sorted(set(day_labels))
+    positions = {label: i for i, label in enumerate(labels)}
+    period_of_day = [positions[label] for label in day_labels]
+
+    credits, debits, counts = engine.totals(engine.period_codes(first_day, period_of_day), len(labels))
+    report["periods"] = [row for row in zip(labels, credits, debits, counts) if row[3]]
+
+    descriptions = list(data.descriptions)
+    credits, debits, counts = engine.totals(engine.description_codes, len(descriptions))
+    ranked = sorted((i for i, count in enumerate(counts) if count), key=lambda i: credits[i] + debits[i], reverse=True)
+    report["descriptions"] = [(descriptions[i], credits[i], debits[i], counts[i]) for i in ranked[:top]]
+
+    credits, debits, counts = engine.totals(engine.accounts, len(accounts))
+    report["accounts"] = [(account, credits[i], debits[i], counts[i]) for i, account in enumerate(accounts)]
+    return report
+
+
+# -------------------- REPORTS COMMAND --------------------
+@click.command()
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only include transactions on or after this date (YYYY-MM-DD).")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only include transactions on or before this date (YYYY-MM-DD).")
+@click.option("--period", type=click.Choice(PERIODS), default="month", help="Group the totals by this period. Defaults to month.")
+@click.option("--account", "account_ids", multiple=True, help="Only include this account (can be given several times).")
+@click.option("--top", type=click.IntRange(min=0), default=5, help="Number of descriptions to list. Defaults to 5.")
+@click.pass_obj
+def reports(obj: dict, since, until, period: str, account_ids: tuple, top: int):
+
+    '''
+    Shows credit and debit totals per period, the top descriptions and a
+    comparison of the accounts.
+
+    Totals are computed on the transactions of all accounts (or the ones
+    given with --account) column by column, with NumPy when it is installed.
+    Transactions archived by `stash compact` are included when the date
+    range reaches back to them.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    start = time.perf_counter()
+    backend = backends.get_backend(obj)
+    accounts = backend.accounts()
+
+    if account_ids:
+        unknown = set(account_ids) - {account["id"] for account in accounts}
+        if unknown:
+            click.echo(f"{click.style('ERROR:', fg='black', bg='red')} Cannot find the account(s) {', '.join(sorted(unknown))}. Please re-check the IDs.")
+            return
+        accounts = [account for account in accounts if account["id"] in account_ids]
+
+    if not accounts:
+        click.echo(f"{click.style('INFO:', bg='blue')} There are no accounts in stash to report on.")
+        return
+
+    # Timestamps of the first moment in and the first moment after the range
+    low = columns.to_timestamp(since.strftime("%d-%m-%Y"), "00:00:00") if since else None
+    high = columns.to_timestamp(until.strftime("%d-%m-%Y"), "00:00:00") + columns.SECONDS_PER_DAY if until else None
+
+    data = gather(backend, obj["path"], accounts, since.strftime("%Y-%m-%d") if since else None)
+    with tracing.phase("aggregation"):
+        report = build_report(data, accounts, period, top, low, high)
+
+    if not report["transactions"]:
+        click.echo(f"{click.style('INFO:', bg='blue')} There are no transactions in the selected range.")
+        return
+
+    currency = obj["currency"]
+
+    def amount(cents: int) -> str:
+        return f"{currency} {utils.from_cents(cents)}"
+
+    def net(credits: int, debits: int) -> str:
+        return click.style(amount(credits - debits), fg="green" if credits >= debits else "red")
+
+    with tracing.phase("rendering"):
+        period_rows = [[label, amount(credits), amount(debits), net(credits, debits), count] for label, credits, debits, count in report["periods"]]
+        total_credits = sum(row[1] for row in report["accounts"])
+        total_debits = sum(row[2] for row in report["accounts"])
+        period_rows.append([click.style("Total", fg="yellow"), amount(total_credits), amount(total_debits), net(total_credits, total_debits), report["transactions"]])
+        period_table = tabulate.tabulate(period_rows, [period, "credits", "debits", "net", "transactions"], tablefmt="grid")
+
+        description_table = tabulate.tabulate(
+            [[description, amount(credits), amount(debits), net(credits, debits), count] for description, credits, debits, count in report["descriptions"]],
+            ["description", "credits", "debits", "net", "transactions"],
+            tablefmt="grid"
+        )
+
+        volume = (total_credits + total_debits) or 1
+        account_table = tabulate.tabulate(
+            [
+                [account["id"], account["full_name"], amount(credits), amount(debits), net(credits, debits), count, f"{(credits + debits) / volume:.1%}"]
+                for account, credits, debits, count in report["accounts"]
+            ],
+            ["id", "full_name", "credits", "debits", "net", "transactions", "share of volume"],
+            tablefmt="grid"
+        )
+
+    title = f"Totals per {period}"
+    if since:
+        title += f" since {since:%Y-%m-%d}"
+    if until:
+        title += f" until {until:%Y-%m-%d}"
+    click.echo(click.style(title, fg="yellow"))
+    click.echo(period_table)
+    if report["descriptions"]:
+        click.echo(click.style(f"Top {len(report['descriptions'])} descriptions by volume", fg="yellow"))
+        click.echo(description_table)
+    click.echo(click.style("Accounts", fg="yellow"))
+    click.echo(account_table)
+
+    engine = report["engine"] if numpy is not None else f"{report['engine']} (install numpy for faster reports)"
+    click.echo(f"-- Transactions: {click.style(str(report['transactions']), fg='cyan')} of {click.style(str(len(accounts)), fg='cyan')} accounts")
+    click.echo(f"-- Engine: {click.style(engine, fg='cyan')}, time: {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import mmap
+import tempfile
+from stash_basic import cache, columns, tracing, utils
+
+
+# -------------------- SCANNER SETTINGS --------------------
+# Where every account of a JSON ledger starts and ends lives next to it in <ledger>.offsets and can always be rebuilt
+OFFSETS_SUFFIX = ".offsets"
+MAGIC = b"STASHO01"
+
+# Bytes copied at a time from the old ledger when splicing
+COPY_BYTES = 16 * 1024 * 1024
+
+def offsets_path(ledger_path: str) -> str:
+    return ledger_path + OFFSETS_SUFFIX
+
+# A JSON string, whatever it contains
+_STRING = rb'"(?:[^"\\]++|\\.)*+"'
+
+def _containers(depth: int) -> bytes:
+    # An array or object nested at most depth levels deep, skipped in a single regular expression match
+    inner = rb'(?:[^"\[\]{}]++|' + _STRING + rb')*+'
+    for _ in range(depth):
+        container = rb'[\[{]' + inner + rb'[\]}]'
+        inner = rb'(?:[^"\[\]{}]++|' + _STRING + rb'|' + container + rb')*+'
+    return container
+
+# Account -> transactions -> transaction (or column)
+ACCOUNT = re.compile(_containers(3))
+# The ID of an account, which comes before its transactions
+ACCOUNT_ID = re.compile(rb'\{\s*(?:' + _STRING + rb'\s*:\s*(?:' + _STRING + rb'|[-+.\w]++)\s*,\s*)*?"id"\s*:\s*(' + _STRING + rb')')
+ARRAY_START = re.compile(rb'\s*\[\s*')
+SEPARATOR = re.compile(rb'\s*([,\]])\s*')
+
+
+class AccountRanges:
+
+    '''
+    The byte range of every account in a JSON ledger, found by walking the
+    top-level array through a memory map without parsing the accounts.
+
+    A walk stops as soon as it found the accounts it was asked for and the
+    next one continues where it stopped, so accounts near the start of the
+    ledger are found without reading the rest. What was found is kept next
+    to the ledger for as long as the file does not change.
+    '''
+
+    def __init__(self, fingerprint: tuple | None = None, ranges: dict | None = None, resume: int | None = 0):
+        self.fingerprint = fingerprint
+        self.ranges = ranges if ranges is not None else {}
+        # Where the walk continues, None once it reached the end of the array
+        self.resume = resume
+
+    @classmethod
+    def load(cls, ledger_path: str) -> "AccountRanges":
+
+        '''
+        Reads the ranges found so far in the ledger, or returns empty ones if
+        there are none, they cannot be read or the ledger changed since.
+        '''
+
+        ranges = cls(cache.fingerprint(ledger_path))
+        with tracing.phase("index read"):
+            data = utils.load_sidecar(offsets_path(ledger_path), MAGIC)
+        if data is None or data["fingerprint"] != ranges.fingerprint:
+            return ranges
+
+        ranges.ranges = data["ranges"]
+        ranges.resume = data["resume"]
+
+        return ranges
+
+    def save(self, ledger_path: str) -> None:
+        with tracing.phase("index write"):
+            utils.save_sidecar(offsets_path(ledger_path), MAGIC, {"fingerprint": self.fingerprint, "ranges": self.ranges, "resume": self.resume})
+
+    def find(self, data, account_ids: set) -> bool:
+
+        '''
+        Walks the ledger (a memory map of it) on from where the last walk
+        stopped until every one of account_ids has a range or the array ends.
+        Returns True if new ranges were found.
+
+        Raises ValueError if the ledger is not laid out the way this module
+        knows, the caller then parses it as a whole instead.
+        '''
+
+        missing = set(account_ids) - set(self.ranges)
+        position = self.resume
+        if not missing or position is None:
+            return False
+
+        with tracing.phase("ledger scan"):
+            if position == 0:
+                start = ARRAY_START.match(data, 0)
+                if start is None:
+                    raise ValueError("The ledger is not a JSON array.")
+                position = start.end()
+                if data[position:position + 1] == b"]":
+                    self.resume = None
+                    return True
+
+            while missing:
+                account = ACCOUNT.match(data, position) if data[position:position + 1] == b"{" else None
+                if account is None:
+                    raise ValueError(f"Cannot find the end of the account at byte {position}.")
+
+                account_id = ACCOUNT_ID.match(data, position, account.end())
+                if account_id is not None:
+                    account_id = json.loads(account_id.group(1))
+                else:
+                    # The ID comes after the transactions, only then the account is parsed
+                    account_id = json.loads(data[position:account.end()])["id"]
+
+                self.ranges.setdefault(account_id, (position, account.end()))
+                missing.discard(account_id)
+
+                separator = SEPARATOR.match(data, account.end())
+                if separator is None:
+                    raise ValueError(f"Unexpected data after the account at byte {account.end()}.")
+                position = separator.end()
+                if separator.group(1) == b"]":
+                    position = None
+                    break
+
+        self.resume = position
+        return True
+
+    def spliced(self, replaced: dict) -> "AccountRanges":
+
+        '''
+        Returns the ranges after the accounts in replaced ({account ID: new
+        length}) were replaced, every later range shifts by the difference.
+        '''
+
+        shifts = sorted((self.ranges[account_id][0], self.ranges[account_id][1], length) for account_id, length in replaced.items())
+
+        def shifted(position: int) -> int:
+            return position + sum(length - (end - start) for start, end, length in shifts if end <= position)
+
+        ranges = {}
+        for account_id, (start, end) in self.ranges.items():
+            new_start = shifted(start)
+            ranges[account_id] = (new_start, new_start + replaced[account_id] if account_id in replaced else shifted(end))
+        return AccountRanges(None, ranges, None if self.resume is None else shifted(self.resume))
+
+
+# -------------------- READING --------------------
+def read_accounts(ledger_path: str, account_ids: set) -> tuple:
+
+    '''
+    Returns (the accounts with the given IDs in ledger order, AccountRanges
+    of the ledger). Only their bytes are parsed, the rest of the ledger is
+    at most walked over once. IDs that are not in the ledger are left out.
+    '''
+
+    ranges = AccountRanges.load(ledger_path)
+
+    with open(ledger_path, "rb") as ledger_file:
+        if os.fstat(ledger_file.fileno()).st_size == 0:
+            raise ValueError("The ledger is empty.")
+
+        with mmap.mmap(ledger_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if ranges.find(data, account_ids):
+                ranges.save(ledger_path)
+
+            found = sorted(ranges.ranges[account_id] for account_id in account_ids if account_id in ranges.ranges)
+            with tracing.phase("ledger read"):
+                chunks = [data[start:end] for start, end in found]
+
+    with tracing.phase("json parse"):
+        return [json.loads(chunk) for chunk in chunks], ranges
+
+
+# -------------------- WRITING --------------------
+def _account_json(account: dict, compact: bool) -> str:
+    if compact:
+        return json.dumps(dict(account, transactions=columns.encode(account["transactions"])), separators=(",", ":"), ensure_ascii=True)
+    # One level into the indented top-level array
+    return json.dumps(account, indent=2, ensure_ascii=True, default=columns.to_json).replace("\n", "\n  ")
+
+def encode_account(account: dict, compact: bool) -> bytes:
+
+    '''
+    Returns the bytes of an account exactly as a rewrite of the whole ledger
+    lays them out (see encode_ledger()).
+    '''
+
+    return _account_json(account, compact).encode("ascii")
+
+def encode_ledger(contents: list, compact: bool) -> tuple:
+
+    '''
+    Returns (the JSON of the whole ledger, where each account starts and
+    ends in it), byte for byte what json.dumps() writes for the list.
+    '''
+
+    parts = [_account_json(account, compact) for account in contents]
+    if not parts:
+        return "[]", {}
+
+    opening, separator = ("[", ",") if compact else ("[\n  ", ",\n  ")
+    positions = {}
+    position = len(opening)
+    for account, part in zip(contents, parts):
+        positions.setdefault(account["id"], (position, position + len(part)))
+        position += len(part) + len(separator)
+
+    return opening + separator.join(parts) + ("]" if compact else "\n]"), positions
+
+def write_spliced(ledger_path: str, ranges: AccountRanges, replacements: dict) -> tuple:
+
+    '''
+    Writes a copy of the ledger with the accounts in replacements ({account
+    ID: bytes}) replaced to a temporary file in the same directory, forced
+    to disk. Every other byte is copied over as it is, no other account is
+    parsed or serialized. Returns (its path, AccountRanges of it); put it in
+    place with utils.replace_file().
+    '''
+
+    cuts = sorted((ranges.ranges[account_id], data) for account_id, data in replacements.items())
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ledger_path)), prefix=os.path.basename(ledger_path) + ".", suffix=".tmp")
+
+    try:
+        # mkstemp() makes the file private, the ledger keeps its permissions
+        if os.name != "nt":
+            os.fchmod(fd, utils.file_mode(ledger_path))
+        with os.fdopen(fd, "wb") as temp_file, open(ledger_path, "rb") as ledger_file:
+            with mmap.mmap(ledger_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with tracing.phase("file write"):
+                    position = 0
+                    for (start, end), replacement in cuts + [((len(data), len(data)), b"")]:
+                        while position < start:
+                            temp_file.write(data[position:min(start, position + COPY_BYTES)])
+                            position = min(start, position + COPY_BYTES)
+                        temp_file.write(replacement)
+                        position = end
+                    temp_file.flush()
+            with tracing.phase("fsync"):
+                os.fsync(temp_file.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return temp_path, ranges.spliced({account_id: len(data) for account_id, data in replacements.items()})
@@ -0,0 +1,341 @@
+import json
+import time
+import calendar
+from datetime import datetime, timedelta
+import click
+import tabulate
+from stash_basic import backends, ids, locking, tracing, utils
+
+
+# -------------------- SCHEDULE SETTINGS --------------------
+# The recurring postings of a ledger live next to it in <ledger>.schedules
+SCHEDULES_SUFFIX = ".schedules"
+LOCK_SUFFIX = ".schedules.lock"
+PERIODS = ("day", "week", "month", "year")
+
+def schedules_path(ledger_path: str) -> str:
+    return ledger_path + SCHEDULES_SUFFIX
+
+def lock_path(ledger_path: str) -> str:
+
+    '''
+    Returns the path of the lock that serializes changes to the schedules
+    and runs, so no occurrence is ever posted twice.
+    '''
+
+    return ledger_path + LOCK_SUFFIX
+
+def load(ledger_path: str) -> dict:
+
+    '''
+    Returns the schedules of a ledger: {"next": number of the next schedule,
+    "schedules": [schedule, ...]}. Numbers are never handed out twice.
+    '''
+
+    try:
+        with open(schedules_path(ledger_path), "r") as schedules_file:
+            return json.load(schedules_file)
+    except FileNotFoundError:
+        return {"next": 1, "schedules": []}
+
+def save(ledger_path: str, data: dict) -> None:
+    utils.atomic_write(schedules_path(ledger_path), json.dumps(data, indent=2))
+
+
+# -------------------- OCCURRENCES --------------------
+def occurrence(schedule: dict, n: int) -> datetime:
+
+    '''
+    Returns when the n-th occurrence (counted from 0) of a schedule is due.
+    Monthly and yearly ones due on a day a month does not have fall on the
+    last day of that month (e.g. the 31st on the 30th of April).
+    '''
+
+    start = datetime.strptime(f"{schedule['start']} {schedule['time']}", "%Y-%m-%d %H:%M:%S")
+    steps = n * schedule["interval"]
+
+    if schedule["every"] == "day":
+        return start + timedelta(days=steps)
+    if schedule["every"] == "week":
+        return start + timedelta(weeks=steps)
+
+    months = start.month - 1 + steps * (12 if schedule["every"] == "year" else 1)
+    year, month = start.year + months // 12, months % 12 + 1
+    return start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1]))
+
+def due(schedule: dict, before: datetime) -> list:
+
+    '''
+    Returns (n, moment) of every occurrence of a schedule that was not posted
+    yet and is due before the given moment, oldest first.
+    '''
+
+    occurrences = []
+    n = schedule["posted"]
+    while True:
+        moment = occurrence(schedule, n)
+        if moment >= before or (schedule["until"] is not None and moment.strftime("%Y-%m-%d") > schedule["until"]):
+            return occurrences
+        occurrences.append((n, moment))
+        n += 1
+
+def make_transaction(schedule: dict, moment: datetime) -> dict:
+
+    '''
+    Returns the transaction an occurrence posts. Its ID only depends on the
+    schedule and the moment (see ids.scheduled_id()), so it is the same
+    whether the occurrence is shown as pending or posted.
+    '''
+
+    return {
+        "transaction_id": ids.scheduled_id(moment, schedule["number"]),
+        "date": moment.strftime("%d-%m-%Y"),
+        "time": moment.strftime("%H:%M:%S"),
+        "description": schedule["description"],
+        "type": schedule["type"],
+        "amount": schedule["amount"]
+    }
+
+def pending(backend: backends.Backend, ledger_path: str, account_ids: list | None = None, before: datetime | None = None) -> dict:
+
+    '''
+    Returns {account ID: transactions in date order} of the occurrences that
+    are due (before now, or before the given moment if earlier) but were not
+    posted by `stash schedule run` yet, for the given accounts or all of
+    them. Nothing is written, they are computed from the schedules on every
+    call. Occurrences a run already put in the ledger, but did not get to
+    note, are left out.
+    '''
+
+    before = min(datetime.now(), before) if before is not None else datetime.now()
+    transactions = {}
+
+    for schedule in load(ledger_path)["schedules"]:
+        if account_ids is not None and schedule["account"] not in account_ids:
+            continue
+
+        for _, moment in due(schedule, before):
+            transaction = make_transaction(schedule, moment)
+            if backend.get_transaction(schedule["account"], transaction["transaction_id"]) is None:
+                transactions.setdefault(schedule["account"], []).append(dict(transaction, pending=True))
+
+    for account_transactions in transactions.values():
+        account_transactions.sort(key=lambda transaction: transaction["transaction_id"])
+    return transactions
+
+def describe(schedule: dict) -> str:
+    if schedule["interval"] == 1:
+        return f"every {schedule['every']}"
+    return f"every {schedule['interval']} {schedule['every']}s"
+
+
+# -------------------- SCHEDULE COMMANDS --------------------
+@click.group()
+@click.pass_context
+def schedule(ctx):
+    '''
+    Defines recurring postings and posts them when they are due.
+
+    A schedule posts the same credit or debit to an account every N days,
+    weeks, months or years, e.g. a salary or the rent. `stash schedule run`
+    (e.g. from cron) posts every occurrence that is due with a single write.
+    Until then, balances and statements already show them as pending.
+    '''
+    ctx.ensure_object(dict)
+    tracing.label(ctx.invoked_subcommand)
+
+    if not ctx.obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+@schedule.command()
+@click.argument("id", type=click.STRING)
+@click.argument("amount", type=click.FloatRange(min=0, min_open=True))
+@click.option("--type", "transaction_type", type=click.Choice(["credit", "debit"], case_sensitive=False), default="credit", help="Post a credit or a debit. Defaults to credit.")
+@click.option("--every", type=click.Choice(PERIODS), required=True, help="The period of the schedule.")
+@click.option("--interval", type=click.IntRange(min=1), default=1, help="Post every INTERVAL periods, e.g. --every week --interval 2. Defaults to 1.")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Date of the first posting (YYYY-MM-DD). Defaults to today.")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="No postings after this date (YYYY-MM-DD). Defaults to none.")
+@click.option("--time", "at", type=click.DateTime(formats=["%H:%M:%S", "%H:%M"]), default="09:00", help="Time of day of the postings (HH:MM). Defaults to 09:00.")
+@click.option("--description", "--desc", default=None, help="A short description for the transactions.")
+@click.pass_obj
+def add(obj: dict, id: str, amount: float, transaction_type: str, every: str, interval: int, start, until, at, description: str | None):
+    '''
+    Adds a recurring posting to an account.
+
+    ID is the unique ID of the account, AMOUNT the money posted each time.
+    '''
+
+    backend = backends.get_backend(obj)
+    account = backend.get_account(id, transactions=False)
+    if account is None:
+        click.echo(f"{click.style('ERROR:', bg='red')} Account not found. Please re-check the account ID.")
+        return
+
+    start = start or datetime.now()
+    if not ids.is_supported(start):
+        raise click.BadParameter(f"must be {ids.FIRST_MOMENT:%Y-%m-%d} or later.", param_hint="--start")
+    if until is not None and until < start.replace(hour=0, minute=0, second=0, microsecond=0):
+        raise click.BadParameter("must not be before the start.", param_hint="--until")
+
+    transaction_type = transaction_type.upper()
+    if description is None:
+        description = "Amount CREDITED." if transaction_type == "CREDIT" else "Amount DEBITED."
+
+    ledger_path = obj["path"]
+    with locking.lock(lock_path(ledger_path)):
+        data = load(ledger_path)
+        new_schedule = {
+            "number": data["next"],
+            "account": id,
+            "type": transaction_type,
+            "amount": round(amount, 2),
+            "description": description,
+            "every": every,
+            "interval": interval,
+            "start": start.strftime("%Y-%m-%d"),
+            "until": until.strftime("%Y-%m-%d") if until else None,
+            "time": at.strftime("%H:%M:%S"),
+            # Occurrences posted so far
+            "posted": 0
+        }
+        data["next"] += 1
+        data["schedules"].append(new_schedule)
+        save(ledger_path, data)
+
+    colour = "green" if transaction_type == "CREDIT" else "red"
+    click.echo(click.style("The following schedule was added successfully:", fg="green"))
+    click.echo(tabulate.tabulate(
+        [
+            [click.style("Schedule", fg="cyan"), new_schedule["number"]],
+            [click.style("Account", fg="cyan"), id],
+            [click.style("Description", fg="cyan"), description],
+            [click.style("Type", fg="cyan"), click.style(transaction_type, fg=colour)],
+            [click.style("Amount", fg="cyan"), click.style(f"{obj['currency']} {new_schedule['amount']}", fg=colour)],
+            [click.style("Repeats", fg="cyan"), describe(new_schedule)],
+            [click.style("First posting", fg="cyan"), f"{new_schedule['start']} {new_schedule['time']}"],
+            [click.style("Last posting", fg="cyan"), new_schedule["until"] or "-"]
+        ],
+        tablefmt="grid"
+    ))
+
+@schedule.command(name="list")
+@click.pass_obj
+def list_(obj: dict):
+    '''
+    Lists every schedule with its next posting and how many are due.
+    '''
+
+    schedules = load(obj["path"])["schedules"]
+    if not schedules:
+        click.echo(f"{click.style('INFO:', bg='blue')} There are no schedules. You can add one with {click.style('stash schedule add', fg='yellow')}")
+        return
+
+    now = datetime.now()
+    currency = obj["currency"]
+    rows = []
+    for item in schedules:
+        due_now = len(due(item, now))
+        upcoming = occurrence(item, item["posted"] + due_now)
+        ended = item["until"] is not None and upcoming.strftime("%Y-%m-%d") > item["until"]
+        colour = "green" if item["type"] == "CREDIT" else "red"
+        rows.append([
+            item["number"],
+            item["account"],
+            item["description"],
+            click.style(item["type"], fg=colour),
+            click.style(f"{currency} {item['amount']}", fg=colour),
+            describe(item),
+            item["posted"],
+            click.style(str(due_now), fg="yellow" if due_now else None),
+            "-" if ended else upcoming.strftime("%Y-%m-%d %H:%M")
+        ])
+
+    with tracing.phase("rendering"):
+        rendered = tabulate.tabulate(rows, ["schedule", "account", "description", "type", "amount", "repeats", "posted", "due", "next"], tablefmt="grid")
+
+    click.echo(click.style("Here are all schedules", fg="yellow"))
+    click.echo(rendered)
+
+@schedule.command()
+@click.argument("number", type=click.INT)
+@click.pass_obj
+def delete(obj: dict, number: int):
+    '''
+    Removes a schedule. Transactions it already posted are kept.
+
+    NUMBER is the number of the schedule, see `stash schedule list`.
+    '''
+
+    ledger_path = obj["path"]
+    with locking.lock(lock_path(ledger_path)):
+        data = load(ledger_path)
+        found = next((item for item in data["schedules"] if item["number"] == number), None)
+        if found is None:
+            click.echo(f"{click.style('ERROR:', bg='red')} Schedule not found. Please re-check the number with `stash schedule list`.")
+            return
+
+        if not click.confirm(f"Do you want to proceed to delete schedule {number} ({describe(found)}, {found['description']})?"):
+            click.echo(click.style("Schedule was not removed.", fg="yellow"))
+            return
+
+        data["schedules"].remove(found)
+        save(ledger_path, data)
+
+    click.echo(click.style(f"Schedule {number} removed successfully", fg="green"))
+
+@schedule.command()
+@click.pass_obj
+def run(obj: dict):
+    '''
+    Posts every occurrence that is due, of every schedule, with a single write.
+
+    Occurrences missed since the last run (e.g. while the computer was off)
+    are caught up in the same write, dated when they were due. Meant to be
+    run regularly, e.g. every hour from cron.
+    '''
+
+    start = time.perf_counter()
+    ledger_path = obj["path"]
+
+    with locking.lock(lock_path(ledger_path)):
+        data = load(ledger_path)
+        backend = backends.get_backend(obj)
+        now = datetime.now()
+
+        due_schedules = [(item, due(item, now)) for item in data["schedules"]]
+        due_schedules = [(item, occurrences) for item, occurrences in due_schedules if occurrences]
+        if not due_schedules:
+            click.echo(f"{click.style('INFO:', bg='blue')} Nothing is due.")
+            return
+
+        existing = {account["id"] for account in backend.accounts()}
+        postings = {}
+        skipped = []
+        for item, occurrences in due_schedules:
+            if item["account"] not in existing:
+                skipped.append(item)
+                continue
+
+            for _, moment in occurrences:
+                transaction = make_transaction(item, moment)
+                # Posted by a run that was interrupted before it could note it
+                if backend.get_transaction(item["account"], transaction["transaction_id"]) is None:
+                    postings.setdefault(item["account"], []).append(transaction)
+
+        # One write for every occurrence of every account
+        with backend.batch():
+            for account_id, transactions in postings.items():
+                transactions.sort(key=lambda transaction: transaction["transaction_id"])
+                backend.add_transactions(account_id, transactions)
+
+        for item, occurrences in due_schedules:
+            if item not in skipped:
+                item["posted"] = occurrences[-1][0] + 1
+        save(ledger_path, data)
+
+    posted = sum(len(transactions) for transactions in postings.values())
+    click.echo(click.style(f"Posted {posted} scheduled transaction(s) in one commit.", fg="green"))
+    click.echo(f"-- Accounts: {click.style(str(len(postings)), fg='cyan')}, schedules: {click.style(str(len(due_schedules) - len(skipped)), fg='cyan')}")
+    if skipped:
+        click.echo(f"-- Skipped schedules of deleted accounts: {click.style(', '.join(str(item['number']) for item in skipped), fg='yellow')}")
+    click.echo(f"-- Time: {click.style(f'{time.perf_counter() - start:.2f}s', fg='cyan')}")
@@ -0,0 +1,411 @@
+import os
+import re
+import sys
+import bisect
+from array import array
+import click
+from stash_basic import backends, columns, journal, statements, tracing, utils
+
+
+# -------------------- INDEX SETTINGS --------------------
+# The index lives next to the ledger in <ledger>.search and can always be rebuilt from it
+INDEX_SUFFIX = ".search"
+MAGIC = b"STASHS01"
+
+# Rebuild the index from scratch once most of it belongs to deleted transactions
+REBUILD_MIN_DEAD = 1000
+
+# Re-sort the amount and date indexes instead of inserting when this share of the documents is new
+RESORT_SHARE = 8
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def index_path(ledger_path: str) -> str:
+    return ledger_path + INDEX_SUFFIX
+
+def tokenize(text: str) -> set:
+
+    '''
+    Returns the lower-case words of a description.
+    '''
+
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+def ledger_signature(ledger_path: str) -> tuple:
+
+    '''
+    Returns the signatures of every file a write to the ledger changes,
+    whatever the backend: the data file, its journal, the SQLite
+    write-ahead log and the account index of a sharded ledger.
+    '''
+
+    paths = [ledger_path, journal.journal_path(ledger_path), ledger_path + "-wal"]
+    if os.path.isdir(ledger_path):
+        paths.append(os.path.join(ledger_path, backends.SHARD_INDEX))
+
+    return tuple(utils.file_signature(path) for path in paths)
+
+def day_number(transaction_date: str) -> int:
+    # DD-MM-YYYY -> YYYYMMDD, which orders like the dates
+    return int(transaction_date[6:] + transaction_date[3:5] + transaction_date[:2])
+
+
+class PostingLists:
+
+    '''
+    Maps keys (description words, account IDs) to arrays of document numbers.
+
+    On disk all lists are one block of bytes plus the sorted keys and their
+    offsets, so loading the index does not create an object per key. A list
+    is only unpacked when a query or an update uses it.
+    '''
+
+    def __init__(self, packed: tuple | None = None):
+        self.lists = {}
+        self.keys, self.offsets, self.blob = [], array("q", [0]), b""
+
+        if packed is not None:
+            keys, offsets, self.blob = packed
+            self.keys = keys.split(columns.PACK_SEPARATOR) if keys else []
+            self.offsets = array("q", offsets)
+
+    def get(self, key: str) -> array:
+
+        '''
+        Returns the (modifiable) list of a key, empty if it has none.
+        '''
+
+        docs = self.lists.get(key)
+        if docs is None:
+            docs = self.lists[key] = array("l")
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                docs.frombytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+        return docs
+
+    def pack(self) -> tuple:
+        lists = {key: self.blob[self.offsets[i]:self.offsets[i + 1]] for i, key in enumerate(self.keys) if key not in self.lists}
+        lists.update((key, docs.tobytes()) for key, docs in self.lists.items())
+
+        keys = sorted(key for key, docs in lists.items() if docs)
+        offsets = array("q", [0])
+        for key in keys:
+            offsets.append(offsets[-1] + len(lists[key]))
+        return columns.PACK_SEPARATOR.join(keys), offsets.tobytes(), b"".join(lists[key] for key in keys)
+
+
+class SearchIndex:
+
+    '''
+    Index of all transactions of a ledger. Every transaction is a document
+    with a number; its account, ID, amount, date, time, type and description
+    are kept in columns so results are shown without reading the ledger.
+
+    - description word -> numbers of the documents that contain it
+    - amounts and dates in sorted arrays, with the matching document numbers
+
+    The index is brought up to date incrementally: transactions appended to
+    an account since the last sync are added, accounts that changed in any
+    other way are re-indexed. Documents of deleted transactions stay behind
+    as dead entries until the next rebuild.
+    '''
+
+    def __init__(self):
+        self.signature = None
+        self.accounts = {}
+        self.account_docs = PostingLists()
+        self.doc_accounts = []
+        self.doc_ids = array("q")
+        self.doc_cents = array("q")
+        self.doc_days = array("l")
+        self.doc_seconds = array("l")
+        self.doc_debits = array("b")
+        self.doc_descriptions = []
+        self.alive = bytearray()
+        self.dead = 0
+        self.terms = PostingLists()
+        self.amount_keys = array("q")
+        self.amount_docs = array("l")
+        self.day_keys = array("l")
+        self.day_docs = array("l")
+
+    # ----- PERSISTENCE -----
+    ARRAYS = ("doc_ids", "doc_cents", "doc_days", "doc_seconds", "doc_debits", "amount_keys", "amount_docs", "day_keys", "day_docs")
+
+    @classmethod
+    def load(cls, ledger_path: str) -> "SearchIndex":
+
+        '''
+        Reads the index of a ledger, or returns an empty one if there is none
+        or it cannot be read.
+        '''
+
+        index = cls()
+        with tracing.phase("index read"):
+            data = utils.load_sidecar(index_path(ledger_path), MAGIC)
+        if data is None:
+            return index
+
+        for name in cls.ARRAYS:
+            getattr(index, name).frombytes(data.pop(name))
+        index.account_docs = PostingLists(data.pop("account_docs"))
+        index.terms = PostingLists(data.pop("terms"))
+        index.alive = bytearray(data.pop("alive"))
+        index.signature = data.pop("signature")
+        index.accounts = data.pop("accounts")
+        index.doc_accounts = data.pop("doc_accounts")
+        index.doc_descriptions = data.pop("doc_descriptions")
+        if isinstance(index.doc_descriptions, str):
+            index.doc_descriptions = index.doc_descriptions.split(columns.PACK_SEPARATOR) if index.doc_ids else []
+        index.dead = data.pop("dead")
+
+        return index
+
+    def save(self, ledger_path: str) -> None:
+
+        '''
+        Writes the index next to the ledger. It is not synced to disk, a lost
+        index is rebuilt on the next search.
+        '''
+
+        with tracing.phase("serialization"):
+            # Like TransactionColumns.pack(), one string splits faster than a list of strings loads
+            descriptions = columns.PACK_SEPARATOR.join(self.doc_descriptions)
+            if descriptions.count(columns.PACK_SEPARATOR) != max(len(self.doc_descriptions) - 1, 0):
+                descriptions = self.doc_descriptions
+
+            data = {name: getattr(self, name).tobytes() for name in self.ARRAYS}
+            data.update(
+                account_docs=self.account_docs.pack(),
+                terms=self.terms.pack(),
+                alive=bytes(self.alive),
+                signature=self.signature,
+                accounts=self.accounts,
+                doc_accounts=self.doc_accounts,
+                doc_descriptions=descriptions,
+                dead=self.dead
+            )
+
+        with tracing.phase("index write"):
+            utils.save_sidecar(index_path(ledger_path), MAGIC, data)
+
+    # ----- UPDATES -----
+    def _add(self, account_id: str, transactions: list) -> list:
+        account_id = sys.intern(account_id)
+        docs = self.account_docs.get(account_id)
+        added = []
+
+        for transaction in transactions:
+            doc = len(self.doc_ids)
+            self.doc_accounts.append(account_id)
+            self.doc_ids.append(transaction["transaction_id"])
+            self.doc_cents.append(utils.to_cents(transaction["amount"]))
+            self.doc_days.append(day_number(transaction["date"]))
+            self.doc_seconds.append(int(transaction["time"][:2]) * 3600 + int(transaction["time"][3:5]) * 60 + int(transaction["time"][6:8]))
+            self.doc_debits.append(transaction["type"] == "DEBIT")
+            self.doc_descriptions.append(sys.intern(transaction["description"]))
+            self.alive.append(1)
+
+            for term in tokenize(transaction["description"]):
+                self.terms.get(term).append(doc)
+
+            docs.append(doc)
+            added.append(doc)
+
+        return added
+
+    def _remove_account(self, account_id: str) -> None:
+        docs = self.account_docs.get(account_id)
+        for doc in docs:
+            self.alive[doc] = 0
+        self.dead += len(docs)
+        del docs[:]
+        self.accounts.pop(account_id, None)
+
+    def _insert_sorted(self, keys: array, docs: array, column: array, new_docs: list) -> tuple:
+        if len(new_docs) * RESORT_SHARE > len(keys):
+            # Cheaper to sort everything that is alive again
+            order = sorted((doc for doc in range(len(column)) if self.alive[doc]), key=column.__getitem__)
+            return array(keys.typecode, [column[doc] for doc in order]), array("l", order)
+
+        for doc in new_docs:
+            position = bisect.bisect_right(keys, column[doc])
+            keys.insert(position, column[doc])
+            docs.insert(position, doc)
+        return keys, docs
+
+    def sync(self, backend: backends.Backend, signature: tuple) -> bool:
+
+        '''
+        Brings the index up to date with the ledger. Returns False if the
+        ledger did not change since the last sync, without reading it.
+        '''
+
+        if signature == self.signature:
+            return False
+
+        if self.dead >= REBUILD_MIN_DEAD and self.dead * 2 > len(self.doc_ids):
+            self.__init__()
+
+        with tracing.phase("index sync"):
+            new_docs = []
+            seen = set()
+
+            for account in backend.accounts():
+                account_id = account["id"]
+                seen.add(account_id)
+                state = self.accounts.get(account_id)
+                tail = None
+
+                if state is not None:
+                    count, last_id, balance = state
+                    tail = backends.appended_since(backend, account_id, count, last_id)
+                    if count and tail is not None:
+                        expected = utils.to_cents(balance) + sum(utils.signed_cents(transaction) for transaction in tail)
+                        if expected != utils.to_cents(account["balance"]):
+                            tail = None
+
+                if tail is None:
+                    # New account or changed in some other way than by appending
+                    self._remove_account(account_id)
+                    tail = list(backend.iter_transactions(account_id))
+                    count = 0
+
+                new_docs += self._add(account_id, tail)
+                count += len(tail)
+                last_id = tail[-1]["transaction_id"] if tail else (state[1] if state and count else None)
+                self.accounts[account_id] = (count, last_id, account["balance"])
+
+            for account_id in set(self.accounts) - seen:
+                self._remove_account(account_id)
+
+            if new_docs:
+                self.amount_keys, self.amount_docs = self._insert_sorted(self.amount_keys, self.amount_docs, self.doc_cents, new_docs)
+                self.day_keys, self.day_docs = self._insert_sorted(self.day_keys, self.day_docs, self.doc_days, new_docs)
+
+        self.signature = signature
+        return True
+
+    # ----- QUERIES -----
+    def _range(self, keys: array, docs: array, low, high) -> array:
+        start = 0 if low is None else bisect.bisect_left(keys, low)
+        end = len(keys) if high is None else bisect.bisect_right(keys, high)
+        return docs[start:end]
+
+    def query(self, words: list, account_id: str | None = None, transaction_type: str | None = None, min_cents: int | None = None, max_cents: int | None = None, since: int | None = None, until: int | None = None) -> list:
+
+        '''
+        Returns the numbers of the documents that match every given filter,
+        ordered by date and time. Words must all appear in the description.
+
+        The candidates come from the most selective index (a word, the
+        amount range, the date range or the account); only those are
+        checked against the other filters.
+        '''
+
+        terms = set(word for text in words for word in tokenize(text))
+        sources = []
+
+        with tracing.phase("index query"):
+            for term in terms:
+                sources.append(self.terms.get(term))
+            if account_id is not None:
+                sources.append(self.account_docs.get(account_id))
+            if min_cents is not None or max_cents is not None:
+                sources.append(self._range(self.amount_keys, self.amount_docs, min_cents, max_cents))
+            if since is not None or until is not None:
+                sources.append(self._range(self.day_keys, self.day_docs, since, until))
+
+            candidates = min(sources, key=len) if sources else range(len(self.doc_ids))
+            debit = None if transaction_type is None else transaction_type == "DEBIT"
+
+            matches = [
+                doc for doc in candidates
+                if self.alive[doc]
+                and (account_id is None or self.doc_accounts[doc] == account_id)
+                and (debit is None or self.doc_debits[doc] == debit)
+                and (min_cents is None or self.doc_cents[doc] >= min_cents)
+                and (max_cents is None or self.doc_cents[doc] <= max_cents)
+                and (since is None or self.doc_days[doc] >= since)
+                and (until is None or self.doc_days[doc] <= until)
+                and (not terms or terms <= tokenize(self.doc_descriptions[doc]))
+            ]
+
+            matches.sort(key=lambda doc: (self.doc_days[doc], self.doc_seconds[doc], doc))
+
+        return matches
+
+    def transaction(self, doc: int) -> dict:
+
+        '''
+        Returns a document as a transaction with its account_id.
+        '''
+
+        day, seconds = self.doc_days[doc], self.doc_seconds[doc]
+        return {
+            "account_id": self.doc_accounts[doc],
+            "transaction_id": self.doc_ids[doc],
+            "date": f"{day % 100:02d}-{day // 100 % 100:02d}-{day // 10000}",
+            "time": f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}",
+            "description": self.doc_descriptions[doc],
+            "type": "DEBIT" if self.doc_debits[doc] else "CREDIT",
+            "amount": utils.from_cents(self.doc_cents[doc])
+        }
+
+
+# -------------------- SEARCH COMMAND --------------------
+@click.command()
+@click.argument("words", nargs=-1)
+@click.option("--account", "account_id", default=None, help="Only search the transactions of this account.")
+@click.option("--type", "transaction_type", type=click.Choice(["credit", "debit"], case_sensitive=False), default=None, help="Only show credits or debits.")
+@click.option("--min", "min_amount", type=click.FLOAT, default=None, help="Only show transactions of at least this amount.")
+@click.option("--max", "max_amount", type=click.FLOAT, default=None, help="Only show transactions of at most this amount.")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only show transactions on or after this date (YYYY-MM-DD).")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Only show transactions on or before this date (YYYY-MM-DD).")
+@click.option("--limit", type=click.IntRange(min=0), default=None, help="Show at most this many transactions.")
+@click.option("--format", "output_format", type=click.Choice(["table", "csv", "jsonl"]), default="table", help="Output format. Defaults to table.")
+@click.pass_obj
+def search(obj: dict, words: tuple, account_id: str | None, transaction_type: str | None, min_amount: float | None, max_amount: float | None, since, until, limit: int | None, output_format: str):
+    '''
+    Finds transactions by description, type, amount and date.
+
+    WORDS must all appear in the description (case-insensitive, whole
+    words). Without any filter every transaction is listed. Results are
+    ordered by date and cover all accounts unless --account is given.
+
+    The search uses an index next to the ledger that is updated with the
+    changes since the last search, so it never scans every transaction.
+    Transactions archived by `stash compact` are not searched.
+    '''
+
+    ledger_path = obj["path"]
+    index = SearchIndex.load(ledger_path)
+
+    # Only read the ledger if it changed since the index was last updated
+    if index.sync(backends.get_backend(obj), ledger_signature(ledger_path)):
+        index.save(ledger_path)
+
+    matches = index.query(
+        list(words),
+        account_id=account_id,
+        transaction_type=transaction_type.upper() if transaction_type else None,
+        min_cents=utils.to_cents(min_amount) if min_amount is not None else None,
+        max_cents=utils.to_cents(max_amount) if max_amount is not None else None,
+        since=int(since.strftime("%Y%m%d")) if since else None,
+        until=int(until.strftime("%Y%m%d")) if until else None
+    )
+
+    found = len(matches)
+    if limit is not None:
+        matches = matches[:limit]
+    transactions = (index.transaction(doc) for doc in matches)
+
+    if output_format == "csv":
+        statements.emit(statements.render_csv(transactions, statements.ACCOUNT_TRANSACTION_FIELDS), False)
+    elif output_format == "jsonl":
+        statements.emit(statements.render_jsonl(transactions, statements.ACCOUNT_TRANSACTION_FIELDS), False)
+    elif not matches:
+        click.echo(f"{click.style('INFO:', bg='blue')} No transactions match the search.")
+    else:
+        statements.emit(statements.render_table(transactions, obj["currency"], account_column=True), False)
+        click.echo(f"-- Matches: {click.style(str(found), fg='cyan')}" + (f" (showing {len(matches)})" if len(matches) < found else ""))
@@ -0,0 +1,400 @@
+import os
+import json
+import signal
+import socket
+import asyncio
+import click
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from stash_basic import backends, columns, tracing
+
+
+# -------------------- SERVER SETTINGS --------------------
+FLUSH_INTERVAL = 0.005
+CONNECT_TIMEOUT = 1.0
+MAX_REQUEST_BYTES = 1 << 30
+
+# Backend methods that change the ledger, these are batched by the server
+WRITE_METHODS = {"add_account", "delete_account", "add_transaction", "add_transactions", "delete_transaction", "load", "repair_balances"}
+READ_METHODS = {"accounts", "get_account", "get_transaction", "transactions_page", "dump", "recompute_balances"}
+PAGE_SIZE = 1000
+
+def socket_path(obj: dict) -> str:
+
+    '''
+    Returns the path of the Unix socket the server listens on, next to the ledger.
+    '''
+
+    return obj["path"] + backends.SOCKET_SUFFIX
+
+def is_supported() -> bool:
+
+    '''
+    Returns True if the platform has Unix sockets (i.e. not Windows).
+    '''
+
+    return hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+def _open_socket(obj: dict) -> socket.socket | None:
+    path = socket_path(obj)
+    if not is_supported() or not os.path.exists(path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CONNECT_TIMEOUT)
+    try:
+        client.connect(path)
+    except OSError:
+        # Stale socket file of a server that is gone
+        client.close()
+        return None
+
+    client.settimeout(None)
+    return client
+
+def is_running(obj: dict) -> bool:
+
+    '''
+    Returns True if a server for the configured ledger accepts connections.
+    '''
+
+    client = _open_socket(obj)
+    if client is None:
+        return False
+
+    client.close()
+    return True
+
+def connect(obj: dict):
+
+    '''
+    Returns a RemoteBackend connected to the running server, or None when no
+    server is running for the configured ledger.
+    '''
+
+    client = _open_socket(obj)
+    return RemoteBackend(obj, client) if client is not None else None
+
+
+# -------------------- CLIENT --------------------
+class RemoteError(Exception):
+
+    '''
+    Raised on the client for an error the server hit while handling a request.
+    '''
+
+
+class RemoteBackend(backends.Backend):
+
+    '''
+    Forwards every backend call to `stash serve` over its Unix socket, one JSON
+    line per request and response. Changes made inside batch() are sent as a
+    single request and committed by the server in one write; if one of them
+    fails on the server, none of them is written.
+    '''
+
+    name = "remote"
+
+    def __init__(self, obj: dict, client: socket.socket):
+        super().__init__(obj)
+        self._client = client
+        self._stream = client.makefile("rwb")
+        self._calls = None
+
+    def _call(self, method: str, *args):
+        if self._calls is not None and method in WRITE_METHODS:
+            self._calls.append([method, list(args)])
+            return None
+
+        return self._send({"method": method, "args": list(args)})
+
+    def _send(self, request: dict):
+        with tracing.phase("server call"):
+            self._stream.write(json.dumps(request, ensure_ascii=True, default=columns.to_json).encode() + b"\n")
+            self._stream.flush()
+            line = self._stream.readline()
+
+        if not line:
+            raise RemoteError("The stash server closed the connection.")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RemoteError(response["error"])
+        return response["result"]
+
+    def accounts(self) -> list:
+        return self._call("accounts")
+
+    def get_account(self, account_id: str, transactions: bool = True) -> dict | None:
+        return self._call("get_account", account_id, transactions)
+
+    def add_account(self, account: dict) -> None:
+        return self._call("add_account", account)
+
+    def delete_account(self, account_id: str) -> None:
+        return self._call("delete_account", account_id)
+
+    def get_transaction(self, account_id: str, transaction_id: int) -> dict | None:
+        return self._call("get_transaction", account_id, transaction_id)
+
+    def add_transactions(self, account_id: str, transactions: list) -> float:
+        return self._call("add_transactions", account_id, transactions)
+
+    def delete_transaction(self, account_id: str, transaction_id: int) -> float:
+        return self._call("delete_transaction", account_id, transaction_id)
+
+    def iter_transactions(self, account_id: str, since: str | None = None, until: str | None = None, offset: int = 0, limit: int | None = None):
+        # Fetch PAGE_SIZE transactions per round trip
+        while limit is None or limit > 0:
+            size = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit)
+            page = self._call("transactions_page", account_id, since, until, offset, size)
+            yield from page
+
+            if len(page) < size:
+                break
+            offset += size
+            if limit is not None:
+                limit -= size
+
+    def dump(self) -> list:
+        return self._call("dump")
+
+    def load(self, contents: list) -> None:
+        return self._call("load", contents)
+
+    def rewrite(self, function) -> None:
+        # The function cannot be sent over the socket
+        raise RemoteError("The whole ledger cannot be rewritten through `stash serve`, stop the server first.")
+
+    def recompute_balances(self) -> dict:
+        return self._call("recompute_balances")
+
+    def repair_balances(self, account_ids: list) -> dict:
+        return self._call("repair_balances", account_ids)
+
+    @contextmanager
+    def batch(self):
+        if self._calls is not None:
+            yield self
+            return
+
+        self._calls = []
+
+        try:
+            yield self
+        except BaseException:
+            self._calls = None
+            raise
+
+        calls, self._calls = self._calls, None
+
+        if calls:
+            self._send({"method": "batch", "args": [calls]})
+
+    def close(self) -> None:
+        self._stream.close()
+        self._client.close()
+
+
+# -------------------- SERVER --------------------
+class Server:
+
+    '''
+    Holds one backend (and with it the parsed, indexed ledger) in memory and
+    answers requests from RemoteBackend clients.
+
+    Reads are answered right away. Writes are queued and flushed together
+    every FLUSH_INTERVAL seconds inside one backend batch, i.e. with a single
+    durable write, and each client only gets its answer after that write. The
+    writes of one request are applied all or not at all.
+
+    The backend is only used from one worker thread, so the event loop keeps
+    reading requests while a batch is written and synced to disk.
+    '''
+
+    def __init__(self, obj: dict, flush_interval: float):
+        self.obj = obj
+        self.backend = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stash-backend")
+        self.flush_interval = flush_interval
+        self.queue = []
+        self.flush_task = None
+        self.stats = {"requests": 0, "flushes": 0}
+
+    def run(self, function, *args) -> asyncio.Future:
+
+        '''
+        Calls function(*args) on the backend thread, one call after the other.
+        '''
+
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def read(self, method: str, args: list):
+        self.backend.refresh()
+        if method == "transactions_page":
+            return list(self.backend.iter_transactions(*args))
+        return getattr(self.backend, method)(*args)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                try:
+                    response = {"result": await self.dispatch(json.loads(line))}
+                except Exception as error:
+                    response = {"error": f"{type(error).__name__}: {error}"}
+
+                writer.write(json.dumps(response, ensure_ascii=True, default=columns.to_json).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: dict):
+        self.stats["requests"] += 1
+        method, args = request["method"], request.get("args", [])
+
+        if method in READ_METHODS:
+            return await self.run(self.read, method, args)
+
+        if method == "batch":
+            calls = args[0]
+        elif method in WRITE_METHODS:
+            calls = [[method, args]]
+        else:
+            raise ValueError(f"unknown method {method!r}")
+
+        # Queue the write and wait until it is on disk
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((calls, future))
+
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+        results = await future
+        return results[-1] if method != "batch" else None
+
+    async def flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+
+        '''
+        Applies every queued write in one batch and answers the waiting clients.
+        Writes queued meanwhile go into the next batch.
+        '''
+
+        queue, self.queue, self.flush_task = self.queue, [], None
+        if not queue:
+            return
+
+        outcomes = await self.run(self.write, [calls for calls, _ in queue])
+        self.stats["flushes"] += 1
+
+        for (_, future), outcome in zip(queue, outcomes):
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def write(self, queued: list) -> list:
+
+        '''
+        Runs the calls of every client in one backend batch on the backend
+        thread. Returns each client's results, or the error its calls raised.
+
+        The calls of a client are applied all or not at all: if one of them
+        fails, the batch is thrown away and run again without that client.
+        '''
+
+        outcomes = [None] * len(queued)
+        clients = list(range(len(queued)))
+
+        while True:
+            self.backend.refresh()
+            failed = None
+
+            try:
+                with self.backend.batch():
+                    for client in clients:
+                        try:
+                            outcomes[client] = [getattr(self.backend, method)(*args) for method, args in queued[client]]
+                        except Exception as error:
+                            failed, outcomes[client] = client, error
+                            raise
+            except Exception as error:
+                if failed is None:
+                    # The batch could not be written, nobody's change is on disk
+                    for client in clients:
+                        outcomes[client] = error
+                    return outcomes
+
+                clients.remove(failed)
+                continue
+
+            return outcomes
+
+    async def serve(self, path: str) -> None:
+        # Created on the backend thread, SQLite connections only work in the thread that opened them
+        self.backend = await self.run(lambda: backends.get_backend(self.obj, local=True))
+        server = await asyncio.start_unix_server(self.handle_client, path=path, limit=MAX_REQUEST_BYTES)
+        os.chmod(path, 0o600)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+
+        async with server:
+            await stop.wait()
+
+        # Write whatever is still queued before shutting down
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+        await self.run(self.backend.close)
+        self.executor.shutdown()
+
+
+@click.command()
+@click.option("--flush-interval", default=FLUSH_INTERVAL * 1000, type=click.FLOAT, show_default=True, help="Milliseconds to collect writes before they are flushed to disk together.")
+@click.pass_obj
+def serve(obj: dict, flush_interval: float):
+    '''
+    Runs the Stash server in the foreground.
+
+    The server keeps the ledger in memory and listens on a Unix socket next to
+    the data file. While it is running, all `stash accounts` and `stash
+    transactions` commands talk to it instead of reading the file themselves.
+    Stop it with Ctrl+C.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    if not is_supported():
+        raise click.UsageError("`stash serve` needs Unix sockets, which are not available on this platform.")
+
+    path = socket_path(obj)
+    if is_running(obj):
+        raise click.UsageError(f"A Stash server is already listening on {path}.")
+
+    # Remove the socket file of a server that did not shut down cleanly
+    if os.path.exists(path):
+        os.remove(path)
+
+    click.echo(f"-- Ledger: {click.style(obj['path'], fg='yellow')}")
+    click.echo(f"-- Socket: {click.style(path, fg='yellow')}")
+    click.echo(click.style("Stash server is running. Press Ctrl+C to stop.", fg="green"))
+
+    server = Server(obj, flush_interval / 1000)
+    try:
+        asyncio.run(server.serve(path))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    click.echo(click.style(f"Stash server stopped after {server.stats['requests']} requests and {server.stats['flushes']} flushes.", fg="yellow"))
@@ -0,0 +1,143 @@
+import io
+import csv
+import json
+import click
+from stash_basic import tracing
+
+
+# -------------------- STATEMENT SETTINGS --------------------
+TRANSACTION_FIELDS = ["transaction_id", "date", "time", "description", "type", "amount"]
+ACCOUNT_TRANSACTION_FIELDS = ["account_id"] + TRANSACTION_FIELDS
+PAGE_ROWS = 200
+
+def table_row(transaction: dict, currency: str) -> list:
+
+    '''
+    Returns the coloured table cells for one transaction.
+    '''
+
+    colour = "red" if transaction["type"] == "DEBIT" else "green"
+    # Scheduled postings that are due but not posted yet, see scheduler.pending()
+    description = click.style(f"{transaction['description']} (pending)", fg="yellow") if transaction.get("pending") else transaction["description"]
+    return [
+        transaction["transaction_id"],
+        transaction["date"],
+        transaction["time"],
+        description,
+        click.style(transaction["type"], fg=colour),
+        f"{click.style(currency, fg='cyan')} {click.style(transaction['amount'], fg=colour)}"
+    ]
+
+def _visible_width(cell) -> int:
+    return len(click.unstyle(str(cell)))
+
+def _grid_line(cells: list, widths: list) -> str:
+    parts = []
+    for cell, width in zip(cells, widths):
+        padding = " " * (width - _visible_width(cell))
+        # Numbers are right aligned, like tabulate does
+        parts.append(f"{padding}{cell}" if isinstance(cell, int) else f"{cell}{padding}")
+    return "| " + " | ".join(parts) + " |"
+
+def _grid_border(widths: list, fill: str = "-") -> str:
+    return "+" + "+".join(fill * (width + 2) for width in widths) + "+"
+
+def render_table(transactions, currency: str, balance: float | None = None, account_column: bool = False):
+
+    '''
+    Renders transactions in the same grid layout as tabulate, PAGE_ROWS rows
+    at a time, so output starts right away and only one page is held in
+    memory. Columns are as wide as the widest cell seen so far.
+
+    If balance is given, a final "Total:" row with it is added. With
+    account_column the transactions carry an account_id, shown first.
+    '''
+
+    fields = ACCOUNT_TRANSACTION_FIELDS if account_column else TRANSACTION_FIELDS
+    widths = [len(header) for header in fields]
+    page = []
+    first = True
+
+    def flush(rows: list) -> str:
+        nonlocal first
+
+        with tracing.phase("rendering"):
+            rows = [
+                row if isinstance(row, list) else ([row["account_id"]] if account_column else []) + table_row(row, currency)
+                for row in rows
+            ]
+            for row in rows:
+                for i, cell in enumerate(row):
+                    widths[i] = max(widths[i], _visible_width(cell))
+
+            lines = []
+            if first:
+                lines += [_grid_border(widths), _grid_line(fields, widths), _grid_border(widths, "=")]
+                first = False
+
+            for i, row in enumerate(rows):
+                if i:
+                    lines.append(_grid_border(widths))
+                lines.append(_grid_line(row, widths))
+
+            lines.append(_grid_border(widths))
+            return "\n".join(lines) + "\n"
+
+    for transaction in transactions:
+        page.append(transaction)
+
+        if len(page) == PAGE_ROWS:
+            yield flush(page)
+            page = []
+
+    if balance is not None:
+        total = [""] * len(fields)
+        total[-2] = click.style("Total:", fg="cyan")
+        total[-1] = click.style(f"{currency} {balance}", fg="yellow")
+        page.append(total)
+
+    if page:
+        yield flush(page)
+
+def render_csv(transactions, fields: list = TRANSACTION_FIELDS):
+
+    '''
+    Renders transactions as CSV lines with a header line.
+    '''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(fields)
+
+    for transaction in transactions:
+        writer.writerow([transaction[field] for field in fields])
+
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def render_jsonl(transactions, fields: list = TRANSACTION_FIELDS):
+
+    '''
+    Renders transactions as one JSON object per line.
+    '''
+
+    for transaction in transactions:
+        yield json.dumps({field: transaction[field] for field in fields}, ensure_ascii=False) + "\n"
+
+def emit(chunks, pager: bool) -> None:
+
+    '''
+    Writes rendered chunks to stdout as they are produced, or through the
+    system pager.
+    '''
+
+    if pager:
+        click.echo_via_pager(chunks)
+    else:
+        for chunk in chunks:
+            with tracing.phase("output"):
+                click.echo(chunk, nl=False)
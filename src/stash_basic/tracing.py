@@ -0,0 +1,119 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+
+# -------------------- TRACE SETTINGS --------------------
+TRACE_FORMATS = ["human", "json"]
+
+# The trace of the running command, None unless `stash --trace` is used
+_trace = None
+
+class Trace:
+
+    '''
+    Collects the time spent in each phase of one command. Phases nest: the
+    time of a phase excludes the phases it contains, so the phase times add
+    up to (at most) the total time of the command.
+    '''
+
+    def __init__(self, output_format: str, profile_path: str | None):
+        self.output_format = output_format
+        self.profile_path = profile_path
+        self.command = []
+        self.phases = {}
+        self.stack = []
+        self.started = time.perf_counter()
+        self.profiler = None
+
+        if profile_path:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def report(self) -> dict:
+        return {
+            "command": " ".join(self.command),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "phases": {
+                name: {"ms": round(seconds * 1000, 3), "calls": calls}
+                for name, (seconds, calls) in sorted(self.phases.items(), key=lambda item: -item[1][0])
+            }
+        }
+
+def start(output_format: str = "human", profile_path: str | None = None) -> None:
+
+    '''
+    Starts tracing the current command, optionally under cProfile.
+    '''
+
+    global _trace
+    _trace = Trace(output_format, profile_path)
+
+def label(name: str | None) -> None:
+
+    '''
+    Adds the name of an invoked (sub)command to the traced command line.
+    '''
+
+    if _trace is not None and name:
+        _trace.command.append(name)
+
+@contextmanager
+def phase(name: str):
+
+    '''
+    Times the with-block as the given phase of the traced command. Costs next
+    to nothing when tracing is off.
+    '''
+
+    if _trace is None:
+        yield
+        return
+
+    frame = [time.perf_counter(), 0.0]
+    _trace.stack.append(frame)
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - frame[0]
+        _trace.stack.pop()
+        if _trace.stack:
+            _trace.stack[-1][1] += elapsed
+
+        totals = _trace.phases.setdefault(name, [0.0, 0])
+        totals[0] += elapsed - frame[1]
+        totals[1] += 1
+
+def finish() -> None:
+
+    '''
+    Stops tracing and writes the timings to stderr, as a table or as a single
+    JSON line, and the cProfile statistics to the profile file.
+    '''
+
+    global _trace
+    trace, _trace = _trace, None
+    if trace is None:
+        return
+
+    if trace.profiler is not None:
+        trace.profiler.disable()
+        trace.profiler.dump_stats(trace.profile_path)
+
+    report = trace.report()
+    if trace.output_format == "json":
+        sys.stderr.write(json.dumps(report) + "\n")
+        return
+
+    traced = sum(phase["ms"] for phase in report["phases"].values())
+    lines = [f"-- Trace: stash {report['command']} took {report['total_ms']:.1f} ms"]
+    for name, phase in report["phases"].items():
+        lines.append(f"   {name:<16} {phase['ms']:>10.1f} ms  {phase['calls']:>6} calls")
+    lines.append(f"   {'(untraced)':<16} {report['total_ms'] - traced:>10.1f} ms")
+    if trace.profile_path:
+        lines.append(f"-- Profile written to {trace.profile_path}")
+
+    sys.stderr.write("\n".join(lines) + "\n")
@@ -1,7 +1,23 @@
-import json
 import click
 import tabulate
-from datetime import datetime
+from stash_basic import backends, ids
+
+def new_transaction(transaction_type: str, amount: float, description: str) -> dict:
+
+    '''
+    Creates a CREDIT or DEBIT transaction dated now.
+    '''
+
+    transaction_obj = {}
+    # The ID carries the time the transaction is recorded at, see ids.py
+    transaction_obj["transaction_id"] = ids.new_id()
+    moment = ids.moment_of(transaction_obj["transaction_id"])
+    transaction_obj["date"] = moment.strftime("%d-%m-%Y")
+    transaction_obj["time"] = moment.strftime("%H:%M:%S")
+    transaction_obj["description"] = description
+    transaction_obj["type"] = transaction_type
+    transaction_obj["amount"] = round(amount, 2)
+    return transaction_obj
 
 @click.command()
 @click.argument("id", type=click.STRING)
@@ -17,39 +33,19 @@ def credit(obj: dict, id: str, amount: float, description: str):
     AMOUNT is the money you want to add to the account.
     '''
 
-    # Load contents
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
-
     # Search for the account
-    account_index = -1
-    for i, account in enumerate(contents):
-        if account["id"] == id:
-            account_index = account_index + i + 1
+    backend = backends.get_backend(obj)
+    account = backend.get_account(id, transactions=False)
 
     # Account not found
-    if account_index == -1:
+    if account is None:
         click.echo(f"{click.style('ERROR:', bg="red")} Account not found. Please re-check the account ID.")
     # Account found
     else:
-        transaction_obj = {}
-        timestamp = datetime.now().timestamp()
-        transaction_obj["transaction_id"] = int(timestamp)
-        transaction_obj["date"] = datetime.fromtimestamp(timestamp).strftime("%d-%m-%Y")
-        transaction_obj["time"] = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
-        transaction_obj["description"] = description
-        transaction_obj["type"] = "CREDIT"
-        transaction_obj["amount"] = round(amount, 2)
-
-        # Add transaction row to account
-        contents[account_index]["transactions"].append(transaction_obj)
-
-        # Update balance
-        contents[account_index]["balance"] = round(contents[account_index]["balance"] + amount, 2)
-
-        # Add the contents to file
-        with open(obj["path"], "w") as new_json_file:
-            json.dump(contents, new_json_file, indent=2)
+        transaction_obj = new_transaction("CREDIT", amount, description)
+
+        # Add transaction row to account and update balance
+        balance = backend.add_transaction(id, transaction_obj)
         
         click.echo(click.style("The following transaction was made successfully:", fg="green"))
 
@@ -62,7 +58,7 @@ def credit(obj: dict, id: str, amount: float, description: str):
                 [click.style("Description", fg="cyan"), transaction_obj["description"]],
                 [click.style("Type", fg="cyan"), click.style(transaction_obj["type"], fg="green")],
                 [click.style(f"Amount", fg="cyan"), click.style(f"{obj["currency"]} {transaction_obj["amount"]}", fg="green")],
-                [click.style(f"Balance", fg="cyan"), click.style(f"{obj["currency"]} {contents[account_index]["balance"]}", fg="yellow")]
+                [click.style(f"Balance", fg="cyan"), click.style(f"{obj["currency"]} {balance}", fg="yellow")]
 
             ],
             tablefmt="grid"
@@ -82,39 +78,19 @@ def debit(obj: dict, id: str, amount: float, description: str):
     AMOUNT is the money you want to remove from the account.
     '''
 
-    # Load contents
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
-
     # Search for the account
-    account_index = -1
-    for i, account in enumerate(contents):
-        if account["id"] == id:
-            account_index = account_index + i + 1
+    backend = backends.get_backend(obj)
+    account = backend.get_account(id, transactions=False)
 
     # Account not found
-    if account_index == -1:
+    if account is None:
         click.echo(f"{click.style('ERROR:', bg="red")} Account not found. Please re-check the account ID.")
     # Account found
     else:
-        transaction_obj = {}
-        timestamp = datetime.now().timestamp()
-        transaction_obj["transaction_id"] = int(timestamp)
-        transaction_obj["date"] = datetime.fromtimestamp(timestamp).strftime("%d-%m-%Y")
-        transaction_obj["time"] = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
-        transaction_obj["description"] = description
-        transaction_obj["type"] = "DEBIT"
-        transaction_obj["amount"] = round(amount, 2)
-
-        # Add transaction row to account
-        contents[account_index]["transactions"].append(transaction_obj)
-
-        # Update balance
-        contents[account_index]["balance"] = round(contents[account_index]["balance"] - amount, 2)
-
-        # Add the contents to file
-        with open(obj["path"], "w") as new_json_file:
-            json.dump(contents, new_json_file, indent=2)
+        transaction_obj = new_transaction("DEBIT", amount, description)
+
+        # Add transaction row to account and update balance
+        balance = backend.add_transaction(id, transaction_obj)
         
         click.echo(click.style("The following transaction was made successfully:", fg="green"))
 
@@ -127,7 +103,7 @@ def debit(obj: dict, id: str, amount: float, description: str):
                 [click.style("Description", fg="cyan"), transaction_obj["description"]],
                 [click.style("Type", fg="cyan"), click.style(transaction_obj["type"], fg="red")],
                 [click.style(f"Amount", fg="cyan"), click.style(f"{obj["currency"]} {transaction_obj["amount"]}", fg="red")],
-                [click.style(f"Balance", fg="cyan"), click.style(f"{obj["currency"]} {contents[account_index]["balance"]}", fg="yellow")]
+                [click.style(f"Balance", fg="cyan"), click.style(f"{obj["currency"]} {balance}", fg="yellow")]
 
             ],
             tablefmt="grid"
@@ -145,36 +121,23 @@ def delete(obj: dict, account_id: str, transaction_id: int):
     remove a transaction with a unique TRANSACTION_ID. 
     '''
 
-    # Fetch contents of JSON file
-    with open(obj["path"], "r") as json_file:
-        contents = json.load(json_file)
-    
     # Ensure account with account_id exists
-    account_index = -1
-    for i, account in enumerate(contents):
-        if account["id"] == account_id:
-            account_index += i + 1
-            break
+    backend = backends.get_backend(obj)
+    account = backend.get_account(account_id, transactions=False)
     
     # Account not found
-    if account_index == -1:
+    if account is None:
         click.echo(f"{click.style('ERROR:', bg="red")} Account not found. Please re-check the account ID.")
     # Account found
     else:
-        # Ensure transaction with transaction_id exists
-        transaction_index = -1
-        for trans_index, transaction in enumerate(contents[account_index]["transactions"]):
-            if transaction["transaction_id"] == transaction_id:
-                transaction_index += trans_index + 1
-                break
+        # Ensure transaction with transaction_id exists and retreive it
+        del_transaction = backend.get_transaction(account_id, transaction_id)
         
         # Transaction not found
-        if transaction_index == -1:
+        if del_transaction is None:
            click.echo(f"{click.style('ERROR:', bg="red")} Transaction not found. Please re-check the Transaction ID.") 
         # Transaction found
         else:
-            # Retreive the transaction to delete
-            del_transaction = contents[account_index]["transactions"][transaction_index]
 
             # Display transaction to delete
             click.echo(click.style("The following transaction will be deleted:", fg="cyan"))
@@ -190,19 +153,10 @@ def delete(obj: dict, account_id: str, transaction_id: int):
             # Ask for confirmation
             if click.confirm("Do you want to proceed to delete the above transaction?"):
                
-               # Remove transaction object from transactions
-               contents[account_index]["transactions"].pop(transaction_index)
-
-               # Update balance
-               if del_transaction["type"] == "DEBIT":
-                   contents[account_index]["balance"] = round(contents[account_index]["balance"] + del_transaction["amount"], 2)
-               if del_transaction["type"] == "CREDIT":
-                   contents[account_index]["balance"] = round(contents[account_index]["balance"] - del_transaction["amount"], 2)
-            
-            
-            # Update JSON
-            with open(obj["path"], "w") as new_json_file:
-                json.dump(contents, new_json_file, ensure_ascii=True, indent=2)
-
-            click.echo(click.style(f"Transaction with ID {del_transaction["transaction_id"]} removed successfully from account with ID {contents[account_index]["id"]}", fg="green")) 
+               # Remove transaction object from transactions and update balance
+               backend.delete_transaction(account_id, transaction_id)
+
+               click.echo(click.style(f"Transaction with ID {del_transaction["transaction_id"]} removed successfully from account with ID {account["id"]}", fg="green"))
+            else:
+                click.echo(click.style("Transaction was not removed.", fg="yellow"))
             
\ No newline at end of file
@@ -1,24 +1,44 @@
 import os
+import sys
 import json
+import stat
+import marshal
+import tempfile
 from pathlib import Path
 from datetime import datetime
+from stash_basic import tracing
 
 
 # -------------------- GLOBALS TO SAVE CONFIG --------------------
 CONFIG_DIR = Path(os.getenv("XDG_CONFIG_HOME", Path.home() / ".config")) / "stash"
 CONFIG_FILE = CONFIG_DIR / "config.json"
 
+# Config as last read and the file signature it was read at
+_config_cache = None
+
+# Sidecar files written by another Python version or sidecar format are ignored
+SIDECAR_FORMAT = (1, marshal.version, sys.version_info[:2])
+
 def load_config() -> dict:
 
     '''
-    Loads the configuration object from the JSON file
+    Loads the configuration object from the JSON file. The file is only
+    parsed once per process, later calls return a copy of the cached config
+    unless the file changed.
     '''
 
-    if CONFIG_FILE.exists():
-        with CONFIG_FILE.open() as config_file:
-            return json.load(config_file)
-    
-    return {}
+    global _config_cache
+
+    with tracing.phase("config load"):
+        signature = file_signature(CONFIG_FILE)
+        if signature is None:
+            return {}
+
+        if _config_cache is None or _config_cache[0] != signature:
+            with CONFIG_FILE.open() as config_file:
+                _config_cache = (signature, json.load(config_file))
+
+        return dict(_config_cache[1])
 
 def save_config(config: dict) -> None:
 
@@ -26,46 +46,198 @@ def save_config(config: dict) -> None:
     Saves the configuration object to the JSON file
     '''
 
+    global _config_cache
+
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-    with CONFIG_FILE.open("w") as config_file:
-        json.dump(config, config_file, indent=2)
+    atomic_write(CONFIG_FILE, json.dumps(config, indent=2))
+    _config_cache = (file_signature(CONFIG_FILE), dict(config))
 
-def create_unique_id(full_name:str, dob: datetime):
+def atomic_write(path: str, data: str | bytes) -> None:
 
     '''
-    Create a unique ID by combining full name and dob.
-    Example: firstnamelastname_daymonthyear
+    Replaces the file at path with data so that a crash at any point leaves
+    either the old or the new file behind, never a truncated one.
     '''
 
-    return full_name.replace(" ", "").lower() + "_" + str(dob.day) + str(dob.month) + str(dob.year)
+    replace_file(write_temp_file(path, data), path)
+
+def file_mode(path: str) -> int:
+
+    '''
+    Returns the permissions of the file at path, or those a newly created
+    file gets under the current umask if there is none.
+    '''
+
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def write_temp_file(path: str, data: str | bytes) -> str:
+
+    '''
+    Writes data to a new temporary file in the same directory as path, forces
+    it to disk and returns its path. Pass it to replace_file() afterwards.
+    '''
 
-def is_duplicate_account(contents: list, holder_full_name:str, dob: datetime):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+
+    try:
+        # mkstemp() makes the file private, the replaced file keeps its permissions
+        if os.name != "nt":
+            os.fchmod(fd, file_mode(path))
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as temp_file:
+            with tracing.phase("file write"):
+                temp_file.write(data)
+                temp_file.flush()
+            with tracing.phase("fsync"):
+                os.fsync(temp_file.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return temp_path
+
+def replace_file(temp_path: str, path: str) -> None:
+
+    '''
+    Atomically renames a file written by write_temp_file() over path and makes
+    the rename durable.
+    '''
+
+    os.replace(temp_path, path)
+
+    if os.name != "nt":
+        directory_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            with tracing.phase("fsync"):
+                os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+def load_sidecar(path: str, magic: bytes, header=None):
 
     '''
-    Checks the given list of contents to see if current account in question already exists in contents.
-    Returns True if account already exists contents
-    Returns false if account does not exist in contents
+    Returns the data of a file written by save_sidecar() with the same magic
+    bytes (and header, if given), or None if there is none, it cannot be read
+    or it was written by another Python version or sidecar format.
     '''
 
-    is_duplicate_id = False
+    try:
+        with open(path, "rb") as sidecar_file:
+            if sidecar_file.read(len(magic)) != magic:
+                return None
+
+            file_format, data = marshal.load(sidecar_file)
+            if file_format != SIDECAR_FORMAT:
+                return None
 
-    # Loop through each account
-    for account in contents:
-        
-        # Generate unique ID for current account
-        current_acc_id = create_unique_id(holder_full_name, dob)
+            # The header is checked before the (possibly large) data is read
+            if header is not None:
+                data = marshal.load(sidecar_file) if data == header else None
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
 
-        # Compare unique IDs
-        if current_acc_id == account["id"]:
-            is_duplicate_id = True
-            break
-    
-    if not is_duplicate_id:
-        # Account is not duplicate
-        return False
+    return data
+
+def save_sidecar(path: str, magic: bytes, data, header=None, sync: bool = False) -> None:
+
+    '''
+    Writes data next to the ledger in marshal format, e.g. a cache or an
+    index that is rebuilt when lost. Such files are not synced to disk and
+    failing to write them is ignored, unless sync is set: then the file is
+    written like atomic_write() and errors are raised.
+    '''
+
+    if header is None:
+        contents = magic + marshal.dumps((SIDECAR_FORMAT, data))
     else:
-        # Account is duplicate
-        return True
-    
+        contents = magic + marshal.dumps((SIDECAR_FORMAT, header)) + marshal.dumps(data)
 
+    if sync:
+        atomic_write(path, contents)
+        return
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as sidecar_file:
+            sidecar_file.write(contents)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+def file_signature(path: str) -> tuple | None:
+
+    '''
+    Returns (modification time, size, inode) of a file, or None if it does not
+    exist. Used to notice that another process replaced the file.
+    '''
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def to_cents(amount: float) -> int:
+
+    '''
+    Converts an amount to integer minor units (cents), so sums are exact.
+    '''
+
+    return round(amount * 100)
+
+def from_cents(cents: int) -> float:
+
+    '''
+    Converts integer minor units back to the amount stored in the ledger.
+    '''
+
+    return cents / 100
+
+def signed_cents(transaction: dict) -> int:
+
+    '''
+    Returns the effect a transaction has on the balance of its account in
+    cents, i.e. the amount for a CREDIT and the negative amount for a DEBIT.
+    '''
+
+    if transaction["type"] == "DEBIT":
+        return -to_cents(transaction["amount"])
+
+    return to_cents(transaction["amount"])
+
+def iso_date(date: str) -> str:
+
+    '''
+    Converts a transaction date (DD-MM-YYYY) to YYYY-MM-DD, which sorts and
+    compares correctly as a plain string.
+    '''
+
+    return date[6:] + date[2:6] + date[:2]
+
+def create_unique_id(full_name:str, dob: datetime):
+
+    '''
+    Create a unique ID by combining full name and dob.
+    Example: firstnamelastname_daymonthyear
+    '''
+
+    return full_name.replace(" ", "").lower() + "_" + str(dob.day) + str(dob.month) + str(dob.year)
+
+def is_duplicate_account(backend, holder_full_name:str, dob: datetime):
+
+    '''
+    Checks the given storage backend to see if current account in question already exists.
+    Returns True if account already exists in the backend
+    Returns false if account does not exist in the backend
+    '''
 
+    # Generate unique ID for current account and look it up
+    return backend.get_account(create_unique_id(holder_full_name, dob), transactions=False) is not None
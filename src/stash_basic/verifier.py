@@ -0,0 +1,229 @@
+import json
+import time
+import hashlib
+import click
+import tabulate
+from stash_basic import backends, columns, search, tracing, utils
+
+
+# -------------------- VERIFY SETTINGS --------------------
+# What the last verify found lives next to the ledger in <ledger>.verify and can always be rebuilt
+STATE_SUFFIX = ".verify"
+MAGIC = b"STASHV01"
+
+def state_path(ledger_path: str) -> str:
+    return ledger_path + STATE_SUFFIX
+
+def check_transactions(transactions) -> tuple:
+
+    '''
+    Returns (number of transactions, balance in cents, checksum) of an
+    account's transactions. The checksum is a BLAKE2 digest of their
+    columns, so it changes with any change of a transaction and costs about
+    as much as copying them once.
+    '''
+
+    if not isinstance(transactions, columns.TransactionColumns):
+        transactions = columns.TransactionColumns(transactions)
+
+    digest = hashlib.blake2b(digest_size=16)
+    for column in (transactions.ids, transactions.timestamps, transactions.cents, transactions.debits):
+        digest.update(column.tobytes())
+    digest.update("\x00".join(transactions.descriptions).encode("utf-8"))
+    return len(transactions), transactions.balance_cents(), digest.hexdigest()
+
+def check_shard(shard_path: str) -> tuple:
+
+    '''
+    check_transactions() for the shard of an account. Runs in the worker
+    processes of ShardedBackend.map_shards().
+    '''
+
+    with open(shard_path, "r") as shard_file:
+        return check_transactions(columns.decode(json.load(shard_file)))
+
+def check_sqlite_account(arguments: tuple) -> tuple:
+
+    '''
+    check_transactions() for one account of an SQLite ledger, (database
+    path, account ID). Runs in worker processes, each with its own connection.
+    '''
+
+    database_path, account_id = arguments
+    backend = backends.SqliteBackend({"path": database_path})
+    try:
+        return check_transactions(backend.iter_transactions(account_id))
+    finally:
+        backend.close()
+
+
+class VerifyState:
+
+    '''
+    What the last verify found: the signature of the ledger files and, per
+    account, the stored balance, the signature of its shard (sharded
+    backend), the number of transactions, their balance in cents and their
+    checksum.
+
+    If the ledger files did not change since, nothing is read again. With
+    the sharded backend only accounts whose shard or stored balance changed
+    are read again.
+    '''
+
+    def __init__(self):
+        self.signature = None
+        self.accounts = {}
+
+    @classmethod
+    def load(cls, ledger_path: str) -> "VerifyState":
+
+        '''
+        Reads the state of a ledger, or returns an empty one if there is none
+        or it cannot be read.
+        '''
+
+        state = cls()
+        with tracing.phase("index read"):
+            data = utils.load_sidecar(state_path(ledger_path), MAGIC)
+        if data is None:
+            return state
+
+        state.signature = data["signature"]
+        state.accounts = data["accounts"]
+
+        return state
+
+    def save(self, ledger_path: str) -> None:
+        with tracing.phase("index write"):
+            utils.save_sidecar(state_path(ledger_path), MAGIC, {"signature": self.signature, "accounts": self.accounts})
+
+
+def check_accounts(backend: backends.Backend, accounts: list, state: VerifyState) -> dict:
+
+    '''
+    Returns {account ID: (shard signature, number of transactions, balance
+    in cents, checksum)} for the accounts that have to be read again, i.e.
+    all of them unless the backend is sharded and the shard and the stored
+    balance of an account did not change since the last verify.
+    '''
+
+    if isinstance(backend, backends.ShardedBackend):
+        signatures = {account["id"]: backend.shard_signature(account["id"]) for account in accounts}
+        changed = [
+            account["id"] for account in accounts
+            if account["id"] not in state.accounts or state.accounts[account["id"]][:2] != (account["balance"], signatures[account["id"]])
+        ]
+        results = backend.map_shards(check_shard, changed)
+        return {account_id: (signatures[account_id],) + result for account_id, result in results.items()}
+
+    if isinstance(backend, backends.SqliteBackend):
+        results = backends.parallel_map(check_sqlite_account, {account["id"]: (backend.path, account["id"]) for account in accounts})
+    else:
+        # The ledger is already in memory, handing it to other processes would cost more than checking it
+        results = {account["id"]: check_transactions(backend.get_account(account["id"])["transactions"]) for account in accounts}
+    return {account_id: (None,) + result for account_id, result in results.items()}
+
+
+# -------------------- VERIFY COMMAND --------------------
+@click.command()
+@click.option("--repair", is_flag=True, help="Set every balance that does not match its transactions to the recomputed one.")
+@click.pass_obj
+def verify(obj: dict, repair: bool):
+
+    '''
+    Checks that every stored balance matches its transactions.
+
+    Every account's balance is recomputed in whole cents from its
+    transactions, in worker processes for sharded and SQLite ledgers. A
+    checksum of each account's transactions is kept next to the ledger, so
+    later runs only read what changed since: nothing if the ledger files are
+    unchanged and, with the sharded backend, only the changed shards.
+
+    Exits with status 1 if a balance does not match, unless --repair fixed it.
+    '''
+
+    if not obj:
+        raise click.UsageError("No configuration found – run `stash init` first.")
+
+    if repair:
+        # Imported here, it loads asyncio which nothing else of this module needs
+        from stash_basic import server
+
+        if server.is_running(obj):
+            raise click.UsageError("Stop `stash serve` before repairing the ledger.")
+
+    start = time.perf_counter()
+    ledger_path = obj["path"]
+    # Taken before reading, a write in between is then noticed by the next verify
+    signature = search.ledger_signature(ledger_path)
+    backend = backends.get_backend(obj, local=True)
+    accounts = backend.accounts()
+
+    if not accounts:
+        click.echo(f"{click.style('INFO:', bg='blue')} There are no accounts in stash to verify.")
+        return
+
+    state = VerifyState.load(ledger_path)
+    unchanged = signature == state.signature and set(state.accounts) == {account["id"] for account in accounts}
+
+    checked = {} if unchanged else check_accounts(backend, accounts, state)
+    changed = sum(1 for account_id, result in checked.items() if account_id not in state.accounts or state.accounts[account_id][4] != result[3])
+
+    problems = []
+    accounts_state = {}
+    for account in accounts:
+        if account["id"] in checked:
+            shard_signature, count, cents, checksum = checked[account["id"]]
+        else:
+            _, shard_signature, count, cents, checksum = state.accounts[account["id"]]
+        accounts_state[account["id"]] = (account["balance"], shard_signature, count, cents, checksum)
+
+        # Balances are kept in whole cents, anything else drifted
+        if account["balance"] != utils.from_cents(cents):
+            problems.append((account, cents))
+
+    if problems:
+        currency = obj["currency"]
+        with tracing.phase("rendering"):
+            rendered = tabulate.tabulate(
+                [
+                    [
+                        account["id"],
+                        account["full_name"],
+                        f"{currency} {account['balance']}",
+                        click.style(f"{currency} {utils.from_cents(cents)}", fg="cyan"),
+                        click.style("MISMATCH" if utils.to_cents(account["balance"]) != cents else "DRIFT", fg="red")
+                    ]
+                    for account, cents in problems
+                ],
+                ["id", "full_name", "stored balance", "recomputed balance", "check"],
+                tablefmt="grid"
+            )
+        click.echo(click.style("Accounts whose balance does not match their transactions", fg="yellow"))
+        click.echo(rendered)
+
+    if problems and repair:
+        # Recomputed again as part of the write, so a change since the check above is not undone
+        repaired = backend.repair_balances([account["id"] for account, _ in problems])
+        for account_id, balance in repaired.items():
+            # The account may have changed since it was checked, the next verify reads it again
+            accounts_state[account_id] = (balance, None) + accounts_state[account_id][2:]
+
+    state.signature = signature
+    state.accounts = accounts_state
+    state.save(ledger_path)
+
+    transactions = sum(count for _, count, _, _ in checked.values())
+    click.echo(
+        f"-- Accounts: {click.style(str(len(accounts)), fg='cyan')}, read again: {click.style(str(len(checked)), fg='cyan')} "
+        f"({transactions} transactions), changed since the last verify: {click.style(str(changed), fg='cyan')}"
+    )
+    click.echo(f"-- Time: {time.perf_counter() - start:.2f}s")
+
+    if not problems:
+        click.echo(click.style("All balances match their transactions.", fg="green"))
+    elif repair:
+        click.echo(click.style(f"Repaired {len(problems)} account balance(s).", fg="green"))
+    else:
+        click.echo(f"{click.style('ERROR:', fg='black', bg='red')} {len(problems)} account balance(s) do not match their transactions. Run `stash verify --repair` to fix them.")
+        raise SystemExit(1)
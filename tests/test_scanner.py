@@ -0,0 +1,81 @@
+import json
+import pytest
+from stash_basic import scanner
+
+
+def make_account(number: int, transaction_count: int) -> dict:
+    transactions = [
+        {
+            "transaction_id": 1_000_000 * number + index,
+            "date": f"{index % 28 + 1:02d}-01-2024",
+            "time": "12:00:00",
+            "description": f"Amount CREDITED. é {index}",
+            "type": "CREDIT",
+            "amount": float(index + 1)
+        }
+        for index in range(transaction_count)
+    ]
+    return {
+        "id": f"account_{number}",
+        "full_name": f"Account {number}",
+        "balance": float(sum(transaction["amount"] for transaction in transactions)),
+        "transactions": transactions
+    }
+
+def write_ledger(path, contents: list, compact: bool) -> dict:
+    text, positions = scanner.encode_ledger(contents, compact)
+    path.write_bytes(text.encode("ascii"))
+    return positions
+
+def find_all(path, account_ids: set) -> scanner.AccountRanges:
+    accounts, ranges = scanner.read_accounts(str(path), account_ids)
+    assert {account["id"] for account in accounts} == account_ids
+    return ranges
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_encode_ledger_matches_json_dumps(tmp_path, compact):
+    contents = [make_account(number, number * 3) for number in range(4)]
+    path = tmp_path / "records.json"
+    positions = write_ledger(path, contents, compact)
+
+    data = path.read_bytes()
+    if not compact:
+        assert data == json.dumps(contents, indent=2).encode("ascii")
+    for account in contents:
+        start, end = positions[account["id"]]
+        assert json.loads(data[start:end])["id"] == account["id"]
+
+    assert find_all(path, set(positions)).ranges == positions
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("replaced", [0, 2, 4])
+def test_splice_keeps_other_accounts(tmp_path, compact, replaced):
+    contents = [make_account(number, 5 + number) for number in range(5)]
+    path = tmp_path / "records.json"
+    write_ledger(path, contents, compact)
+    old_data = path.read_bytes()
+    old_ranges = find_all(path, {account["id"] for account in contents})
+
+    # Grow the account, so every later one moves
+    account = make_account(replaced, 12)
+    account_id = account["id"]
+    temp_path, new_ranges = scanner.write_spliced(str(path), old_ranges, {account_id: scanner.encode_account(account, compact)})
+    with open(temp_path, "rb") as temp_file:
+        new_data = temp_file.read()
+
+    # Byte for byte what rewriting the whole ledger gives
+    contents[replaced] = account
+    expected, positions = scanner.encode_ledger(contents, compact)
+    assert new_data == expected.encode("ascii")
+    assert new_ranges.ranges == positions
+
+    shift = (new_ranges.ranges[account_id][1] - new_ranges.ranges[account_id][0]) - (old_ranges.ranges[account_id][1] - old_ranges.ranges[account_id][0])
+    for number, other in enumerate(contents):
+        if number == replaced:
+            continue
+        old_start, old_end = old_ranges.ranges[other["id"]]
+        new_start, new_end = new_ranges.ranges[other["id"]]
+        assert new_data[new_start:new_end] == old_data[old_start:old_end]
+        assert (new_start, new_end) == ((old_start, old_end) if number < replaced else (old_start + shift, old_end + shift))